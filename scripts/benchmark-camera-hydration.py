@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Benchmark camera command endpoints with eager vs lazy Camera hydration.
+
+Every camera endpoint loads its Camera from the database first. Before,
+Camera.from_db_row parsed the registration and status JSON for every
+request; now they are kept as raw JSON until something reads them. This
+drives the command endpoints through Flask's test client (no sockets, so
+only the API's own overhead is measured) with both behaviours and prints
+requests per second.
+
+Cameras are simulated: Camera.send_message returns True immediately.
+
+Usage: benchmark-camera-hydration.py [--requests N] [--cameras N]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'arlo-cam-api')
+
+
+def create_database(path, cameras, messages):
+    with sqlite3.connect(path) as conn:
+        c = conn.cursor()
+        c.execute("CREATE TABLE camera (ip text, serialnumber text, hostname text, status text, register_set text, friendlyname text, last_seen real, mac_address text, connected integer, armed integer)")
+        c.execute("CREATE UNIQUE INDEX idx_camera_serialnumber ON camera (serialnumber)")
+        for i in range(cameras):
+            serial = f"BENCH{i:04d}"
+            registration = dict(messages.REGISTRATION, SystemSerialNumber=serial)
+            status = dict(messages.STATUS, SystemSerialNumber=serial)
+            c.execute("INSERT INTO camera VALUES (?, ?, ?, ?, ?, ?, julianday('now'), NULL, 1, 1)",
+                      (f"172.14.0.{100 + i}", serial, f"VMC4030P-{serial[-5:]}", json.dumps(status), json.dumps(registration), f"Camera {i}"))
+        conn.commit()
+
+
+def run(client, requests, serials):
+    endpoints = [
+        ('/camera/{}/arm', None),
+        ('/camera/{}/disarm', None),
+        ('/camera/{}/statusrequest', None),
+        ('/camera/{}/pirled', {"enabled": 1, "sensitivity": 80}),
+        ('/camera/{}/audiomic', {"enabled": 1}),
+    ]
+    results = {}
+    for path, body in endpoints:
+        started = time.perf_counter()
+        for i in range(requests):
+            response = client.post(path.format(serials[i % len(serials)]), json=body)
+            assert response.status_code == 200, response.status_code
+        results[path] = requests / (time.perf_counter() - started)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--cameras', type=int, default=8)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='arlo-bench-'))
+    sys.path.insert(0, os.path.abspath(API_DIR))
+    import api.api
+    import arlo.camera
+    import arlo.messages
+    from arlo.camera import Camera
+    from arlo.messages import Message
+
+    create_database('arlo.db', args.cameras, arlo.messages)
+    Camera.send_message = lambda self, message: True
+    serials = [f"BENCH{i:04d}" for i in range(args.cameras)]
+    client = api.api.app.test_client()
+
+    lazy_from_db_row = Camera.from_db_row
+
+    def eager_from_db_row(row):
+        # What from_db_row used to do: parse both blobs up front, every time
+        camera = lazy_from_db_row(row)
+        if camera is not None:
+            camera.registration = Message.from_json(row[4])
+            camera.status = Message.from_json(row[3])
+        return camera
+
+    print(f"{args.requests} requests per endpoint, {args.cameras} cameras")
+    print(f"{'endpoint':<28} {'eager req/s':>12} {'lazy req/s':>12} {'change':>8}")
+
+    Camera.from_db_row = staticmethod(eager_from_db_row)
+    before = run(client, args.requests, serials)
+    Camera.from_db_row = staticmethod(lazy_from_db_row)
+    after = run(client, args.requests, serials)
+
+    for path in before:
+        change = (after[path] / before[path] - 1) * 100
+        print(f"{path.format('<serial>'):<28} {before[path]:>12.1f} {after[path]:>12.1f} {change:>+7.1f}%")
+
+    # Hydration on its own, without Flask and SQLite around it
+    with sqlite3.connect('arlo.db') as conn:
+        row = conn.execute("SELECT * FROM camera").fetchone()
+    rows = args.requests * 10
+    timings = []
+    for from_db_row in (eager_from_db_row, lazy_from_db_row):
+        started = time.perf_counter()
+        for _ in range(rows):
+            from_db_row(row)
+        timings.append((time.perf_counter() - started) / rows * 1e6)
+    print(f"{'Camera.from_db_row':<28} {timings[0]:>10.1f}us {timings[1]:>10.1f}us {(timings[1] / timings[0] - 1) * 100:>+7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
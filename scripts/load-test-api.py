@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Load test for the arlo-cam-api REST server.
+
+Runs the Flask app under the Werkzeug development server (how the API was
+served before) and under the embedded cheroot server, drives both with the
+same concurrent client load and prints throughput and latency percentiles.
+
+Cameras are simulated: Camera.send_message just sleeps for --camera-latency
+seconds, standing in for a camera round trip, so no hardware is needed.
+
+Usage: load-test-api.py [--cameras N] [--clients N] [--seconds N]
+                        [--camera-latency S] [--workers N]
+"""
+import argparse
+import http.client
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'arlo-cam-api')
+
+
+def create_database(path, cameras):
+    with sqlite3.connect(path) as conn:
+        c = conn.cursor()
+        c.execute("CREATE TABLE camera (ip text, serialnumber text, hostname text, status text, register_set text, friendlyname text, last_seen real, mac_address text, connected integer, armed integer)")
+        c.execute("CREATE UNIQUE INDEX idx_camera_serialnumber ON camera (serialnumber)")
+        for i in range(cameras):
+            serial = f"LOADTEST{i:04d}"
+            registration = {"Type": "registration", "SystemSerialNumber": serial, "SystemModelNumber": "VMC4030P"}
+            status = {"Type": "status", "SystemSerialNumber": serial, "BatPercent": 80, "SignalStrengthIndicator": 4}
+            c.execute("INSERT INTO camera VALUES (?, ?, ?, ?, ?, ?, julianday('now'), NULL, 1, 1)",
+                      (f"172.14.0.{100 + i}", serial, f"VMC4030P-{serial[-5:]}", json.dumps(status), json.dumps(registration), f"Camera {i}"))
+        conn.commit()
+
+
+def client(port, paths, stop_at, latencies, errors):
+    conn = None
+    i = 0
+    while time.time() < stop_at:
+        method, path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            conn.request(method, path, body=b'{}' if method == 'POST' else None,
+                         headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            if response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+                conn.close()
+                conn = None
+            if response.status >= 500:
+                errors.append(response.status)
+                continue
+        except Exception as e:
+            errors.append(str(e))
+            if conn is not None:
+                conn.close()
+            conn = None
+            continue
+        latencies.append(time.perf_counter() - started)
+    if conn is not None:
+        conn.close()
+
+
+def run_load(port, paths, clients, seconds):
+    latencies = []
+    errors = []
+    stop_at = time.time() + seconds
+    threads = [threading.Thread(target=client, args=(port, paths, stop_at, latencies, errors)) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors
+
+
+def report(name, latencies, errors, seconds):
+    latencies.sort()
+
+    def percentile(p):
+        if not latencies:
+            return float('nan')
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"{name:<28} {len(latencies) / seconds:>9.1f} req/s   p50 {percentile(0.50):>8.1f} ms   "
+          f"p99 {percentile(0.99):>8.1f} ms   errors {len(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cameras', type=int, default=8)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--camera-latency', type=float, default=0.2)
+    parser.add_argument('--workers', type=int, default=32)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='arlo-loadtest-')
+    os.chdir(work_dir)
+    create_database('arlo.db', args.cameras)
+
+    sys.path.insert(0, os.path.abspath(API_DIR))
+    import api.api
+    from arlo.camera import Camera
+    from werkzeug.serving import make_server
+
+    def simulated_send_message(self, message):
+        time.sleep(args.camera_latency)
+        return True
+    Camera.send_message = simulated_send_message
+
+    serials = [f"LOADTEST{i:04d}" for i in range(args.cameras)]
+    # Mostly dashboard polling with some camera commands mixed in
+    paths = []
+    for serial in serials:
+        paths += [('GET', '/cameras/status')] * 3
+        paths += [('GET', f'/camera/{serial}'), ('POST', f'/camera/{serial}/statusrequest')]
+
+    print(f"{args.clients} clients, {args.cameras} cameras, {args.camera_latency * 1000:.0f} ms camera latency, {args.seconds:.0f}s per run")
+
+    # Before: Werkzeug development server (what app.run() used)
+    dev_server = make_server('127.0.0.1', 0, api.api.app, threaded=True)
+    dev_thread = threading.Thread(target=dev_server.serve_forever, daemon=True)
+    dev_thread.start()
+    latencies, errors = run_load(dev_server.server_port, paths, args.clients, args.seconds)
+    dev_server.shutdown()
+    report("werkzeug dev server", latencies, errors, args.seconds)
+
+    # After: embedded cheroot server
+    server_thread = api.api.ApiServerThread(host='127.0.0.1', port=0, workers=args.workers)
+    server_thread.start()
+    while not server_thread.server.ready:
+        time.sleep(0.05)
+    port = server_thread.server.bind_addr[1]
+    latencies, errors = run_load(port, paths, args.clients, args.seconds)
+    server_thread.stop()
+    report(f"cheroot ({args.workers} workers)", latencies, errors, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,17 +6,69 @@ import functools
 import os
 import time
 import shutil
+import concurrent.futures
+import io
+import tempfile
 from arlo.camera import Camera
-from arlo.messages import Message
 from flask import g
-from helpers.stream_manager import StreamManager
+from cheroot import wsgi
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
+from helpers.stream_manager import StreamManager, claim_stream_dir, LEASE_DURATION
+from helpers.snapshot_cache import snapshot_cache
+from helpers.status_view import status_view
+from helpers.event_bus import event_bus, format_sse
+from helpers.command_queue import command_queue
+from helpers.camera_latency import camera_latency
+from helpers.metrics import registry, stream_startup_seconds, http_request_seconds
+import helpers.profiling
 
 app = flask.Flask(__name__)
 app.config["DEBUG"] = False
 app.use_reloader=False
 
-# Global dict to track active streams
+# Global dict to track active streams (and stopped ones whose DVR ring is
+# still kept for export)
 active_streams = {}
+registry.gauge('arlo_active_streams', 'Live streams currently running',
+               callback=lambda: sum(1 for s in tuple(active_streams.values()) if s.is_active()))
+
+# Adaptive quality controller - set by server.py
+quality_controller = None
+
+# Notification rate limiter - set by server.py
+notification_policy = None
+
+# Battery/temperature/signal/offline alert rules - set by server.py
+alert_rules = None
+
+# Battery drain forecasts from status history - set by server.py
+battery_forecaster = None
+
+# Bulk camera commands: how many cameras are contacted at once and the
+# default overall deadline in seconds
+BULK_MAX_WORKERS = 8
+BULK_DEADLINE = 15
+bulk_executor = concurrent.futures.ThreadPoolExecutor(max_workers=BULK_MAX_WORKERS, thread_name_prefix='bulk')
+
+# Seconds between SSE keep-alive comments (also how fast a gone client is noticed)
+EVENT_HEARTBEAT_INTERVAL = 15
+
+# Where cameras upload snapshots we ask for (this API's /snapshot route as
+# seen from the camera network) - set by server.py
+SNAPSHOT_CALLBACK_URL = 'http://172.14.0.1:5000/snapshot'
+SNAPSHOT_WAIT_TIMEOUT = 10  # seconds
+# Uploaded snapshots land in SNAPSHOT_DIR/<identifier>.jpg; bigger uploads
+# are refused - set by server.py
+SNAPSHOT_DIR = '/tmp'
+SNAPSHOT_MAX_BYTES = 2 * 1024 * 1024
+
+# Camera commands answer 202 Accepted and run in the background when the
+# client sends "Prefer: respond-async" (or ?async=1), or always when this is
+# set - set by server.py. A retried request with the same Idempotency-Key
+# header gets the original command's outcome instead of a second send.
+ASYNC_COMMANDS = False
+COMMAND_WAIT_TIMEOUT = 30  # seconds a synchronous idempotent request waits
 
 # Cleanup leftover stream files on startup
 if os.path.exists('/tmp/arlo-stream'):
@@ -39,12 +91,115 @@ def validate_camera_request(body_required=True):
         return wrapper
     return decorator
 
+def wants_async():
+    if flask.request.args.get('async') is not None:
+        return flask.request.args.get('async') not in ('0', 'false')
+    if 'respond-async' in flask.request.headers.get('Prefer', ''):
+        return True
+    return ASYNC_COMMANDS
+
+def command_accepted(record):
+    status_url = flask.url_for('command_status', command_id=record["id"])
+    response = flask.jsonify({
+        "command_id": record["id"],
+        "status": record["status"],
+        "status_url": status_url
+    })
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+def queueable_command(name):
+    """
+    Let a camera command endpoint run through the command queue
+
+    Goes below validate_camera_request so unknown cameras and bad bodies
+    are still rejected straight away. Requests without async mode or an
+    Idempotency-Key run inline exactly as before.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            idempotency_key = flask.request.headers.get('Idempotency-Key')
+            run_async = wants_async()
+            if not run_async and idempotency_key is None:
+                return f(*args, **kwargs)
+
+            camera = g.camera
+            body = g.get('args')
+
+            @flask.copy_current_request_context
+            def job():
+                # g doesn't follow the request context to the worker thread
+                g.camera = camera
+                g.args = body
+                try:
+                    response = app.make_response(f(*args, **kwargs))
+                except HTTPException as e:
+                    return e.code, {"error": e.description}
+                return response.status_code, response.get_json()
+
+            record, _ = command_queue.submit(camera.serial_number, name, job, idempotency_key)
+            if run_async:
+                return command_accepted(record)
+
+            record = command_queue.wait(record["id"], COMMAND_WAIT_TIMEOUT)
+            if record["finished"] is None:
+                return command_accepted(record)
+            if record["http_status"] is None:
+                # The endpoint raised
+                flask.abort(500)
+            return flask.jsonify(record["result"]), record["http_status"]
+        return wrapper
+    return decorator
+
+@app.before_request
+def start_request_timer():
+    if helpers.profiling.ENABLED:
+        g.request_started = time.monotonic()
+
+@app.after_request
+def record_request_time(response):
+    started = g.get('request_started')
+    if started is not None:
+        elapsed = time.monotonic() - started
+        route = flask.request.url_rule.rule if flask.request.url_rule else 'unmatched'
+        http_request_seconds.observe(elapsed, route=route, method=flask.request.method, status=response.status_code)
+        # Shows up in the browser's network panel
+        response.headers['Server-Timing'] = f"app;dur={elapsed * 1000:.1f}"
+    return response
+
 @app.route('/', methods=['GET'])
 def home():
     return "PING"
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint"""
+    return flask.Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profile', methods=['GET'])
+def sample_profile():
+    """
+    Sample all threads for ?seconds=N (default 10) and return collapsed
+    stacks for flamegraph.pl or speedscope. Needs ProfilingEnabled.
+    """
+    if not helpers.profiling.ENABLED:
+        flask.abort(404)
+    try:
+        seconds = float(flask.request.args.get('seconds', 10))
+        interval = float(flask.request.args.get('interval', 0.01))
+    except ValueError:
+        flask.abort(400)
+    if seconds <= 0 or interval <= 0:
+        flask.abort(400)
+    folded = helpers.profiling.sample_stacks(seconds, interval)
+    response = flask.Response(folded, mimetype='text/plain')
+    response.headers['Content-Disposition'] = f'attachment; filename="arlo-profile-{time.strftime("%Y%m%d-%H%M%S")}.folded"'
+    return response
+
 @app.route('/camera', methods=['GET'])
-def list():
+def list_cameras():
     with sqlite3.connect('arlo.db') as conn:
         c = conn.cursor()
         c.execute("SELECT * FROM camera")
@@ -60,68 +215,62 @@ def list():
 @app.route('/cameras/status', methods=['GET'])
 def cameras_status():
     """Get comprehensive status for all cameras"""
-    import time
-    with sqlite3.connect('arlo.db') as conn:
-        c = conn.cursor()
-        c.execute("SELECT ip, serialnumber, hostname, status, register_set, friendlyname, last_seen, mac_address, connected, armed FROM camera")
-        rows = c.fetchall()
-        cameras_status = []
-
-
-        if rows is not None:
-            for row in rows:
-                (ip, serial_number, hostname, status_json, registration_json, friendly_name, last_seen_db, mac_address, connected, armed) = row
-
-                # Use connectivity checker result
-                online = bool(connected) if connected is not None else False
-                # Parse status for battery and other info
-                battery_percent = None
-                signal_strength = None
-                charging_state = None
-                charger_tech = None
-                battery_voltage = None
-
-                if status_json:
-                    try:
-                        status_data = Message.from_json(status_json)
-                        battery_percent = status_data.dictionary.get('BatPercent')
-                        signal_strength = status_data.dictionary.get('SignalStrengthIndicator')
-                        charging_state = status_data.dictionary.get('ChargingState')
-                        charger_tech = status_data.dictionary.get('ChargerTech')
-                        battery_voltage = status_data.dictionary.get('Bat1Volt')
-                    except:
-                        pass
-
-                # Convert last_seen from Julian day to ISO timestamp for readability
-                last_seen_iso = None
-                if last_seen_db is not None:
-                    # Calculate seconds since epoch from Julian day
-                    # Julian day 0 = noon on January 1, 4713 BC
-                    # Unix epoch (1970-01-01 00:00:00) = Julian day 2440587.5
-                    import datetime
-                    epoch_julian = 2440587.5
-                    seconds_since_epoch = (last_seen_db - epoch_julian) * 86400
-                    last_seen_iso = datetime.datetime.utcfromtimestamp(seconds_since_epoch).isoformat() + 'Z'
-
-                camera_info = {
-                    "serial_number": serial_number,
-                    "friendly_name": friendly_name or hostname or serial_number,
-                    "hostname": hostname,
-                    "ip": ip if online else None,
-                    "mac_address": mac_address,
-                    "online": online,
-                    "armed": bool(armed) if armed is not None else True,
-                    "battery_percent": battery_percent,
-                    "signal_strength": signal_strength,
-                    "charging_state": charging_state,
-                    "charger_tech": charger_tech,
-                    "battery_voltage": battery_voltage,
-                    "last_seen": last_seen_iso
-                }
-
-                cameras_status.append(camera_info)
-
-        return flask.jsonify(cameras_status)
+    # Cheap path for pollers whose copy is current - no database access at all
+    etag = status_view.etag()
+    if etag in flask.request.headers.get('If-None-Match', ''):
+        return flask.Response(status=304, headers={"ETag": etag})
+
+    version, cameras = status_view.get()
+    response = flask.jsonify(cameras)
+    response.headers["ETag"] = status_view.etag(version)
+    response.headers["X-Status-Version"] = str(version)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route('/cameras/latency', methods=['GET'])
+def cameras_latency():
+    """Command round-trip percentiles, adaptive timeouts and failure counts for all cameras"""
+    return flask.jsonify(camera_latency.get_state())
+
+@app.route('/camera/<serial>/latency', methods=['GET'])
+@validate_camera_request(body_required=False)
+def camera_latency_state(serial):
+    """Command round-trip percentiles, adaptive timeout and failure counts for one camera"""
+    return flask.jsonify(camera_latency.get_state(serial) or {})
+
+@app.route('/events', methods=['GET'])
+def events():
+    """
+    Server-Sent Events stream of motion, recording, status, connectivity
+    and stream state events
+
+    Reconnecting clients send Last-Event-ID (EventSource does this itself)
+    or ?since=<id> to receive the events they missed.
+    """
+    since = flask.request.headers.get('Last-Event-ID') or flask.request.args.get('since')
+    try:
+        since = int(since) if since is not None else None
+    except ValueError:
+        since = None
+    subscription = event_bus.subscribe(since)
+
+    def stream():
+        try:
+            # Tell the client the current cursor straight away
+            yield f"retry: 3000\n: connected at {event_bus.last_id()}\n\n"
+            while True:
+                event = subscription.get(timeout=EVENT_HEARTBEAT_INTERVAL)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield format_sse(event)
+        finally:
+            subscription.close()
+
+    return flask.Response(stream(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
 
 @app.route('/camera/<serial>', methods=['GET'])
 @validate_camera_request(body_required=False)
@@ -141,12 +290,14 @@ def registration(serial):
 
 @app.route('/camera/<serial>/statusrequest', methods=['POST'])
 @validate_camera_request(body_required=False)
+@queueable_command('statusrequest')
 def status_request(serial):
     result = g.camera.status_request()
     return flask.jsonify({"result":result})
 
 @app.route('/camera/<serial>/userstreamactive', methods=['POST'])
 @validate_camera_request()
+@queueable_command('userstreamactive')
 def user_stream_active(serial):
     active = g.args["active"]
     if active is None:
@@ -162,63 +313,217 @@ def user_stream_active(serial):
     result = g.camera.set_user_stream_active(int(active))
     return flask.jsonify({"result":result})
 
-@app.route('/camera/<serial>/arm', methods=['POST'])
-@validate_camera_request(body_required=False)
-def arm(serial):
+def arm_config_from_args(args):
     # Use provided args or defaults for arming
-    args = flask.request.get_json() if flask.request.is_json else {}
-    arm_config = {
+    return {
         'PIRTargetState': args.get('PIRTargetState', 1),
         'VideoMotionEstimationEnable': args.get('VideoMotionEstimationEnable', 1),
         'AudioTargetState': args.get('AudioTargetState', 1)
     }
-    result = g.camera.arm(arm_config)
+
+# Disarm by setting all detection to off
+DISARM_CONFIG = {
+    'PIRTargetState': 0,
+    'VideoMotionEstimationEnable': 0,
+    'AudioTargetState': 0
+}
+
+def apply_arm_state(camera, arm_config, armed):
+    """Send the arm/disarm registerSet and remember the state if it was acked"""
+    result = camera.arm(arm_config)
     if result:
-        g.camera.armed = 1
-        g.camera.persist()
+        camera.armed = armed
+        camera.persist()
+    return result
+
+@app.route('/camera/<serial>/arm', methods=['POST'])
+@validate_camera_request(body_required=False)
+@queueable_command('arm')
+def arm(serial):
+    args = flask.request.get_json() if flask.request.is_json else {}
+    result = apply_arm_state(g.camera, arm_config_from_args(args), 1)
     return flask.jsonify({"result":result})
 
 @app.route('/camera/<serial>/disarm', methods=['POST'])
 @validate_camera_request(body_required=False)
+@queueable_command('disarm')
 def disarm(serial):
-    # Disarm by setting all detection to off
-    disarm_config = {
-        'PIRTargetState': 0,
-        'VideoMotionEstimationEnable': 0,
-        'AudioTargetState': 0
-    }
-    result = g.camera.arm(disarm_config)
-    if result:
-        g.camera.armed = 0
-        g.camera.persist()
+    result = apply_arm_state(g.camera, DISARM_CONFIG, 0)
     return flask.jsonify({"result":result})
 
+def run_bulk(command):
+    """
+    Run command(camera, args) against many cameras in parallel, args being
+    the validated request body
+
+    Body (optional JSON): {"serials": [...], "deadline": seconds}. Without
+    serials every known camera is targeted. Cameras that haven't answered
+    by the deadline are reported as timed out (their command still
+    finishes in the background).
+    """
+    args = flask.request.get_json() if flask.request.is_json else {}
+    if not isinstance(args, dict):
+        return flask.jsonify({"result": False, "error": "Body must be a JSON object"}), 400
+    serials = args.get('serials')
+    if serials is not None and (not isinstance(serials, list)
+                                or not all(isinstance(serial, str) for serial in serials)):
+        return flask.jsonify({"result": False, "error": "serials must be a list of serial numbers"}), 400
+    try:
+        deadline = float(args.get('deadline', BULK_DEADLINE))
+    except (TypeError, ValueError):
+        deadline = None
+    if deadline is None or not 0 < deadline < float('inf'):
+        return flask.jsonify({"result": False, "error": "deadline must be a positive number of seconds"}), 400
+
+    if serials is None:
+        cameras = Camera.from_db_all()
+        serials = [camera.serial_number for camera in cameras]
+    else:
+        cameras = [Camera.from_db_serial(serial) for serial in serials]
+
+    results = {}
+    futures = {}
+    for serial, camera in zip(serials, cameras):
+        if camera is None:
+            results[serial] = {"result": False, "error": "Unknown camera"}
+        else:
+            futures[bulk_executor.submit(command, camera, args)] = serial
+
+    done, not_done = concurrent.futures.wait(futures, timeout=deadline)
+    for future in done:
+        try:
+            results[futures[future]] = {"result": future.result()}
+        except Exception as e:
+            results[futures[future]] = {"result": False, "error": str(e)}
+    for future in not_done:
+        results[futures[future]] = {"result": None, "error": "Timed out"}
+
+    return flask.jsonify({
+        "result": all(r["result"] for r in results.values()),
+        "cameras": results
+    })
+
+@app.route('/cameras/arm', methods=['POST'])
+def bulk_arm():
+    return run_bulk(lambda camera, args: apply_arm_state(camera, arm_config_from_args(args), 1))
+
+@app.route('/cameras/disarm', methods=['POST'])
+def bulk_disarm():
+    return run_bulk(lambda camera, args: apply_arm_state(camera, DISARM_CONFIG, 0))
+
+@app.route('/cameras/statusrequest', methods=['POST'])
+def bulk_status_request():
+    return run_bulk(lambda camera, args: camera.status_request())
+
 @app.route('/camera/<serial>/pirled', methods=['POST'])
 @validate_camera_request()
+@queueable_command('pirled')
 def pir_led(serial):
     result = g.camera.pir_led(g.args)
     return flask.jsonify({"result":result})
 
 @app.route('/camera/<serial>/quality', methods=['POST'])
 @validate_camera_request()
+@queueable_command('quality')
 def set_quality(serial):
     if g.args['quality'] is None:
         flask.abort(400)
     else:
         result = g.camera.set_quality(g.args)
+        if result and quality_controller is not None:
+            quality_controller.set_manual(serial, g.args['quality'])
         return flask.jsonify({"result":result})
 
+@app.route('/camera/<serial>/quality', methods=['GET'])
+@validate_camera_request(body_required=False)
+def get_quality(serial):
+    """Adaptive quality position and decision log for one camera"""
+    if quality_controller is None:
+        return flask.jsonify({"enabled": False})
+    return flask.jsonify(quality_controller.get_state(serial))
+
+@app.route('/quality', methods=['GET'])
+def quality_decisions():
+    """Adaptive quality position and decision log for all cameras"""
+    if quality_controller is None:
+        return flask.jsonify({"enabled": False})
+    return flask.jsonify(quality_controller.get_state())
+
+@app.route('/notifications/policy', methods=['GET'])
+def notification_policy_state():
+    """Rate limit buckets and open digests"""
+    if notification_policy is None:
+        return flask.jsonify({"enabled": False})
+    return flask.jsonify(notification_policy.get_state())
+
+@app.route('/alerts/rules', methods=['GET'])
+def alert_rule_state():
+    """Enabled alert rules and each camera's current level"""
+    if alert_rules is None:
+        return flask.jsonify({"rules": []})
+    return flask.jsonify(alert_rules.get_state())
+
+@app.route('/battery/forecast', methods=['GET'])
+def battery_forecast():
+    """Drain rate, predicted run-out time and abnormal-drain flag for every camera"""
+    if battery_forecaster is None:
+        return flask.jsonify({"cameras": {}})
+    return flask.jsonify(battery_forecaster.get_forecast())
+
+@app.route('/camera/<serial>/battery/forecast', methods=['GET'])
+@validate_camera_request(body_required=False)
+def camera_battery_forecast(serial):
+    """Battery forecast for one camera"""
+    forecast = battery_forecaster.get_forecast(serial) if battery_forecaster is not None else None
+    if forecast is None:
+        flask.abort(404)
+    return flask.jsonify(forecast)
+
 @app.route('/camera/<serial>/snapshot', methods=['POST'])
 @validate_camera_request()
+@queueable_command('snapshot')
 def request_snapshot(serial):
-    if g.args['url'] is None:
-        flask.abort(400)
+    """
+    Ask the camera to upload a snapshot
+
+    Body: {"url": upload URL (default: this API's /snapshot/<serial>/),
+           "wait": true or seconds to wait for the upload to arrive}
+    """
+    url = g.args.get('url') or f"{SNAPSHOT_CALLBACK_URL}/{serial}/"
+    wait = g.args.get('wait')
+    if wait is True:
+        timeout = SNAPSHOT_WAIT_TIMEOUT
+    elif not wait:
+        timeout = None
     else:
-        result = g.camera.snapshot_request(g.args['url'])
+        try:
+            timeout = float(wait)
+        except (TypeError, ValueError):
+            flask.abort(400)
+        if not 0 < timeout < float('inf'):
+            flask.abort(400)
+        timeout = min(timeout, SNAPSHOT_WAIT_TIMEOUT * 6)
+
+    requested_at = time.time()
+    result = g.camera.snapshot_request(url)
+    if not result or timeout is None:
         return flask.jsonify({"result":result})
 
+    # Only uploads to our own callback under the serial are seen here
+    frame = snapshot_cache.wait_for_newer(serial, requested_at, timeout)
+    if frame is None:
+        return flask.jsonify({"result":result, "received":False})
+    return flask.jsonify({
+        "result":result,
+        "received":True,
+        "etag":frame["etag"],
+        "size":len(frame["data"]),
+        "url":f"/camera/{serial}/latest.jpg"
+    })
+
 @app.route('/camera/<serial>/audiomic', methods=['POST'])
 @validate_camera_request()
+@queueable_command('audiomic')
 def request_mic(serial):
     if g.args['enabled'] is None:
         flask.abort(400)
@@ -228,6 +533,7 @@ def request_mic(serial):
 
 @app.route('/camera/<serial>/audiospeaker', methods=['POST'])
 @validate_camera_request()
+@queueable_command('audiospeaker')
 def request_speaker(serial):
     if g.args['enabled'] is None:
         flask.abort(400)
@@ -237,6 +543,7 @@ def request_speaker(serial):
 
 @app.route('/camera/<serial>/record', methods=['POST'])
 @validate_camera_request()
+@queueable_command('record')
 def request_record(serial):
     if g.args['duration'] is None:
         flask.abort(400)
@@ -257,6 +564,7 @@ def set_friendlyname(serial):
 
 @app.route('/camera/<serial>/activityzones', methods=['POST','DELETE'])
 @validate_camera_request()
+@queueable_command('activityzones')
 def set_activity_zones(serial):
     if flask.request.method == 'DELETE':
         result = g.camera.unset_activity_zones()
@@ -265,23 +573,119 @@ def set_activity_zones(serial):
 
     return flask.jsonify({"result":result})
 
+@app.route('/commands/<command_id>', methods=['GET'])
+def command_status(command_id):
+    """Outcome of a queued camera command"""
+    record = command_queue.get(command_id)
+    if record is None:
+        flask.abort(404)
+    return flask.jsonify(record)
+
+class SnapshotUpload(io.FileIO):
+    """Temporary file a multipart upload is written into as it arrives
+
+    Lives next to the final file so it can be renamed into place, and
+    refuses to grow past `limit` bytes.
+    """
+
+    def __init__(self, directory, limit):
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix='.upload-', suffix='.jpg')
+        super().__init__(fd, 'r+b')
+        self.limit = limit
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            raise RequestEntityTooLarge()
+        return super().write(data)
+
+    def discard(self):
+        self.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
 @app.route('/snapshot/<identifier>/', methods=['POST'])
 def receive_snapshot(identifier):
-    if 'file' not in flask.request.files:
+    """
+    Snapshot upload from a camera (multipart, field "file")
+
+    The upload is streamed to a temporary file and renamed over
+    SNAPSHOT_DIR/<identifier>.jpg once complete, so readers never see a
+    partial JPEG.
+    """
+    start_path = os.path.abspath(SNAPSHOT_DIR)
+    target_path = os.path.join(start_path,f"{identifier}.jpg")
+    common_prefix = os.path.commonprefix([target_path, start_path])
+    if (common_prefix != start_path):
         flask.abort(400)
-    else:
-        file = flask.request.files['file']
-        if file.filename=='':
+    if flask.request.content_length is not None and flask.request.content_length > SNAPSHOT_MAX_BYTES:
+        flask.abort(413)
+
+    uploads = []
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        upload = SnapshotUpload(start_path, SNAPSHOT_MAX_BYTES)
+        uploads.append(upload)
+        return upload
+
+    try:
+        _, _, files = parse_form_data(flask.request.environ, stream_factory=stream_factory)
+        file = files.get('file')
+        if file is None or file.filename == '':
             flask.abort(400)
+        upload = file.stream
+        upload.flush()
+        os.replace(upload.path, target_path)
+        uploads.remove(upload)
+        upload.close()
+    finally:
+        for leftover in uploads:
+            leftover.discard()
+
+    # Snapshots we request ourselves are uploaded under the camera serial
+    if Camera.from_db_serial(identifier) is not None:
+        snapshot_cache.put_file(identifier, target_path, 'snapshot')
+    event_bus.publish('snapshot_received', identifier=identifier, size=upload.size)
+    return ""
+
+@app.route('/camera/<serial>/latest.jpg', methods=['GET'])
+@validate_camera_request(body_required=False)
+def latest_snapshot(serial):
+    """
+    Most recent JPEG for a camera from the in-memory cache
+
+    Query args:
+        max_age: Freshness limit in seconds. If the cached frame is older, a
+                 keyframe is taken from the live stream if one is running,
+                 otherwise the camera is woken for a snapshot. Without it
+                 the cached frame is always served and the camera left alone.
+    """
+    frame = snapshot_cache.get(serial)
+    max_age = flask.request.args.get('max_age', type=float)
+
+    if max_age is not None and (frame is None or time.time() - frame["time"] > max_age):
+        since = frame["time"] if frame is not None else 0
+        stream_manager = active_streams.get(serial)
+        if stream_manager is not None and stream_manager.is_active():
+            snapshot_cache.put(serial, stream_manager.grab_keyframe(), 'stream')
         else:
-            start_path = os.path.abspath('/tmp')
-            target_path = os.path.join(start_path,f"{identifier}.jpg")
-            common_prefix = os.path.commonprefix([target_path, start_path])
-            if (common_prefix != start_path):
-                flask.abort(400)
-            else:
-                file.save(target_path)
-            return ""
+            g.camera.snapshot_request(f"{SNAPSHOT_CALLBACK_URL}/{serial}/")
+        frame = snapshot_cache.wait_for_newer(serial, since, SNAPSHOT_WAIT_TIMEOUT) or frame
+
+    if frame is None:
+        flask.abort(404)
+
+    headers = {
+        "ETag": frame["etag"],
+        "Age": str(int(time.time() - frame["time"])),
+        "Cache-Control": "no-cache",
+        "X-Snapshot-Source": frame["source"]
+    }
+    if frame["etag"] in flask.request.headers.get('If-None-Match', ''):
+        return flask.Response(status=304, headers=headers)
+    return flask.Response(frame["data"], mimetype='image/jpeg', headers=headers)
 
 @app.route('/camera/<serial>/stream/start', methods=['POST'])
 @validate_camera_request(body_required=False)
@@ -290,12 +694,40 @@ def stream_start(serial):
     global active_streams
 
     # Check if stream already active for this camera
-    if serial in active_streams:
+    if serial in active_streams and active_streams[serial].is_active():
         return flask.jsonify({
             "result": False,
             "error": "Stream already active for this camera"
         }), 400
 
+    started = time.monotonic()
+    stream_manager = StreamManager(
+        camera_serial=serial,
+        camera_ip=g.camera.ip,
+        camera=g.camera,
+        is4k=False,
+        on_source_lost=quality_controller.record_stream_loss if quality_controller else None
+    )
+
+    # Reserve the stream directory first; a motion recording may already be
+    # publishing live HLS into it, or still be starting up
+    claimed, prewarm_process = claim_stream_dir(serial, stream_manager)
+    if not claimed:
+        return flask.jsonify({
+            "result": False,
+            "error": "Stream is starting for this camera, try again"
+        }), 409
+    active_streams[serial] = stream_manager
+
+    if prewarm_process is not None:
+        stream_manager.attach(prewarm_process, duration=LEASE_DURATION)
+        stream_startup_seconds.observe(time.monotonic() - started, prewarmed='true')
+        return flask.jsonify({
+            "result": True,
+            "stream_url": f"/stream/{serial}/stream.m3u8",
+            "prewarmed": True
+        })
+
     try:
         # Wake camera and wait for it to initialize
         g.camera.status_request()
@@ -305,15 +737,8 @@ def stream_start(serial):
         g.camera.set_user_stream_active(1)
         time.sleep(1)
 
-        # Create StreamManager and start streaming
-        stream_manager = StreamManager(
-            camera_serial=serial,
-            camera_ip=g.camera.ip,
-            is4k=False
-        )
-
-        if stream_manager.start(duration=60):
-            active_streams[serial] = stream_manager
+        if stream_manager.start(duration=LEASE_DURATION):
+            stream_startup_seconds.observe(time.monotonic() - started, prewarmed='false')
             return flask.jsonify({
                 "result": True,
                 "stream_url": f"/stream/{serial}/stream.m3u8"
@@ -325,6 +750,8 @@ def stream_start(serial):
             }), 500
 
     except Exception as e:
+        # Let go of the directory
+        stream_manager.stop()
         return flask.jsonify({
             "result": False,
             "error": str(e)
@@ -336,23 +763,20 @@ def stream_stop(serial):
     """Stop HLS streaming from camera"""
     global active_streams
 
-    if serial not in active_streams:
+    if serial not in active_streams or not active_streams[serial].is_active():
         return flask.jsonify({
             "result": False,
             "error": "No active stream for this camera"
         }), 400
 
     try:
-        # Stop stream and cleanup
+        # Stop stream; its DVR ring stays exportable for the window
         stream_manager = active_streams[serial]
         stream_manager.stop()
 
         # Set UserStreamActive=0
         g.camera.set_user_stream_active(0)
 
-        # Remove from active streams
-        del active_streams[serial]
-
         return flask.jsonify({"result": True})
 
     except Exception as e:
@@ -361,6 +785,57 @@ def stream_stop(serial):
             "error": str(e)
         }), 500
 
+@app.route('/camera/<serial>/stream/renew', methods=['POST'])
+@validate_camera_request(body_required=False)
+def stream_renew(serial):
+    """Keep a live stream running for another lease (viewer keep-alive)"""
+    global active_streams
+
+    stream_manager = active_streams.get(serial)
+    if stream_manager is None or not stream_manager.renew(LEASE_DURATION):
+        return flask.jsonify({
+            "result": False,
+            "error": "No active stream for this camera"
+        }), 400
+
+    return flask.jsonify({
+        "result": True,
+        "expires": stream_manager.lease_deadline
+    })
+
+@app.route('/camera/<serial>/stream/export', methods=['POST'])
+@validate_camera_request(body_required=False)
+def stream_export(serial):
+    """Save a range of the live DVR window as a permanent recording"""
+    global active_streams
+
+    if serial not in active_streams or not active_streams[serial].is_exportable():
+        return flask.jsonify({
+            "result": False,
+            "error": "No active stream for this camera"
+        }), 400
+
+    # Optional unix-time bounds; default is the whole window
+    args = flask.request.get_json() if flask.request.is_json else {}
+    try:
+        path = active_streams[serial].export_range(args.get('start'), args.get('end'))
+    except Exception as e:
+        return flask.jsonify({
+            "result": False,
+            "error": str(e)
+        }), 500
+
+    if path is None:
+        return flask.jsonify({
+            "result": False,
+            "error": "Nothing to export in that range"
+        }), 404
+
+    return flask.jsonify({
+        "result": True,
+        "filename": os.path.basename(path)
+    })
+
 @app.route('/camera/<serial>/stream/status', methods=['GET'])
 @validate_camera_request(body_required=False)
 def stream_status(serial):
@@ -373,11 +848,46 @@ def stream_status(serial):
             "stream_url": f"/stream/{serial}/stream.m3u8"
         })
     else:
-        # Clean up inactive streams
-        if serial in active_streams:
+        # Clean up inactive streams once nothing is left to export
+        if serial in active_streams and not active_streams[serial].is_exportable():
             del active_streams[serial]
         return flask.jsonify({"active": False})
 
 
-def get_thread():
-    return threading.Thread(target=app.run(host='0.0.0.0'))
+class ApiServerThread(threading.Thread):
+    """Serves the API with cheroot's thread-pooled WSGI server
+
+    Each worker thread handles one connection at a time (HTTP/1.1
+    keep-alive), so the pool has to cover polling clients, slow camera
+    round trips and open /events streams. stop() stops accepting new
+    connections and gives in-flight requests up to shutdown_timeout
+    seconds to finish.
+    """
+
+    def __init__(self, host='0.0.0.0', port=5000, workers=32, request_timeout=10, shutdown_timeout=10):
+        super().__init__(name='api-server', daemon=True)
+        self.server = wsgi.Server(
+            (host, port),
+            app,
+            numthreads=workers,
+            timeout=request_timeout,
+            shutdown_timeout=shutdown_timeout,
+            request_queue_size=64
+        )
+
+    def run(self):
+        self.server.safe_start()
+
+    def stop(self):
+        self.server.stop()
+
+
+def get_thread(config=None):
+    config = config or {}
+    return ApiServerThread(
+        host=config.get('ApiHost', '0.0.0.0'),
+        port=config.get('ApiPort', 5000),
+        workers=config.get('ApiWorkers', 32),
+        request_timeout=config.get('ApiRequestTimeout', 10),
+        shutdown_timeout=config.get('ApiShutdownTimeout', 10)
+    )
@@ -1,3 +1,4 @@
+import functools
 import json
 import socket
 import sqlite3
@@ -9,12 +10,30 @@ from arlo.socket import ArloSocket
 import arlo.messages
 from helpers.safe_print import s_print
 from helpers.recorder import Recorder
+from helpers.status_view import status_view
+from helpers.dhcp_leases import lease_index
+from helpers.camera_latency import camera_latency
+from helpers.metrics import send_message_seconds, send_message_failures, sqlite_seconds
+from helpers.profiling import timed
 
 # Global camera aliases loaded from config.yaml
 # Set by server.py on startup
 CAMERA_ALIASES = {}
 
+# Parsed registration/status blobs, keyed by the JSON text. Cameras loaded
+# from the same row share the Message, so treat these as read-only and
+# assign a new Message instead of editing one in place.
+@functools.lru_cache(maxsize=256)
+def _parse_blob(blob):
+    return Message.from_json(blob)
+
+# Marks a blob that hasn't been parsed yet
+_UNPARSED = object()
+
 class Camera:
+    __slots__ = ('ip', 'id', 'serial_number', 'hostname', 'friendly_name', 'armed', 'last_seen',
+                 '_registration', '_registration_json', '_status', '_status_json')
+
     def __init__(self, ip, registration):
         self.registration = registration
         self.ip = ip
@@ -25,21 +44,64 @@ class Camera:
         # Use alias from config if available, otherwise fall back to serial number
         self.friendly_name = CAMERA_ALIASES.get(self.serial_number, self.serial_number)
         self.armed = 1  # Default to armed state
+        self.last_seen = None
+
+    # registration and status are kept as the raw database JSON until first
+    # read, so commands that never look at them don't pay for parsing
+
+    @property
+    def registration(self):
+        if self._registration is _UNPARSED:
+            self._registration = _parse_blob(self._registration_json)
+        return self._registration
+
+    @registration.setter
+    def registration(self, registration):
+        self._registration = registration
+        self._registration_json = None
+
+    @property
+    def status(self):
+        if self._status is _UNPARSED:
+            self._status = _parse_blob(self._status_json)
+        return self._status
+
+    @status.setter
+    def status(self, status):
+        self._status = status
+        self._status_json = None
 
     def __getitem__(self,key):
         return self.registration[key]
 
+    @timed('Camera.send_message')
     def send_message(self,message):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-
-            sock.settimeout(5.0)
+        started = time.monotonic()
+        failure = None
+        for attempt in range(camera_latency.attempts()):
+            if attempt:
+                # A sleeping camera refuses or ignores connections until it wakes
+                camera_latency.retried(self.serial_number)
+                time.sleep(camera_latency.retry_delay(attempt))
+            # Learned from this camera's recent round trips, longer if it may be asleep
+            timeout = camera_latency.timeout(self.serial_number, attempt)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            attempt_started = time.monotonic()
             try:
                 sock.connect((self.ip, 4000))
+                break
             except OSError as msg:
-                print('Connection to camera failed: {msg}')
-                return False
+                sock.close()
+                print(f'Connection to camera failed: {msg}')
+        else:
+            send_message_failures.inc(serial_number=self.serial_number, reason='connect')
+            camera_latency.failure(self.serial_number, 'connect')
+            return False
 
+        with sock:
             result = False
+            failure = 'no_ack'
             try:
                 arloSock = ArloSocket(sock)
                 self.id += 1
@@ -54,16 +116,28 @@ class Camera:
                         if ('Response' in ack and ack['Response'] != "Ack"):
                             s_print(f"<[{self.ip}][{self.id}] {ack['Response']}")
                             result = False
+                            failure = 'nack'
                         else:
                             s_print(f"<[{self.ip}][{self.id}] Ack")
                             result = True
+                            failure = None
+            except socket.timeout:
+                s_print(f"<[{self.ip}][{self.id}] No ack within {timeout:.1f}s")
             except:
                 print(f'Exception: {sys.exc_info()}')
+                failure = 'error'
             finally:
+                send_message_seconds.observe(time.monotonic() - started, serial_number=self.serial_number)
+                if failure is not None:
+                    send_message_failures.inc(serial_number=self.serial_number, reason=failure)
+                    camera_latency.failure(self.serial_number, failure)
+                else:
+                    camera_latency.success(self.serial_number, time.monotonic() - attempt_started)
                 return result
 
+    @timed('Camera.persist')
     def persist(self):
-        with sqlite3.connect('arlo.db') as conn:
+        with sqlite_seconds.time(operation='persist'), sqlite3.connect('arlo.db') as conn:
             c = conn.cursor()
             # Remove the IP for any redundant camera that has the same IP...
             c.execute("UPDATE camera SET ip = 'UNKNOWN' WHERE ip = ? AND serialnumber <> ?", (self.ip, self.serial_number))
@@ -85,9 +159,17 @@ class Camera:
                     friendlyname = excluded.friendlyname,
                     last_seen = excluded.last_seen,
                     armed = excluded.armed
-            """, (self.ip, self.serial_number, self.hostname, repr(self.status), repr(self.registration),
+            """, (self.ip, self.serial_number, self.hostname, self._blob('status'), self._blob('registration'),
                   self.friendly_name, last_seen, self.serial_number, self.serial_number, self.armed))
             conn.commit()
+        status_view.invalidate()
+
+    def _blob(self, field):
+        # Write back the JSON we loaded unless the field was replaced
+        value = getattr(self, f'_{field}')
+        if value is _UNPARSED:
+            return getattr(self, f'_{field}_json')
+        return repr(value)
 
     def pir_led(self,args):
         register_set = Message(arlo.messages.REGISTER_SET)
@@ -190,7 +272,7 @@ class Camera:
 
     @staticmethod
     def from_db_serial(serial):
-        with sqlite3.connect('arlo.db') as conn:
+        with sqlite_seconds.time(operation='select'), sqlite3.connect('arlo.db') as conn:
             c = conn.cursor()
             c.execute("SELECT * FROM camera WHERE serialnumber = ?", (serial,))
             result = c.fetchone()
@@ -198,25 +280,43 @@ class Camera:
 
     @staticmethod
     def from_db_ip(ip):
-        with sqlite3.connect('arlo.db') as conn:
+        # The DHCP lease index knows a camera's new IP before it re-registers
+        serial_number = lease_index.serial_for_ip(ip)
+        if serial_number is not None:
+            camera = Camera.from_db_serial(serial_number)
+            if camera is not None:
+                camera.ip = ip
+                return camera
+        with sqlite_seconds.time(operation='select'), sqlite3.connect('arlo.db') as conn:
             c = conn.cursor()
             c.execute("SELECT * FROM camera WHERE ip = ?", (ip,))
             result = c.fetchone()
             return Camera.from_db_row(result)
 
+    @staticmethod
+    def from_db_all():
+        with sqlite_seconds.time(operation='select'), sqlite3.connect('arlo.db') as conn:
+            c = conn.cursor()
+            c.execute("SELECT * FROM camera")
+            return [Camera.from_db_row(row) for row in c.fetchall()]
+
     @staticmethod
     def from_db_row(row):
         if row is not None:
             (ip,serial_number,hostname,status,registration,friendly_name,last_seen,_,_,armed) = row
-            _registration = Message.from_json(registration)
-            cam = Camera(ip,_registration)
-            cam.status = Message.from_json(status)
+            # Skip __init__: serial and hostname come from their own columns,
+            # the JSON blobs are only parsed if something reads them
+            cam = Camera.__new__(Camera)
+            cam.ip = ip
+            cam.id = 0
+            cam.serial_number = serial_number
+            cam.hostname = hostname
+            cam._registration, cam._registration_json = _UNPARSED, registration
+            cam._status, cam._status_json = _UNPARSED, status
             cam.last_seen = last_seen
             cam.armed = armed if armed is not None else 1  # Default to armed if not set
-            # Camera.__init__ already applied alias from CAMERA_ALIASES
-            # Only use DB value if no alias is configured
-            if cam.serial_number not in CAMERA_ALIASES:
-                cam.friendly_name = friendly_name
+            # Use alias from config if available, otherwise the DB value
+            cam.friendly_name = CAMERA_ALIASES.get(serial_number, friendly_name)
             return cam
         else:
             return None
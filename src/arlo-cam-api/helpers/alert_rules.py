@@ -0,0 +1,330 @@
+import sqlite3
+import threading
+import time
+
+from helpers.safe_print import s_print
+from helpers.event_bus import event_bus
+
+# How often cameras are checked for having gone quiet (at most)
+OFFLINE_SWEEP_INTERVAL = 60  # seconds
+
+
+class LevelRule:
+    """Alert when a status field crosses one of a list of thresholds
+
+    Levels go from least to most severe ("low" then "critical"). A camera
+    moves up a level as soon as the value crosses its threshold, but only
+    moves back down once the value has cleared the threshold by
+    `hysteresis`, so a reading bouncing around a limit alerts once.
+    Thresholds may name a registration field plus an offset, resolved per
+    camera by bind() (e.g. ThermalShutdownMaxTemp - 5).
+    """
+
+    def __init__(self, name, field, levels, direction='below', hysteresis=0, title='', message='', tags=''):
+        """
+        Args:
+            name: Rule name, used as its state key
+            field: Status message field to watch
+            levels: [(level, threshold, priority)] least to most severe;
+                    threshold is a number or (registration_field, offset)
+            direction: 'below' alerts on values <= threshold, 'above' on >=
+            hysteresis: How far the value must clear a threshold to recover
+            title, message: Templates formatted with camera, value, level, threshold
+            tags: ntfy tags
+        """
+        self.name = name
+        self.field = field
+        self.levels = levels
+        self.direction = direction
+        self.hysteresis = hysteresis
+        self.title = title
+        self.message = message
+        self.tags = tags
+        # Compare everything as "lower is worse"
+        self.sign = 1 if direction == 'below' else -1
+
+    def bind(self, registration):
+        """
+        Resolve registration-relative thresholds for one camera
+
+        Returns:
+            LevelRule: Rule with numeric thresholds, or None if the camera
+                       doesn't report what the thresholds are based on
+        """
+        if all(not isinstance(threshold, tuple) for _, threshold, _ in self.levels):
+            return self
+        levels = []
+        for level, threshold, priority in self.levels:
+            if isinstance(threshold, tuple):
+                field, offset = threshold
+                base = registration.get(field) if registration else None
+                if base is None:
+                    return None
+                threshold = base + offset
+            levels.append((level, threshold, priority))
+        return LevelRule(self.name, self.field, levels, self.direction, self.hysteresis,
+                         self.title, self.message, self.tags)
+
+    def evaluate(self, value, current):
+        """
+        Returns:
+            int: Index of the level the value is at (-1 = fine), holding
+                 levels up to `current` until cleared by the hysteresis
+        """
+        value = self.sign * value
+        level = -1
+        for i, (_, threshold, _) in enumerate(self.levels):
+            limit = self.sign * threshold + (self.hysteresis if i <= current else 0)
+            if value <= limit:
+                level = i
+        return level
+
+
+def compile_rules(config):
+    """
+    Build the status rules from config.yaml (done once at startup)
+
+    Returns:
+        list: LevelRule objects for the enabled rules
+    """
+    rules = []
+    if config.get('BatteryWarningEnabled', False):
+        rules.append(LevelRule(
+            'battery', 'BatPercent',
+            [('low', config.get('BatteryWarningLow', 25), 'high'),
+             ('critical', config.get('BatteryWarningCritical', 10), 'urgent')],
+            direction='below',
+            hysteresis=config.get('BatteryWarningHysteresis', 2),
+            title="Arlo Battery {LEVEL}",
+            message="Battery {LEVEL}: {camera} at {value}%",
+            tags="warning,battery"))
+    if config.get('TemperatureWarningEnabled', False):
+        # Warn this many degrees before the camera shuts itself down
+        margin = config.get('TemperatureWarningMargin', 5)
+        hysteresis = config.get('TemperatureWarningHysteresis', 2)
+        rules.append(LevelRule(
+            'temperature_high', 'Temperature',
+            [('hot', ('ThermalShutdownMaxTemp', -margin), 'high'),
+             ('shutdown', ('ThermalShutdownMaxTemp', 0), 'urgent')],
+            direction='above', hysteresis=hysteresis,
+            title="Arlo Temperature {LEVEL}",
+            message="Temperature {LEVEL}: {camera} at {value}°C (limit {threshold}°C)",
+            tags="warning,thermometer"))
+        rules.append(LevelRule(
+            'temperature_low', 'Temperature',
+            [('cold', ('ThermalShutdownMinTemp', margin), 'high'),
+             ('shutdown', ('ThermalShutdownMinTemp', 0), 'urgent')],
+            direction='below', hysteresis=hysteresis,
+            title="Arlo Temperature {LEVEL}",
+            message="Temperature {LEVEL}: {camera} at {value}°C (limit {threshold}°C)",
+            tags="warning,snowflake"))
+    if config.get('SignalWarningEnabled', False):
+        rules.append(LevelRule(
+            'signal', 'SignalStrengthIndicator',
+            [('weak', config.get('SignalWarningBelow', 1), 'default')],
+            direction='below',
+            hysteresis=config.get('SignalWarningHysteresis', 1),
+            title="Arlo Signal {LEVEL}",
+            message="Signal {LEVEL}: {camera} at {value} bars",
+            tags="warning,signal_strength"))
+    return rules
+
+
+class AlertRuleEngine:
+    """Turns status messages into battery, temperature, signal and offline alerts
+
+    Rules are compiled from config once; on each status only the camera's
+    own (bound) rules are evaluated, and a notification is sent when a
+    camera moves to a worse level. A camera that recovers and crosses the
+    same level again within AlertRuleCooldown seconds isn't re-notified.
+    A camera that sends nothing for OfflineWarningMinutes raises an
+    offline alert. Levels are kept in SQLite so a restart doesn't repeat
+    alerts that were already sent.
+    """
+
+    def __init__(self, config, notify, db_path='arlo.db'):
+        """
+        Args:
+            config: Parsed config.yaml
+            notify: Called as notify(kind, title, message, priority, tags, log)
+            db_path: SQLite database holding the rule state
+        """
+        self.rules = compile_rules(config)
+        self.cooldown = config.get('AlertRuleCooldown', 3600)
+        self.offline_after = (config.get('OfflineWarningMinutes', 30) * 60
+                              if config.get('OfflineWarningEnabled', False) else None)
+        self.notify = notify
+        self.db_path = db_path
+
+        self.lock = threading.Lock()
+        self.bound = {}  # serial -> [LevelRule] with this camera's thresholds
+        self.state = {}  # (serial, rule) -> {"level", "value", "since", "last_sent", "last_sent_level"}
+        self.last_seen = {}  # serial -> (unix time, camera name)
+        self.thread = None
+
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("""CREATE TABLE IF NOT EXISTS alert_rule_state (
+                serialnumber TEXT NOT NULL,
+                rule TEXT NOT NULL,
+                level INTEGER NOT NULL,
+                value REAL,
+                since REAL,
+                last_sent REAL,
+                last_sent_level INTEGER,
+                PRIMARY KEY (serialnumber, rule))""")
+            conn.commit()
+            for serial, rule, level, value, since, last_sent, last_sent_level in c.execute("SELECT * FROM alert_rule_state"):
+                self.state[(serial, rule)] = {"level": level, "value": value, "since": since,
+                                              "last_sent": last_sent, "last_sent_level": last_sent_level}
+
+    def start(self):
+        """Start watching for cameras that stop reporting"""
+        if self.offline_after is None:
+            return
+        # Seed "last seen" from the camera table (a Julian day) so the
+        # offline rule works straight after a restart
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute("SELECT serialnumber, COALESCE(friendlyname, hostname, serialnumber), last_seen "
+                                "FROM camera WHERE last_seen IS NOT NULL").fetchall()
+        with self.lock:
+            for serial, name, last_seen in rows:
+                self.last_seen.setdefault(serial, ((last_seen - 2440587.5) * 86400, name))
+        self.thread = threading.Thread(target=self._sweep, name='alert-rules', daemon=True)
+        self.thread.start()
+
+    def on_registration(self, camera):
+        """Re-bind the camera's rules (thresholds may depend on its registration)"""
+        with self.lock:
+            self.bound.pop(camera.serial_number, None)
+        self.seen(camera)
+
+    def on_status(self, camera, status):
+        """Evaluate the camera's rules against a status message"""
+        self.seen(camera)
+        camera_name = camera.friendly_name or camera.hostname or camera.serial_number
+        changes = []
+        with self.lock:
+            rules = self.bound.get(camera.serial_number)
+            if rules is None:
+                registration = camera.registration.dictionary if camera.registration else None
+                rules = [bound for bound in (rule.bind(registration) for rule in self.rules) if bound is not None]
+                self.bound[camera.serial_number] = rules
+            now = time.time()
+            for rule in rules:
+                value = status.dictionary.get(rule.field)
+                if value is None:
+                    continue
+                key = (camera.serial_number, rule.name)
+                state = self.state.get(key)
+                current = state["level"] if state else -1
+                level = rule.evaluate(value, current)
+                if level == current:
+                    continue
+                state = self._transition(key, state, level, value, now)
+                changes.append((rule, level, value, state["worse"], state["sent"]))
+
+        for rule, level, value, worse, sent in changes:
+            self._announce(camera.serial_number, camera_name, rule, level, value, worse, sent)
+
+    def seen(self, camera):
+        """Note that a camera has just been heard from"""
+        serial = camera.serial_number
+        camera_name = camera.friendly_name or camera.hostname or serial
+        with self.lock:
+            self.last_seen[serial] = (time.time(), camera_name)
+            state = self.state.get((serial, 'offline'))
+            if state is None or state["level"] < 0:
+                return
+            state = self._transition((serial, 'offline'), state, -1, None, time.time())
+        s_print(f"[ALERTS] {camera_name} is back online")
+        event_bus.publish('alert_rule', serial_number=serial, rule='offline', level=None, value=None)
+
+    def get_state(self):
+        with self.lock:
+            return {
+                "rules": [rule.name for rule in self.rules] + (['offline'] if self.offline_after else []),
+                "cameras": {
+                    serial: {rule: dict(state) for (s, rule), state in self.state.items() if s == serial}
+                    for serial in {s for s, _ in self.state}
+                }
+            }
+
+    def _transition(self, key, state, level, value, now):
+        """
+        Record a level change (under the lock)
+
+        Returns:
+            dict: Copy of the state, with "worse" set if the level went up and
+                  "sent" if that should be notified
+        """
+        if state is None:
+            state = {"level": -1, "value": None, "since": now, "last_sent": None, "last_sent_level": None}
+            self.state[key] = state
+        worse = level > state["level"]
+        state["level"] = level
+        state["value"] = value
+        state["since"] = now
+        # Notify on getting worse, unless this level was already sent within the cooldown
+        sent = worse and (state["last_sent"] is None or state["last_sent_level"] is None
+                          or level > state["last_sent_level"] or now - state["last_sent"] >= self.cooldown)
+        if sent:
+            state["last_sent"] = now
+            state["last_sent_level"] = level
+        self._save(key, state)
+        state = dict(state)
+        state["worse"] = worse
+        state["sent"] = sent
+        return state
+
+    def _announce(self, serial, camera_name, rule, level, value, worse, sent):
+        if level < 0:
+            s_print(f"[ALERTS] {camera_name} {rule.name} recovered ({rule.field} {value})")
+            event_bus.publish('alert_rule', serial_number=serial, rule=rule.name, level=None, value=value)
+            return
+        level_name, threshold, priority = rule.levels[level]
+        event_bus.publish('alert_rule', serial_number=serial, rule=rule.name, level=level_name, value=value)
+        if not worse:
+            s_print(f"[ALERTS] {camera_name} {rule.name} improved to {level_name} ({rule.field} {value})")
+            return
+        if not sent:
+            s_print(f"[ALERTS] {camera_name} {rule.name} {level_name} ({rule.field} {value}) - within cooldown, not notifying")
+            return
+        fields = {"camera": camera_name, "value": value, "level": level_name, "LEVEL": level_name.upper(),
+                  "threshold": threshold}
+        message = rule.message.format(**fields)
+        tags = rule.tags + (",rotating_light" if level == len(rule.levels) - 1 and len(rule.levels) > 1 else "")
+        self.notify(f"ntfy_{rule.name}", rule.title.format(**fields), message, priority, tags,
+                    f"[ALERTS] {message}")
+
+    def _save(self, key, state):
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("INSERT OR REPLACE INTO alert_rule_state VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             key + (state["level"], state["value"], state["since"],
+                                    state["last_sent"], state["last_sent_level"]))
+                conn.commit()
+        except sqlite3.Error as e:
+            s_print(f"[ALERTS] Could not save rule state: {e}")
+
+    def _sweep(self):
+        interval = min(OFFLINE_SWEEP_INTERVAL, self.offline_after / 4)
+        offline = LevelRule('offline', 'last_seen', [('offline', self.offline_after, 'high')], direction='above',
+                            title="Arlo Camera Offline",
+                            message="Camera offline: {camera} not seen for {value} min",
+                            tags="warning,no_entry")
+        while True:
+            time.sleep(interval)
+            now = time.time()
+            changes = []
+            with self.lock:
+                for serial, (last_seen, camera_name) in self.last_seen.items():
+                    key = (serial, 'offline')
+                    state = self.state.get(key)
+                    if now - last_seen < self.offline_after or (state is not None and state["level"] >= 0):
+                        continue
+                    minutes = int((now - last_seen) / 60)
+                    state = self._transition(key, state, 0, minutes, now)
+                    changes.append((serial, camera_name, minutes, state["sent"]))
+            for serial, camera_name, minutes, sent in changes:
+                self._announce(serial, camera_name, offline, 0, minutes, True, sent)
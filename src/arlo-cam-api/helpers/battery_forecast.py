@@ -0,0 +1,216 @@
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from helpers.safe_print import s_print
+
+# Fewest discharge samples, and shortest span, a drain rate is fitted from
+MIN_SAMPLES = 3
+MIN_SPAN = 3600  # seconds
+# History older than this is pruned (checked at most once an hour)
+PRUNE_INTERVAL = 3600  # seconds
+
+
+class BatteryForecaster:
+    """Battery drain rates and run-out predictions from status history
+
+    Every status message adds a row to the status_history table. For each
+    camera the current discharge segment (samples since it last charged or
+    its percentage jumped up) is fitted with a least-squares line, giving a
+    drain rate in %/hour and a predicted time the battery runs out. The
+    fits for all cameras are computed together as grouped NumPy sums. A
+    camera draining much faster than its own SecsPerPercentAvg, or than the
+    other cameras, is flagged; a rising WifiConnectionCount alongside it
+    usually means a Wi-Fi reconnect loop.
+
+    Results are cached. get_forecast() only refits cameras that have
+    reported since the last refresh, and at most every `refresh` seconds.
+    """
+
+    def __init__(self, config, db_path='arlo.db'):
+        self.window = config.get('BatteryForecastWindowDays', 7) * 86400
+        self.retention = config.get('BatteryHistoryDays', 30) * 86400
+        self.refresh = config.get('BatteryForecastRefresh', 300)
+        self.abnormal_factor = config.get('BatteryAbnormalDrainFactor', 3)
+        self.db_path = db_path
+
+        self.lock = threading.Lock()
+        self.dirty = set()  # serials with samples newer than their cached fit
+        self.fits = {}  # serial -> per-camera forecast dict
+        self.refreshed = 0
+        self.pruned = 0
+        self.cache = None
+
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("""CREATE TABLE IF NOT EXISTS status_history (
+                serialnumber TEXT NOT NULL,
+                time REAL NOT NULL,
+                bat_percent REAL,
+                bat_volt REAL,
+                secs_per_percent REAL,
+                charging INTEGER,
+                wifi_connections INTEGER)""")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_status_history ON status_history (serialnumber, time)")
+            conn.commit()
+            c.execute("SELECT DISTINCT serialnumber FROM status_history")
+            self.dirty.update(serial for (serial,) in c.fetchall())
+
+    def record(self, serial_number, status):
+        """Store the battery fields of a status message"""
+        d = status.dictionary
+        if d.get('BatPercent') is None:
+            return
+        now = time.time()
+        charging = d.get('ChargingState') not in (None, 'Off')
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute("INSERT INTO status_history VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (serial_number, now, d.get('BatPercent'), d.get('Bat1Volt'),
+                              d.get('SecsPerPercentAvg'), int(charging), d.get('WifiConnectionCount')))
+                if now - self.pruned > PRUNE_INTERVAL:
+                    conn.execute("DELETE FROM status_history WHERE time < ?", (now - self.retention,))
+                    self.pruned = now
+                conn.commit()
+        except sqlite3.Error as e:
+            s_print(f"[BATTERY] Could not store status history: {e}")
+            return
+        with self.lock:
+            self.dirty.add(serial_number)
+
+    def get_forecast(self, serial_number=None):
+        """
+        Cached forecast, refitting cameras with new samples when it's stale
+
+        Args:
+            serial_number: Only this camera's forecast (None for all)
+
+        Returns:
+            dict: {"generated", "fleet_median_rate", "cameras": {serial: forecast}},
+                  or a single camera's forecast (None if it has no history)
+        """
+        with self.lock:
+            if self.cache is None or (self.dirty and time.time() - self.refreshed >= self.refresh):
+                self._refresh()
+            if serial_number is not None:
+                return self.cache["cameras"].get(serial_number)
+            return self.cache
+
+    def _refresh(self):
+        """Refit the dirty cameras and re-rank the fleet (under the lock)"""
+        now = time.time()
+        serials = sorted(self.dirty)
+        self.dirty.clear()
+        if serials:
+            rows = self._load(serials, now - self.window)
+            fitted = fit_drain(rows, serials) if rows else {}
+            for serial in serials:
+                if serial in fitted:
+                    self.fits[serial] = fitted[serial]
+                else:
+                    self.fits.pop(serial, None)
+
+        rates = np.array([f["drain_rate"] for f in self.fits.values() if f["drain_rate"] is not None])
+        fleet_median = float(np.median(rates)) if rates.size else None
+        cameras = {}
+        for serial, fit in self.fits.items():
+            forecast = dict(fit)
+            rate = fit["drain_rate"]
+            if rate is not None and rate > 0:
+                forecast["empty_at"] = fit["time"] + fit["percent"] / rate * 3600
+                forecast["hours_left"] = round(max(0, forecast["empty_at"] - now) / 3600, 1)
+            else:
+                forecast["empty_at"] = forecast["hours_left"] = None
+            # Faster than the camera's own average, or than the rest of the fleet
+            baseline = fit["expected_rate"] if fit["expected_rate"] else fleet_median
+            forecast["abnormal"] = bool(rate is not None and baseline and rate > baseline * self.abnormal_factor)
+            cameras[serial] = forecast
+
+        self.cache = {"generated": now, "fleet_median_rate": fleet_median, "cameras": cameras}
+        self.refreshed = now
+
+    def _load(self, serials, since):
+        placeholders = ','.join('?' * len(serials))
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                return conn.execute(
+                    f"SELECT serialnumber, time, bat_percent, bat_volt, secs_per_percent, charging, wifi_connections "
+                    f"FROM status_history WHERE serialnumber IN ({placeholders}) AND time >= ? "
+                    f"ORDER BY serialnumber, time", (*serials, since)).fetchall()
+        except sqlite3.Error as e:
+            s_print(f"[BATTERY] Could not read status history: {e}")
+            return []
+
+
+def fit_drain(rows, serials):
+    """
+    Least-squares drain rate over each camera's current discharge segment
+
+    Args:
+        rows: (serial, time, percent, volt, secs_per_percent, charging,
+              wifi_connections) tuples ordered by serial then time
+        serials: Sorted serials the rows belong to
+
+    Returns:
+        dict: serial -> {"percent", "volt", "time", "samples", "span_hours",
+              "drain_rate" (%/hour, None if too little data), "expected_rate",
+              "wifi_reconnects"}
+    """
+    index = {serial: i for i, serial in enumerate(serials)}
+    group = np.fromiter((index[r[0]] for r in rows), dtype=np.int64, count=len(rows))
+    data = np.array([r[1:] for r in rows], dtype=np.float64)  # None -> nan
+    t, percent, volt, secs_per_percent, charging, wifi = data.T
+
+    # A segment starts at each camera's first row, while charging, or where
+    # the percentage went up (charged, or a new battery)
+    start = np.ones(len(rows), dtype=bool)
+    start[1:] = (group[1:] != group[:-1]) | (charging[1:] > 0) | (np.diff(percent) > 1)
+    segment = np.cumsum(start)
+    last_segment = np.zeros(len(serials), dtype=np.int64)
+    np.maximum.at(last_segment, group, segment)
+    keep = (segment == last_segment[group]) & (charging == 0)
+
+    g, t_k, p_k = group[keep], t[keep], percent[keep]
+    groups = len(serials)
+    # Time from each camera's first sample keeps the sums well conditioned
+    first = np.full(groups, np.inf)
+    np.minimum.at(first, g, t_k)
+    x = t_k - first[g]
+    n = np.bincount(g, minlength=groups).astype(np.float64)
+    sx = np.bincount(g, x, groups)
+    sy = np.bincount(g, p_k, groups)
+    sxx = np.bincount(g, x * x, groups)
+    sxy = np.bincount(g, x * p_k, groups)
+    span = np.zeros(groups)
+    np.maximum.at(span, g, x)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)  # %/second
+
+    # Latest reading per camera (rows are time-ordered within a camera)
+    last = np.full(groups, -1)
+    np.maximum.at(last, group, np.arange(len(rows)))
+    wifi_min = np.full(groups, np.inf)
+    np.minimum.at(wifi_min, g, np.where(np.isnan(wifi[keep]), np.inf, wifi[keep]))
+
+    result = {}
+    for i, serial in enumerate(serials):
+        j = last[i]
+        if j < 0:
+            continue
+        fitted = n[i] >= MIN_SAMPLES and span[i] >= MIN_SPAN and np.isfinite(slope[i])
+        reconnects = wifi[j] - wifi_min[i] if np.isfinite(wifi_min[i]) and not np.isnan(wifi[j]) else None
+        result[serial] = {
+            "percent": float(percent[j]),
+            "volt": None if np.isnan(volt[j]) else float(volt[j]),
+            "time": float(t[j]),
+            "charging": bool(charging[j]),
+            "samples": int(n[i]),
+            "span_hours": round(float(span[i]) / 3600, 2),
+            "drain_rate": round(float(-slope[i] * 3600), 3) if fitted else None,
+            # Camera-reported average discharge, as %/hour
+            "expected_rate": round(3600 / secs_per_percent[j], 3) if secs_per_percent[j] > 0 else None,
+            "wifi_reconnects": None if reconnects is None else int(reconnects)
+        }
+    return result
@@ -0,0 +1,145 @@
+import collections
+import random
+import threading
+import time
+
+from helpers.metrics import registry, send_message_retries
+
+# Set by server.py from config.yaml
+MIN_TIMEOUT = 1.0  # seconds - floor for cameras that answer quickly
+MAX_TIMEOUT = 15.0  # seconds - ceiling, even for a camera waking from sleep
+DEFAULT_TIMEOUT = 5.0  # seconds - until a camera has answered a few times
+CONNECT_RETRIES = 2  # extra connect attempts for a camera that may be asleep
+RETRY_BASE = 0.5  # seconds - first retry delay, doubled each attempt (with jitter)
+AWAKE_WINDOW = 10.0  # seconds after an ack that a camera is assumed still awake
+
+# Round trips kept per camera for percentiles
+SAMPLES = 100
+
+
+class CameraLatency:
+    """Round-trip times and failures of send_message, per camera
+
+    Timeouts follow TCP's retransmission timer: a smoothed round trip
+    (EWMA) plus four times its mean deviation, clamped to
+    [MIN_TIMEOUT, MAX_TIMEOUT]. A camera that answers in 50 ms fails fast
+    instead of holding a command for 5 s; each timeout doubles the next
+    one until the camera answers again, so a sleeping camera gets the time
+    it needs to wake.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cameras = {}  # serial -> per-camera stats dict
+
+    def _stats(self, serial):
+        stats = self.cameras.get(serial)
+        if stats is None:
+            stats = self.cameras[serial] = {
+                "srtt": None,
+                "rttvar": None,
+                "backoff": 1,
+                "samples": collections.deque(maxlen=SAMPLES),
+                "sent": 0,
+                "failures": collections.Counter(),
+                "retries": 0,
+                "last_success": None
+            }
+        return stats
+
+    def timeout(self, serial, attempt=0):
+        """Socket timeout for connect attempt `attempt` (0-based) of the next message (seconds)"""
+        with self.lock:
+            stats = self._stats(serial)
+            timeout = _timeout(stats)
+            if stats["last_success"] is None or time.time() - stats["last_success"] > AWAKE_WINDOW:
+                timeout = max(timeout, DEFAULT_TIMEOUT)
+            return min(MAX_TIMEOUT, timeout * 2 ** attempt)
+
+    def attempts(self):
+        """Connect attempts per message (the first plus CONNECT_RETRIES)"""
+        return CONNECT_RETRIES + 1
+
+    def retry_delay(self, attempt):
+        """Seconds to wait before connect attempt `attempt` (1-based), with jitter"""
+        return RETRY_BASE * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+    def success(self, serial, rtt):
+        """Record a message acked after `rtt` seconds"""
+        with self.lock:
+            stats = self._stats(serial)
+            stats["sent"] += 1
+            stats["samples"].append(rtt)
+            if stats["srtt"] is None:
+                stats["srtt"], stats["rttvar"] = rtt, rtt / 2
+            else:
+                stats["rttvar"] = 0.75 * stats["rttvar"] + 0.25 * abs(stats["srtt"] - rtt)
+                stats["srtt"] = 0.875 * stats["srtt"] + 0.125 * rtt
+            stats["backoff"] = 1
+            stats["last_success"] = time.time()
+
+    def failure(self, serial, reason):
+        """Record a failed message; timeouts back off the next attempt"""
+        with self.lock:
+            stats = self._stats(serial)
+            stats["sent"] += 1
+            stats["failures"][reason] += 1
+            if reason in ('connect', 'no_ack'):
+                stats["backoff"] = min(stats["backoff"] * 2, 8)
+
+    def retried(self, serial):
+        with self.lock:
+            self._stats(serial)["retries"] += 1
+        send_message_retries.inc(serial_number=serial)
+
+    def get_state(self, serial=None):
+        """
+        Returns:
+            dict: Timeout, EWMA, percentiles and failure counts for one
+                  camera, or {serial: ...} for all of them
+        """
+        with self.lock:
+            if serial is not None:
+                return self._describe(self.cameras[serial]) if serial in self.cameras else None
+            return {s: self._describe(stats) for s, stats in self.cameras.items()}
+
+    def _describe(self, stats):
+        samples = sorted(stats["samples"])
+
+        def percentile(p):
+            if not samples:
+                return None
+            return round(samples[min(len(samples) - 1, int(p / 100 * len(samples)))], 4)
+
+        srtt = stats["srtt"]
+        return {
+            "timeout": round(_timeout(stats), 3),
+            "srtt": None if srtt is None else round(srtt, 4),
+            "rttvar": None if srtt is None else round(stats["rttvar"], 4),
+            "backoff": stats["backoff"],
+            "p50": percentile(50),
+            "p90": percentile(90),
+            "p99": percentile(99),
+            "sent": stats["sent"],
+            "failures": dict(stats["failures"]),
+            "retries": stats["retries"],
+            "last_success": stats["last_success"]
+        }
+
+    def timeouts(self):
+        """Current timeout per camera, for /metrics"""
+        with self.lock:
+            return {(serial,): _timeout(stats) for serial, stats in self.cameras.items()}
+
+
+def _timeout(stats):
+    if stats["srtt"] is None:
+        timeout = DEFAULT_TIMEOUT
+    else:
+        timeout = stats["srtt"] + 4 * stats["rttvar"]
+    return min(MAX_TIMEOUT, max(MIN_TIMEOUT, timeout) * stats["backoff"])
+
+
+camera_latency = CameraLatency()
+registry.gauge('arlo_send_message_timeout_seconds', 'Adaptive send_message timeout per camera',
+               ['serial_number'], callback=camera_latency.timeouts)
@@ -0,0 +1,144 @@
+import collections
+import concurrent.futures
+import threading
+import time
+import uuid
+
+from helpers.event_bus import event_bus
+from helpers.safe_print import s_print
+
+# How long finished commands (and their idempotency keys) are remembered
+COMMAND_RETENTION = 3600  # seconds
+
+
+class CommandQueue:
+    """Runs camera commands in the background and keeps their outcome
+
+    Commands for the same camera run one at a time in submission order (an
+    arm followed by a disarm must reach the camera in that order); commands
+    for different cameras run in parallel. A command submitted again with
+    the same idempotency key returns the original command instead of
+    running twice. A command is only "succeeded" if the camera
+    acknowledged it; a job answering {"result": false} (no ack, or the
+    connection failed) is "failed".
+    """
+
+    def __init__(self, workers=8):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='command')
+        self.lock = threading.Lock()
+        self.commands = collections.OrderedDict()  # id -> record
+        self.idempotency_keys = {}  # key -> id
+        self.key_for = {}  # id -> idempotency key, for commands submitted with one
+        self.finished = collections.deque()  # (finished time, id) in the order commands finished
+        self.pending = {}  # serial -> deque of (record, job)
+        self.done_events = {}  # id -> threading.Event
+
+    def submit(self, serial, name, job, idempotency_key=None):
+        """
+        Queue job() for a camera
+
+        Returns:
+            tuple: (command record, True if newly queued / False if the
+                    idempotency key matched an earlier command)
+        """
+        with self.lock:
+            self._prune()
+            if idempotency_key is not None:
+                key = (serial, name, idempotency_key)
+                existing = self.idempotency_keys.get(key)
+                if existing is not None and existing in self.commands:
+                    return dict(self.commands[existing]), False
+
+            record = {
+                "id": uuid.uuid4().hex,
+                "serial_number": serial,
+                "command": name,
+                "status": "queued",
+                "result": None,
+                "http_status": None,
+                "error": None,
+                "created": time.time(),
+                "finished": None
+            }
+            self.commands[record["id"]] = record
+            self.done_events[record["id"]] = threading.Event()
+            if idempotency_key is not None:
+                self.idempotency_keys[key] = record["id"]
+                self.key_for[record["id"]] = key
+
+            queue = self.pending.get(serial)
+            start_worker = queue is None
+            if start_worker:
+                queue = self.pending[serial] = collections.deque()
+            queue.append((record, job))
+            # The worker may start on it straight away - hand out a snapshot
+            accepted = dict(record)
+
+        if start_worker:
+            self.executor.submit(self._drain, serial)
+        return accepted, True
+
+    def _drain(self, serial):
+        while True:
+            with self.lock:
+                queue = self.pending[serial]
+                if not queue:
+                    del self.pending[serial]
+                    return
+                record, job = queue.popleft()
+                record["status"] = "running"
+
+            outcome = {}
+            try:
+                http_status, result = job()
+                outcome["http_status"] = http_status
+                outcome["result"] = result
+                if http_status >= 400:
+                    outcome["status"] = "failed"
+                elif isinstance(result, dict) and result.get("result") is False:
+                    # Camera calls answer False when the send failed or wasn't acked
+                    outcome["error"] = "Camera did not acknowledge the command"
+                    outcome["status"] = "failed"
+                else:
+                    outcome["status"] = "succeeded"
+            except Exception as e:
+                s_print(f"[COMMAND] {record['command']} for {serial} raised: {e}")
+                outcome["error"] = str(e)
+                outcome["status"] = "failed"
+            outcome["finished"] = time.time()
+
+            with self.lock:
+                record.update(outcome)
+                self.finished.append((record["finished"], record["id"]))
+                finished = dict(record)
+                done = self.done_events[record["id"]]
+            done.set()
+            event_bus.publish('command_finished', **finished)
+
+    def get(self, command_id):
+        with self.lock:
+            record = self.commands.get(command_id)
+            return dict(record) if record is not None else None
+
+    def wait(self, command_id, timeout=None):
+        """Block until a command has finished; returns its record"""
+        with self.lock:
+            done = self.done_events.get(command_id)
+        if done is not None:
+            done.wait(timeout)
+        return self.get(command_id)
+
+    def _prune(self):
+        # Called with the lock held. Walks finished commands oldest first and
+        # stops at the first one still retained; a command still queued or
+        # hung isn't in self.finished, so it never holds the others back
+        cutoff = time.time() - COMMAND_RETENTION
+        while self.finished and self.finished[0][0] <= cutoff:
+            _, command_id = self.finished.popleft()
+            del self.commands[command_id]
+            del self.done_events[command_id]
+            key = self.key_for.pop(command_id, None)
+            if key is not None and self.idempotency_keys.get(key) == command_id:
+                del self.idempotency_keys[key]
+
+command_queue = CommandQueue()
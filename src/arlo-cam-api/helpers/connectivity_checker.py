@@ -1,60 +1,284 @@
-import subprocess
+import socket
 import sqlite3
+import struct
 import threading
 import time
 import logging
+from helpers.status_view import status_view
+from helpers.event_bus import event_bus
 
-def check_arp(mac_address):
-    """Check if MAC address is in ARP table"""
-    try:
-        result = subprocess.run(
-            ['arp', '-n'],
-            capture_output=True,
-            text=True,
-            timeout=1
-        )
-        return mac_address.lower() in result.stdout.lower()
-    except Exception as e:
-        logging.error(f"[CONNECTIVITY] Error checking ARP: {e}")
-        return False
-
-def update_camera_connectivity():
-    """Update connectivity status for all cameras in database"""
+DB_PATH = '/opt/arlo-cam-api/arlo.db'
+ARP_TABLE = '/proc/net/arp'
+
+# /proc/net/arp flag for a resolved entry (ATF_COM); unresolved entries
+# show up as 0x0 with an all-zero MAC
+ATF_COM = 0x2
+
+# rtnetlink neighbour messages (linux/rtnetlink.h, linux/neighbour.h)
+RTMGRP_NEIGH = 0x4
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+NDA_DST = 1
+NDA_LLADDR = 2
+NUD_INCOMPLETE = 0x01
+NUD_FAILED = 0x20
+NLMSG_HEADER = struct.Struct('=LHHLL')
+NDMSG = struct.Struct('=BxxxiHBB')
+RTATTR = struct.Struct('=HH')
+
+
+def read_arp_table(path=ARP_TABLE):
+    """
+    Parse the kernel ARP table in one read
+
+    Returns:
+        dict: {mac (lower case): {"ip", "device", "reachable"}}
+    """
+    table = {}
     try:
-        with sqlite3.connect('/opt/arlo-cam-api/arlo.db') as conn:
-            c = conn.cursor()
-            
-            # Get all cameras with MAC addresses
-            c.execute("SELECT serialnumber, mac_address, friendlyname FROM camera WHERE mac_address IS NOT NULL")
-            cameras = c.fetchall()
-            
-            for serial, mac, friendly_name in cameras:
-                if mac:
-                    connected = 1 if check_arp(mac) else 0
-                    c.execute("UPDATE camera SET connected = ? WHERE serialnumber = ?", (connected, serial))
-                    status_str = "Connected" if connected else "Offline"
-                    logging.info(f"[CONNECTIVITY] {friendly_name} ({serial}): {status_str}")
-            
-            conn.commit()
-            
-    except Exception as e:
-        logging.error(f"[CONNECTIVITY] Error updating connectivity: {e}")
+        with open(path) as f:
+            next(f, None)  # header
+            for line in f:
+                fields = line.split()
+                if len(fields) < 6:
+                    continue
+                ip, _, flags, mac, _, device = fields[:6]
+                reachable = bool(int(flags, 16) & ATF_COM)
+                if reachable:
+                    table[mac.lower()] = {"ip": ip, "device": device, "reachable": reachable}
+    except (OSError, ValueError) as e:
+        logging.error(f"[CONNECTIVITY] Error reading {path}: {e}")
+    return table
+
+
+def parse_neighbour_messages(data):
+    """
+    Decode rtnetlink neighbour messages
+
+    Returns:
+        list: (ip, mac or None, reachable) per RTM_NEWNEIGH/RTM_DELNEIGH message
+    """
+    events = []
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, msg_type = NLMSG_HEADER.unpack_from(data, offset)[:2]
+        if length < NLMSG_HEADER.size:
+            break
+        if msg_type in (RTM_NEWNEIGH, RTM_DELNEIGH):
+            body = offset + NLMSG_HEADER.size
+            family, _, state, _, _ = NDMSG.unpack_from(data, body)
+            ip = mac = None
+            attr = body + NDMSG.size
+            end = offset + length
+            while attr + RTATTR.size <= end:
+                attr_len, attr_type = RTATTR.unpack_from(data, attr)
+                if attr_len < RTATTR.size:
+                    break
+                value = data[attr + RTATTR.size:attr + attr_len]
+                if attr_type == NDA_DST and family == socket.AF_INET:
+                    ip = socket.inet_ntoa(value)
+                elif attr_type == NDA_LLADDR and len(value) == 6:
+                    mac = ':'.join(f'{b:02x}' for b in value)
+                attr += (attr_len + 3) & ~3
+            if ip is not None:
+                reachable = msg_type == RTM_NEWNEIGH and not state & (NUD_INCOMPLETE | NUD_FAILED)
+                events.append((ip, mac, reachable))
+        offset += (length + 3) & ~3
+    return events
+
+
+def set_camera_connected(c, serial, friendly_name, connected):
+    """Write a camera's new connectivity and announce it"""
+    c.execute("UPDATE camera SET connected = ? WHERE serialnumber = ?", (connected, serial))
+    status_str = "Connected" if connected else "Offline"
+    logging.info(f"[CONNECTIVITY] {friendly_name} ({serial}): {status_str}")
+    event_bus.publish('connectivity', serial_number=serial, friendly_name=friendly_name, connected=bool(connected))
+
+
+class NeighbourWatcher(threading.Thread):
+    """Reports kernel neighbour (ARP) changes as they happen via rtnetlink"""
+
+    def __init__(self, apply):
+        """
+        Args:
+            apply: Called with (mac, connected) for each neighbour event
+        """
+        super().__init__()
+        self.daemon = True
+        self.apply = apply
+        self.macs = {}  # ip -> mac, for FAILED/DEL messages that carry no MAC
+
+    def open(self):
+        """
+        Returns:
+            socket: Netlink socket subscribed to neighbour events, or None
+                    if netlink isn't available (non-Linux, no permission)
+        """
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_NEIGH))
+            return sock
+        except (AttributeError, OSError) as e:
+            logging.info(f"[CONNECTIVITY] Netlink neighbour events unavailable ({e}), using periodic checks only")
+            return None
+
+    def run(self, sock=None):
+        sock = sock or self.open()
+        if sock is None:
+            return
+        logging.info("[CONNECTIVITY] Watching netlink neighbour events")
+        self.macs = {entry["ip"]: mac for mac, entry in read_arp_table().items()}
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError as e:
+                logging.error(f"[CONNECTIVITY] Netlink receive failed: {e}")
+                time.sleep(5)
+                continue
+            for ip, mac, reachable in parse_neighbour_messages(data):
+                if mac is not None and mac != '00:00:00:00:00:00':
+                    self.macs[ip] = mac
+                mac = self.macs.get(ip)
+                if mac is not None:
+                    self.apply(mac, 1 if reachable else 0)
+
 
 class ConnectivityChecker(threading.Thread):
-    """Background thread that checks camera connectivity every 5 minutes"""
-    
-    def __init__(self):
+    """Background thread that keeps each camera's connected flag current
+
+    Cameras talk to the socket server on their own schedule, so any
+    message from a camera (note_traffic) is taken as proof it is up. Only
+    cameras that have been quiet for longer than their expected check-in
+    interval (learned from the gaps between their messages, `interval`
+    until known) are looked up in the ARP table, with one read per pass.
+    The camera table is only written when a camera's state changes.
+    """
+
+    def __init__(self, netlink=True, interval=300, tick=60, grace=1.5):
+        """
+        Args:
+            netlink: Also apply kernel neighbour events as they happen
+            interval: Check-in interval assumed until one is learned (seconds)
+            tick: Seconds between passes
+            grace: How many expected intervals a camera may be quiet for
+        """
         super().__init__()
         self.daemon = True
-        self.interval = 300  # 5 minutes in seconds
-        
+        self.interval = interval
+        self.tick = tick
+        self.grace = grace
+        self.lock = threading.Lock()
+        self.traffic = {}  # serial -> {"last": unix time, "gap": EWMA seconds between messages}
+        self.connected = {}  # serial -> connected flag as last seen in the camera table
+        # Passes and neighbour events read then write the camera table
+        self.write_lock = threading.Lock()
+        self.wake = threading.Event()
+        # Between passes, react to ARP changes as the kernel reports them
+        self.watcher = NeighbourWatcher(self.apply_neighbour) if netlink else None
+
+    def note_traffic(self, serial_number):
+        """Called for every message a camera sends"""
+        now = time.time()
+        with self.lock:
+            seen = self.traffic.get(serial_number)
+            if seen is None:
+                self.traffic[serial_number] = {"last": now, "gap": None}
+            else:
+                gap = now - seen["last"]
+                # Several messages in one burst don't tell us the check-in interval
+                if gap >= self.tick:
+                    seen["gap"] = gap if seen["gap"] is None else 0.7 * seen["gap"] + 0.3 * gap
+                seen["last"] = now
+            offline = self.connected.get(serial_number) == 0
+        if offline:
+            # Don't wait for the next pass to show it back online
+            self.wake.set()
+
+    def expected_interval(self, serial_number):
+        """Seconds a camera may stay quiet before it is probed"""
+        with self.lock:
+            seen = self.traffic.get(serial_number)
+            gap = seen["gap"] if seen is not None and seen["gap"] is not None else self.interval
+        return max(self.tick, min(gap, 3600)) * self.grace
+
+    def heard_from(self, serial_number, now=None):
+        """True if the camera has sent something within its expected interval"""
+        now = now or time.time()
+        with self.lock:
+            seen = self.traffic.get(serial_number)
+        return seen is not None and now - seen["last"] <= self.expected_interval(serial_number)
+
+    def apply_neighbour(self, mac, connected):
+        """
+        Apply a kernel neighbour event for the camera with this MAC
+
+        A camera that has sent traffic within its expected interval stays
+        connected: its ARP entry can go unreachable while it sleeps, and the
+        next pass would only flip it straight back.
+        """
+        try:
+            with self.write_lock, sqlite3.connect(DB_PATH) as conn:
+                c = conn.cursor()
+                c.execute("SELECT serialnumber, friendlyname, connected FROM camera WHERE lower(mac_address) = ?", (mac,))
+                row = c.fetchone()
+                if row is None:
+                    return
+                serial, friendly_name, was_connected = row
+                if not connected and self.heard_from(serial):
+                    return
+                with self.lock:
+                    self.connected[serial] = connected
+                if connected == was_connected:
+                    return
+                set_camera_connected(c, serial, friendly_name, connected)
+                conn.commit()
+            status_view.invalidate()
+        except Exception as e:
+            logging.error(f"[CONNECTIVITY] Error applying neighbour event: {e}")
+
+    def check(self):
+        """One pass: trust recent traffic, probe quiet cameras, write changes"""
+        try:
+            now = time.time()
+            arp_table = None
+            changed = False
+            with self.write_lock, sqlite3.connect(DB_PATH) as conn:
+                c = conn.cursor()
+
+                # Get all cameras with MAC addresses
+                c.execute("SELECT serialnumber, mac_address, friendlyname, connected FROM camera WHERE mac_address IS NOT NULL")
+                cameras = c.fetchall()
+
+                for serial, mac, friendly_name, was_connected in cameras:
+                    if not mac:
+                        continue
+                    if self.heard_from(serial, now):
+                        connected = 1
+                    else:
+                        # One read of the ARP table answers for every quiet camera
+                        if arp_table is None:
+                            arp_table = read_arp_table()
+                        connected = 1 if mac.lower() in arp_table else 0
+                    with self.lock:
+                        self.connected[serial] = connected
+                    if connected != was_connected:
+                        set_camera_connected(c, serial, friendly_name, connected)
+                        changed = True
+
+                if changed:
+                    conn.commit()
+            if changed:
+                status_view.invalidate()
+
+        except Exception as e:
+            logging.error(f"[CONNECTIVITY] Error updating connectivity: {e}")
+
     def run(self):
-        logging.info("[CONNECTIVITY] Connectivity checker started (5 minute interval)")
-        
-        # Do initial check immediately
-        update_camera_connectivity()
-        
-        # Then check every 5 minutes
+        logging.info(f"[CONNECTIVITY] Connectivity checker started ({self.tick}s passes)")
+        if self.watcher is not None:
+            self.watcher.start()
+
         while True:
-            time.sleep(self.interval)
-            update_camera_connectivity()
+            self.wake.clear()
+            self.check()
+            self.wake.wait(self.tick)
@@ -0,0 +1,228 @@
+import ctypes
+import ctypes.util
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+from helpers.safe_print import s_print
+from helpers.status_view import status_view
+
+# inotify(7) event masks
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+INOTIFY_EVENT = struct.Struct('iIII')
+# Used when inotify isn't available
+POLL_INTERVAL = 5  # seconds
+# dnsmasq rewrites the file in several writes; wait for it to settle
+SETTLE_DELAY = 0.2  # seconds
+
+
+def parse_leases(text):
+    """
+    Parse a dnsmasq lease file ("expiry mac ip hostname client-id" per line)
+
+    Returns:
+        dict: {mac (lower case): {"ip", "hostname", "expiry"}}
+    """
+    leases = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 4 or ':' not in fields[1]:
+            continue
+        expiry, mac, ip, hostname = fields[:4]
+        leases[mac.lower()] = {
+            "ip": ip,
+            "hostname": None if hostname == '*' else hostname,
+            "expiry": int(expiry) if expiry.isdigit() else 0
+        }
+    return leases
+
+
+class LeaseIndex:
+    """In-memory MAC/IP/hostname index of the dnsmasq DHCP leases
+
+    The lease file is followed with inotify (or polled where inotify isn't
+    available). On each change the index is rebuilt and cameras are
+    matched to leases: by their known MAC, else by IP, else by DHCP
+    hostname. A camera row is only written when its MAC or IP actually
+    changed, so after a DHCP renewal serial_for_ip() finds the camera at
+    its new address straight away.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.leases = {}  # mac -> {"ip", "hostname", "expiry"}
+        self.by_ip = {}  # ip -> mac
+        self.by_hostname = {}  # lower-case hostname -> mac
+        self.serial_by_mac = {}  # mac -> camera serial
+        self.lease_file = None
+        self.db_path = 'arlo.db'
+        self.thread = None
+
+    def start(self, lease_file, db_path='arlo.db'):
+        """Load the lease file and follow it from a background thread"""
+        self.lease_file = lease_file
+        self.db_path = db_path
+        # Watch before the first read so no change in between is missed
+        fd = self._inotify()
+        self.reload()
+        self.thread = threading.Thread(target=self._watch, args=(fd,), name='dhcp-leases', daemon=True)
+        self.thread.start()
+
+    def serial_for_ip(self, ip):
+        """
+        Returns:
+            str: Serial of the camera holding this IP's lease, or None
+        """
+        with self.lock:
+            mac = self.by_ip.get(ip)
+            return self.serial_by_mac.get(mac) if mac is not None else None
+
+    def match_camera(self, serial_number):
+        """Attach a lease to a newly registered camera (its lease came first)"""
+        if self.lease_file is None:
+            return
+        with self.lock:
+            if serial_number in self.serial_by_mac.values():
+                return
+        self._match_cameras()
+
+    def reload(self):
+        try:
+            with open(self.lease_file) as f:
+                leases = parse_leases(f.read())
+        except OSError as e:
+            s_print(f"[DHCP] Could not read {self.lease_file}: {e}")
+            return
+        with self.lock:
+            if leases == self.leases:
+                return
+            self.leases = leases
+            self.by_ip = {lease["ip"]: mac for mac, lease in leases.items()}
+            self.by_hostname = {lease["hostname"].lower(): mac for mac, lease in leases.items() if lease["hostname"]}
+        self._match_cameras()
+
+    def _match_cameras(self):
+        """Write MAC/IP changes to camera rows (only the ones that changed)"""
+        try:
+            changed = False
+            with sqlite3.connect(self.db_path) as conn:
+                c = conn.cursor()
+                c.execute("SELECT serialnumber, ip, hostname, mac_address FROM camera")
+                cameras = c.fetchall()
+                with self.lock:
+                    leases, by_ip, by_hostname = self.leases, self.by_ip, self.by_hostname
+                # MACs cameras already have on record, so an IP that went to
+                # another camera's MAC isn't taken over by a stale row
+                owners = {stored_mac.lower(): serial for serial, _, _, stored_mac in cameras if stored_mac}
+                serial_by_mac = {}
+                for serial, ip, hostname, stored_mac in cameras:
+                    mac = stored_mac.lower() if stored_mac else None
+                    if mac not in leases:
+                        mac = self._fallback_mac(serial, ip, hostname, leases, by_ip, by_hostname,
+                                                 owners, serial_by_mac) or mac
+                    if mac is None:
+                        continue
+                    serial_by_mac[mac] = serial
+                    lease = leases.get(mac)
+                    new_ip = lease["ip"] if lease is not None else ip
+                    if mac == stored_mac and new_ip == ip:
+                        continue
+                    if new_ip != ip:
+                        # Same as persist(): no other camera keeps this IP
+                        c.execute("UPDATE camera SET ip = 'UNKNOWN' WHERE ip = ? AND serialnumber <> ?", (new_ip, serial))
+                        s_print(f"[DHCP] {serial} moved from {ip} to {new_ip}")
+                    c.execute("UPDATE camera SET mac_address = ?, ip = ? WHERE serialnumber = ?", (mac, new_ip, serial))
+                    changed = True
+                if changed:
+                    conn.commit()
+            with self.lock:
+                self.serial_by_mac = serial_by_mac
+            if changed:
+                status_view.invalidate()
+        except sqlite3.Error as e:
+            s_print(f"[DHCP] Could not update cameras from leases: {e}")
+
+    @staticmethod
+    def _fallback_mac(serial, ip, hostname, leases, by_ip, by_hostname, owners, serial_by_mac):
+        """
+        Lease for a camera whose recorded MAC has none: the lease at its IP,
+        else the lease with its DHCP hostname
+
+        The IP's lease is only used when its hostname is the camera's too,
+        or no other camera owns that MAC - otherwise the address has simply
+        been handed to another camera since this one was last seen.
+
+        Returns:
+            str: The lease's MAC, or None
+        """
+        hostname = (hostname or '').lower()
+        for mac in (by_ip.get(ip), by_hostname.get(hostname)):
+            if mac is None or serial_by_mac.get(mac, serial) != serial:
+                continue
+            lease_hostname = (leases[mac]["hostname"] or '').lower()
+            if (hostname and lease_hostname == hostname) or owners.get(mac, serial) == serial:
+                return mac
+        return None
+
+    def _watch(self, fd):
+        if fd is None:
+            s_print(f"[DHCP] inotify unavailable, polling {self.lease_file} every {POLL_INTERVAL}s")
+            self._poll()
+            return
+        name = os.path.basename(self.lease_file).encode()
+        while True:
+            try:
+                data = os.read(fd, 4096)
+            except OSError as e:
+                s_print(f"[DHCP] inotify read failed: {e}")
+                time.sleep(POLL_INTERVAL)
+                continue
+            offset = 0
+            relevant = False
+            while offset + INOTIFY_EVENT.size <= len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                event_name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0')
+                relevant = relevant or event_name == name
+                offset += INOTIFY_EVENT.size + length
+            if relevant:
+                time.sleep(SETTLE_DELAY)
+                self.reload()
+
+    def _inotify(self):
+        """
+        Returns:
+            int: inotify fd watching the lease file's directory, or None
+        """
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            # Watch the directory: the file may be replaced rather than rewritten
+            directory = os.path.dirname(os.path.abspath(self.lease_file)).encode()
+            if libc.inotify_add_watch(fd, directory, IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def _poll(self):
+        mtime = None
+        while True:
+            try:
+                current = os.stat(self.lease_file).st_mtime
+            except OSError:
+                current = None
+            if current != mtime:
+                mtime = current
+                self.reload()
+            time.sleep(POLL_INTERVAL)
+
+
+lease_index = LeaseIndex()
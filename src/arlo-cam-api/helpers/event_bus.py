@@ -0,0 +1,110 @@
+import collections
+import json
+import queue
+import threading
+import time
+
+# How many past events are kept for reconnecting subscribers
+HISTORY_SIZE = 500
+# Per-subscriber backlog before it is considered too slow and told to resync
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Subscription:
+    """One consumer's bounded view of the event bus"""
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Never let a slow viewer hold up the publisher
+            self.overflowed = True
+
+    def get(self, timeout):
+        """
+        Next event, or None if nothing arrived within timeout
+
+        A subscriber that fell behind gets a single "resync" event instead
+        of the events it missed and should reload its state.
+        """
+        if self.overflowed:
+            self.overflowed = False
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            return {"id": self.bus.last_id(), "type": "resync", "time": time.time(), "data": {}}
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """In-process publish/subscribe for alerts, status and stream state
+
+    Every event gets an increasing id. Recent events are kept so a
+    subscriber that reconnects with its last seen id (the SSE
+    Last-Event-ID) receives what it missed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.history = collections.deque(maxlen=HISTORY_SIZE)
+        self.subscribers = []
+
+    def publish(self, event_type, **data):
+        """Publish an event to every subscriber (never blocks)"""
+        with self.lock:
+            event = {"id": self.next_id, "type": event_type, "time": time.time(), "data": data}
+            self.next_id += 1
+            self.history.append(event)
+            subscribers = self.subscribers[:]
+        for subscription in subscribers:
+            subscription.offer(event)
+        return event
+
+    def last_id(self):
+        with self.lock:
+            return self.next_id - 1
+
+    def subscribe(self, since=None):
+        """
+        Register a subscriber, replaying history after the `since` cursor
+
+        If `since` is older than the kept history, or newer than anything
+        published (a cursor from before a restart), the subscriber starts
+        with a "resync" event.
+        """
+        subscription = Subscription(self)
+        with self.lock:
+            if since is not None:
+                missed = [e for e in self.history if e["id"] > since]
+                oldest = self.history[0]["id"] if self.history else self.next_id
+                if since < oldest - 1 or since >= self.next_id:
+                    subscription.overflowed = True
+                else:
+                    for event in missed:
+                        subscription.offer(event)
+            self.subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            if subscription in self.subscribers:
+                self.subscribers.remove(subscription)
+
+
+def format_sse(event):
+    """Encode an event as a text/event-stream message"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+event_bus = EventBus()
@@ -1,51 +1,202 @@
 #!/usr/bin/env python3
 """GStreamer HLS streaming helper for Arlo cameras.
 
-Usage: gst_hls_stream.py <rtsp_url> <output_dir> <duration>
+Usage: gst_hls_stream.py <rtsp_url> <output_dir> <duration> [epoch] [dvr_window]
 
 Uses GStreamer with Python bindings to handle the complex pipeline
 that includes both video (H264) and audio (AAC) streams.
+
+The playlist is written by HlsPlaylist rather than hlssink2 so that a
+restarted helper (epoch > 0) resumes the existing playlist after a
+discontinuity instead of starting a new one.
+
+With a dvr_window (seconds) the segments go into a fixed ring of slot
+files that are created once and overwritten in place, and the playlist
+covers the whole window so viewers can scrub back.
+
+The stream stops <duration> seconds after starting, or later if the
+caller extends its lease by writing a new deadline (unix time) to
+<output_dir>/.lease.
+
+Exit codes: 0 when the duration ran out or we were asked to stop,
+2 when the camera dropped the RTSP session (caller may reconnect).
 """
 import gi
 gi.require_version('Gst', '1.0')
-from gi.repository import Gst, GLib
+from gi.repository import Gst, GLib, Gio
 import sys
 import os
 import signal
+import math
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from helpers.hls_playlist import HlsPlaylist
+
+EXIT_SOURCE_LOST = 2
+TARGET_DURATION = 2
+PLAYLIST_WINDOW = 5
+
+# Spare ring slots beyond the playlist window: one being written and one
+# just evicted that a slow player may still be fetching
+DVR_SPARE_SLOTS = 2
+
+# Space reserved per ring slot up front: a 2s segment at ~2 Mbit/s. A bigger
+# segment grows its slot once and the slot keeps that size from then on
+DVR_SLOT_BYTES = 512 * 1024
+
+def ring_slot_name(slot):
+    return f"ring{slot:03d}.ts"
+
+class SegmentRing:
+    """Fixed set of preallocated segment files reused round-robin
+
+    Slots are allocated once (posix_fallocate) and overwritten in place,
+    never truncated, so the filesystem doesn't free and reallocate blocks
+    for every segment. Whatever follows a segment in its slot is left over
+    from an earlier lap, so the playlist gives each segment's length as an
+    EXT-X-BYTERANGE.
+    """
+
+    def __init__(self, output_dir, slots, next_slot=0):
+        self.output_dir = output_dir
+        self.slots = slots
+        self.next_slot = next_slot
+        self.open_fragments = {}  # hlssink2 location -> (slot, dup'd fd sharing the write offset)
+        for slot in range(slots):
+            path = os.path.join(output_dir, ring_slot_name(slot))
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < DVR_SLOT_BYTES:
+                    os.posix_fallocate(fd, 0, DVR_SLOT_BYTES)
+            except OSError:
+                # Filesystem can't preallocate - slots just grow on first use
+                pass
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def resume_slot(playlist, slots):
+        """Slot after the newest one already in a loaded playlist"""
+        if not playlist.segments:
+            return 0
+        newest = playlist.segments[-1]["uri"].split('?', 1)[0]
+        if not newest.startswith("ring"):
+            # Playlist was started by a motion recording's rendition
+            return 0
+        return (int(newest[len("ring"):-len(".ts")]) + 1) % slots
+
+    def open_next(self, location):
+        """Hand GStreamer a stream that overwrites the next slot from the start"""
+        slot = self.next_slot
+        self.next_slot = (self.next_slot + 1) % self.slots
+        path = os.path.join(self.output_dir, ring_slot_name(slot))
+        fd = os.open(path, os.O_WRONLY)
+        # The duplicate shares the file offset, so it tells how much was
+        # written after GStreamer has closed its end
+        self.open_fragments[location] = (slot, os.dup(fd))
+        return Gio.UnixOutputStream.new(fd, True)
+
+    def finish(self, location, media_sequence):
+        """
+        Returns:
+            tuple: (URI, length in bytes) of the fragment just closed
+        """
+        slot, fd = self.open_fragments.pop(location)
+        try:
+            length = os.lseek(fd, 0, os.SEEK_CUR)
+        finally:
+            os.close(fd)
+        # Slot names repeat, so tag the URI to keep player caches honest
+        return f"{ring_slot_name(slot)}?seq={media_sequence}", length
 
 def main():
-    if len(sys.argv) != 4:
-        print(f"Usage: {sys.argv[0]} <rtsp_url> <output_dir> <duration>")
+    if len(sys.argv) not in (4, 5, 6):
+        print(f"Usage: {sys.argv[0]} <rtsp_url> <output_dir> <duration> [epoch] [dvr_window]")
         sys.exit(1)
 
     rtsp_url = sys.argv[1]
     output_dir = sys.argv[2]
     duration = int(sys.argv[3])
+    epoch = int(sys.argv[4]) if len(sys.argv) >= 5 else 0
+    dvr_window = int(sys.argv[5]) if len(sys.argv) == 6 else 0
 
     Gst.init(None)
     os.makedirs(output_dir, exist_ok=True)
 
-    # Pipeline with video and audio - uses hlssink2's built-in muxer
+    ring = None
+    window = PLAYLIST_WINDOW
+    if dvr_window > 0:
+        window = int(math.ceil(dvr_window / TARGET_DURATION))
+
+    playlist_path = f"{output_dir}/stream.m3u8"
+    if epoch > 0:
+        playlist = HlsPlaylist.load(playlist_path, TARGET_DURATION, window)
+        playlist.mark_discontinuity()
+    else:
+        playlist = HlsPlaylist(playlist_path, TARGET_DURATION, window)
+
+    if dvr_window > 0:
+        slots = window + DVR_SPARE_SLOTS
+        ring = SegmentRing(output_dir, slots, SegmentRing.resume_slot(playlist, slots))
+
+    # Pipeline with video and audio - uses hlssink2's built-in muxer.
+    # hlssink2 keeps its own playlist in a scratch file; stream.m3u8 is ours.
     pipeline_str = f'''
         rtspsrc location={rtsp_url} latency=100 name=src
-        hlssink2 name=hls location={output_dir}/segment%05d.ts playlist-location={output_dir}/stream.m3u8 target-duration=2 max-files=3
-        
+        hlssink2 name=hls location={output_dir}/segment{epoch:02d}-%05d.ts playlist-location={output_dir}/.hlssink2.m3u8 target-duration={TARGET_DURATION} max-files=0
+
         src. ! application/x-rtp,media=video ! rtph264depay ! h264parse ! queue ! hls.video
         src. ! application/x-rtp,media=audio,encoding-name=MPEG4-GENERIC ! rtpmp4gdepay ! aacparse ! queue ! hls.audio
     '''
 
     pipeline = Gst.parse_launch(pipeline_str)
     loop = GLib.MainLoop()
+    state = {"stopping": False, "source_lost": False, "fragment_start": 0}
+
+    if ring is not None:
+        # Redirect each fragment into the ring instead of a new file
+        hls = pipeline.get_by_name("hls")
+        hls.connect("get-fragment-stream", lambda sink, location: ring.open_next(location))
+
+    def on_fragment_closed(structure):
+        location = structure.get_string("location")
+        closed_at = structure.get_value("running-time")
+        seconds = (closed_at - state["fragment_start"]) / Gst.SECOND
+        length = None
+        if ring is not None:
+            uri, length = ring.finish(location, playlist.media_sequence + len(playlist.segments))
+        else:
+            uri = os.path.basename(location)
+        evicted = playlist.add_segment(uri, seconds, time.time() - seconds, length)
+        for old_uri in evicted:
+            # Ring slots are reused, anything else (incl. pre-warm segments) goes
+            if not old_uri.startswith("ring"):
+                try:
+                    os.remove(os.path.join(output_dir, old_uri))
+                except OSError:
+                    pass
+        playlist.write()
 
     def on_message(bus, message):
         t = message.type
         if t == Gst.MessageType.EOS:
             print("EOS received")
+            if not state["stopping"]:
+                # Camera ended the session before we asked it to
+                state["source_lost"] = True
             loop.quit()
         elif t == Gst.MessageType.ERROR:
             err, debug = message.parse_error()
             print(f"Error: {err}")
+            state["source_lost"] = True
             loop.quit()
+        elif t == Gst.MessageType.ELEMENT:
+            structure = message.get_structure()
+            if structure.has_name("splitmuxsink-fragment-opened"):
+                state["fragment_start"] = structure.get_value("running-time")
+            elif structure.has_name("splitmuxsink-fragment-closed"):
+                on_fragment_closed(structure)
 
     bus = pipeline.get_bus()
     bus.add_signal_watch()
@@ -54,20 +205,32 @@ def main():
     # Handle termination signals
     def signal_handler(sig, frame):
         print("Signal received, stopping...")
+        state["stopping"] = True
         pipeline.send_event(Gst.Event.new_eos())
 
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
 
-    # Timeout to stop after duration
+    # Stop once the lease runs out; the caller may push it back
+    lease_path = f"{output_dir}/.lease"
+    deadline = time.time() + duration
+
     def timeout_callback():
-        print(f"Duration {duration}s reached, stopping...")
+        try:
+            with open(lease_path) as lease:
+                lease_deadline = float(lease.read())
+        except (OSError, ValueError):
+            lease_deadline = deadline
+        if time.time() < lease_deadline:
+            return True
+        print(f"Lease ended after {time.time() - deadline + duration:.0f}s, stopping...")
+        state["stopping"] = True
         pipeline.send_event(Gst.Event.new_eos())
         return False
 
-    GLib.timeout_add_seconds(duration, timeout_callback)
+    GLib.timeout_add_seconds(1, timeout_callback)
 
-    print(f"Starting HLS stream from {rtsp_url}")
+    print(f"Starting HLS stream from {rtsp_url} (epoch {epoch}, DVR window {dvr_window}s)")
     pipeline.set_state(Gst.State.PLAYING)
 
     try:
@@ -76,7 +239,13 @@ def main():
         pass
     finally:
         pipeline.set_state(Gst.State.NULL)
+        if not state["source_lost"]:
+            playlist.end()
+            playlist.write()
         print("Stream stopped")
 
+    if state["source_lost"]:
+        sys.exit(EXIT_SOURCE_LOST)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,162 @@
+import datetime
+import math
+import os
+
+
+class HlsPlaylist:
+    """Sliding-window HLS media playlist owned by the base station
+
+    hlssink2 rewrites its own playlist from scratch every time a pipeline is
+    (re)built, which loses the media sequence and cannot express a
+    discontinuity. This class keeps the segment list itself so the stream
+    helper can be restarted mid-lease and carry on with the same playlist.
+    """
+
+    def __init__(self, path, target_duration=2, window=5):
+        self.path = path
+        self.target_duration = target_duration
+        self.window = window
+        self.media_sequence = 0
+        self.discontinuity_sequence = 0
+        self.segments = []  # list of dicts: {uri, duration, discontinuity, program_date_time, length}
+        self.ended = False
+        self._pending_discontinuity = False
+
+    @staticmethod
+    def load(path, target_duration=2, window=5):
+        """Rebuild a playlist from a file previously written by write()"""
+        playlist = HlsPlaylist(path, target_duration, window)
+        if not os.path.exists(path):
+            return playlist
+
+        duration = None
+        discontinuity = False
+        program_date_time = None
+        length = None
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+                    playlist.media_sequence = int(line.split(':', 1)[1])
+                elif line.startswith('#EXT-X-DISCONTINUITY-SEQUENCE:'):
+                    playlist.discontinuity_sequence = int(line.split(':', 1)[1])
+                elif line == '#EXT-X-DISCONTINUITY':
+                    discontinuity = True
+                elif line.startswith('#EXT-X-PROGRAM-DATE-TIME:'):
+                    stamp = line.split(':', 1)[1].rstrip('Z')
+                    program_date_time = datetime.datetime.fromisoformat(stamp).replace(
+                        tzinfo=datetime.timezone.utc).timestamp()
+                elif line.startswith('#EXTINF:'):
+                    duration = float(line[len('#EXTINF:'):].split(',', 1)[0])
+                elif line.startswith('#EXT-X-BYTERANGE:'):
+                    length = int(line[len('#EXT-X-BYTERANGE:'):].split('@', 1)[0])
+                elif line and not line.startswith('#') and duration is not None:
+                    playlist.segments.append({
+                        "uri": line,
+                        "duration": duration,
+                        "discontinuity": discontinuity,
+                        "program_date_time": program_date_time,
+                        "length": length
+                    })
+                    duration = None
+                    discontinuity = False
+                    program_date_time = None
+                    length = None
+        return playlist
+
+    def mark_discontinuity(self):
+        """Flag the next added segment as following a source restart"""
+        if self.segments:
+            self._pending_discontinuity = True
+
+    def add_segment(self, uri, duration, program_date_time=None, length=None):
+        """
+        Append a finished segment and slide the window
+
+        Args:
+            uri: Segment URI relative to the playlist
+            duration: Segment duration in seconds
+            program_date_time: Unix time of the segment's first frame (optional)
+            length: Bytes of the file that belong to the segment, when the
+                    file is a reused slot with stale data after it (optional)
+
+        Returns:
+            list: URIs that fell out of the window (caller may delete them)
+        """
+        self.segments.append({
+            "uri": uri,
+            "duration": duration,
+            "discontinuity": self._pending_discontinuity,
+            "program_date_time": program_date_time,
+            "length": length
+        })
+        self._pending_discontinuity = False
+
+        evicted = []
+        while self.window and len(self.segments) > self.window:
+            dropped = self.segments.pop(0)
+            self.media_sequence += 1
+            # A discontinuity tag leaving the window bumps the sequence so
+            # players can keep their timelines aligned (RFC 8216 6.2.1)
+            if dropped["discontinuity"]:
+                self.discontinuity_sequence += 1
+            evicted.append(dropped["uri"])
+        return evicted
+
+    def segments_between(self, start=None, end=None):
+        """
+        Segments overlapping the [start, end] range of unix times
+
+        Segments without a program date time are only returned when the
+        range is unbounded.
+        """
+        selected = []
+        for segment in self.segments:
+            began = segment["program_date_time"]
+            if began is None:
+                if start is None and end is None:
+                    selected.append(segment)
+                continue
+            if start is not None and began + segment["duration"] < start:
+                continue
+            if end is not None and began > end:
+                continue
+            selected.append(segment)
+        return selected
+
+    def end(self):
+        """Mark the playlist as complete (#EXT-X-ENDLIST)"""
+        self.ended = True
+
+    def render(self):
+        longest = max([s["duration"] for s in self.segments], default=0)
+        target = max(self.target_duration, int(math.ceil(longest)))
+        # Byte ranges need version 4
+        version = 4 if any(s.get("length") is not None for s in self.segments) else 3
+        lines = [
+            "#EXTM3U",
+            f"#EXT-X-VERSION:{version}",
+            f"#EXT-X-TARGETDURATION:{target}",
+            f"#EXT-X-MEDIA-SEQUENCE:{self.media_sequence}",
+            f"#EXT-X-DISCONTINUITY-SEQUENCE:{self.discontinuity_sequence}",
+        ]
+        for segment in self.segments:
+            if segment["discontinuity"]:
+                lines.append("#EXT-X-DISCONTINUITY")
+            if segment["program_date_time"] is not None:
+                stamp = datetime.datetime.utcfromtimestamp(segment["program_date_time"])
+                lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{stamp.isoformat(timespec='milliseconds')}Z")
+            lines.append(f"#EXTINF:{segment['duration']:.3f},")
+            if segment.get("length") is not None:
+                lines.append(f"#EXT-X-BYTERANGE:{segment['length']}@0")
+            lines.append(segment["uri"])
+        if self.ended:
+            lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Write the playlist atomically so readers never see a partial file"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,117 @@
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from helpers.metrics import notification_connect_seconds, notification_connections, notification_connect_saved_seconds
+
+# Set on the thread that opened a new connection during the current request
+_local = threading.local()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = time.monotonic()
+        super().connect()
+        _local.connect_time = time.monotonic() - started
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        # Includes the TLS handshake
+        started = time.monotonic()
+        super().connect()
+        _local.connect_time = time.monotonic() - started
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool
+        }
+
+
+class HttpSessionPool:
+    """Keep-alive requests.Session per destination host
+
+    Notifications to the same host (ntfy across a bore tunnel, the motion
+    webhook) reuse an open HTTP/1.1 connection instead of paying for TCP
+    and TLS setup every time. Each host keeps at most `pool_size` idle
+    connections. Connection setup time is measured, and every reused
+    connection is credited with the host's average setup time in
+    arlo_notification_connect_saved_seconds_total.
+    """
+
+    def __init__(self, pool_size=4):
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.sessions = {}  # scheme://host:port -> Session
+        self.connect_average = {}  # host -> EWMA of connection setup seconds
+
+    def _session(self, url):
+        parts = urllib.parse.urlsplit(url)
+        key = f"{parts.scheme}://{parts.netloc}"
+        with self.lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = _TimedAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=1)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.sessions[key] = session
+        return session, parts.hostname
+
+    def post(self, url, **kwargs):
+        """requests.post() over the host's pooled session"""
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        """requests.put() over the host's pooled session"""
+        return self.request('PUT', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        session, host = self._session(url)
+        _local.connect_time = None
+        try:
+            response = session.request(method, url, **kwargs)
+        except Exception:
+            # Only count a connection that was actually opened
+            if _local.connect_time is not None:
+                self._account(host, _local.connect_time)
+            raise
+        self._account(host, _local.connect_time)
+        return response
+
+    def _account(self, host, connect_time):
+        if connect_time is not None:
+            notification_connect_seconds.observe(connect_time, host=host)
+            notification_connections.inc(host=host, reused='false')
+            with self.lock:
+                average = self.connect_average.get(host)
+                self.connect_average[host] = connect_time if average is None else 0.8 * average + 0.2 * connect_time
+        else:
+            notification_connections.inc(host=host, reused='true')
+            saved = self.connect_average.get(host)
+            if saved is not None:
+                notification_connect_saved_seconds.inc(saved, host=host)
+
+    def close(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.close()
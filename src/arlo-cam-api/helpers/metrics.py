@@ -0,0 +1,283 @@
+import bisect
+import threading
+import time
+import weakref
+
+# Default histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class _ThreadToken:
+    """Lives in a thread's local storage; collected when the thread exits"""
+
+
+class Registry:
+    """Counters, gauges and histograms in Prometheus text format
+
+    Hot paths never take a lock: each thread updates its own shard and
+    render() adds the shards up. When a thread exits its shard is folded
+    into a retired total, so short-lived connection threads don't pile up.
+    """
+
+    def __init__(self):
+        # Reentrant: a thread exit can retire a shard at any point
+        self.lock = threading.RLock()
+        self.local = threading.local()
+        self.metrics = {}  # name -> metric, in registration order
+        self.shards = {}  # id -> live per-thread values
+        self.retired = {}
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help, labelnames, buckets))
+
+    def gauge(self, name, help, labelnames=(), callback=None):
+        return self._register(Gauge(self, name, help, labelnames, callback))
+
+    def _register(self, metric):
+        with self.lock:
+            self.metrics[metric.name] = metric
+        return metric
+
+    def _shard(self):
+        """This thread's values: (metric name, label values) -> value"""
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = {}
+            self.local.token = token = _ThreadToken()
+            with self.lock:
+                self.shards[id(shard)] = shard
+            # threading.local drops the token when its thread exits
+            weakref.finalize(token, self._retire, shard)
+            return shard
+
+    def _retire(self, shard):
+        with self.lock:
+            del self.shards[id(shard)]
+            for key, value in shard.items():
+                _merge(self.retired, key, value)
+
+    def _snapshot(self):
+        """Sum of the retired values and every live shard"""
+        with self.lock:
+            shards = [shard.copy() for shard in self.shards.values()]
+            totals = {key: _copy_value(value) for key, value in self.retired.items()}
+        for shard in shards:
+            for key, value in shard.items():
+                _merge(totals, key, value)
+        return totals
+
+    def render(self):
+        """Everything in Prometheus text exposition format (version 0.0.4)"""
+        values = self._snapshot()
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render(values))
+        return '\n'.join(lines) + '\n'
+
+
+def _copy_value(value):
+    return list(value) if isinstance(value, list) else value
+
+
+def _merge(totals, key, value):
+    if isinstance(value, list):
+        total = totals.get(key)
+        if total is None:
+            totals[key] = list(value)
+        else:
+            for i, v in enumerate(value):
+                total[i] += v
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = [(name, str(value)) for name, value in zip(labelnames, labelvalues)]
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, registry, name, help, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels):
+        return (self.name, tuple(str(labels.get(name, '')) for name in self.labelnames))
+
+    def _series(self, values):
+        return sorted((labelvalues, value) for (name, labelvalues), value in values.items() if name == self.name)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self.registry._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def render(self, values):
+        for labelvalues, value in self._series(values):
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames, buckets):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        shard = self.registry._shard()
+        key = self._key(labels)
+        counts = shard.get(key)
+        if counts is None:
+            # Per-bucket counts (last one is +Inf), then sum
+            counts = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, **labels):
+        """Context manager that observes the duration of its block"""
+        return _Timer(self, labels)
+
+    def render(self, values):
+        for labelvalues, counts in self._series(values):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, ('le', _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.started, **self.labels)
+
+
+class Gauge(Metric):
+    """A value that goes up and down
+
+    Either set() directly, or give a callback returning the current value
+    (or a {label values tuple: value} dict) that is read at scrape time.
+    """
+    type = 'gauge'
+
+    def __init__(self, registry, name, help, labelnames, callback):
+        super().__init__(registry, name, help, labelnames)
+        self.callback = callback
+        self.values = {}
+
+    def set(self, value, **labels):
+        # A plain assignment - atomic without a lock
+        self.values[self._key(labels)[1]] = value
+
+    def render(self, values):
+        if self.callback is not None:
+            current = self.callback()
+            series = current if isinstance(current, dict) else {(): current}
+        else:
+            series = dict(self.values)
+        for labelvalues, value in sorted(series.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+registry = Registry()
+
+# Protocol
+messages_received = registry.counter(
+    'arlo_messages_received_total', 'Messages received from cameras', ['type'])
+alert_ack_seconds = registry.histogram(
+    'arlo_alert_ack_seconds', 'Time from receiving an alert to acking it', ['alert_type'])
+send_message_seconds = registry.histogram(
+    'arlo_send_message_seconds', 'Round trip of commands sent to a camera', ['serial_number'])
+send_message_failures = registry.counter(
+    'arlo_send_message_failures_total', 'Commands a camera did not ack', ['serial_number', 'reason'])
+send_message_retries = registry.counter(
+    'arlo_send_message_retries_total', 'Connect attempts repeated for a camera that may be asleep', ['serial_number'])
+
+# Media
+recording_start_seconds = registry.histogram(
+    'arlo_recording_start_seconds', 'Time from motion alert to ffmpeg recording start')
+recording_duration_seconds = registry.histogram(
+    'arlo_recording_duration_seconds', 'Wall time of motion recordings',
+    buckets=(5, 10, 12, 15, 20, 30, 60))
+recording_exits = registry.counter(
+    'arlo_recording_exits_total', 'Motion recording ffmpeg exits by exit code', ['code'])
+stream_startup_seconds = registry.histogram(
+    'arlo_stream_startup_seconds', 'Time for /stream/start to bring a live stream up', ['prewarmed'])
+
+# Notifications
+notification_seconds = registry.histogram(
+    'arlo_notification_seconds', 'Webhook and ntfy request latency', ['kind'])
+notification_errors = registry.counter(
+    'arlo_notification_errors_total', 'Failed webhook and ntfy requests', ['kind'])
+notification_connect_seconds = registry.histogram(
+    'arlo_notification_connect_seconds', 'TCP (and TLS) setup time for new notification connections', ['host'])
+notification_connections = registry.counter(
+    'arlo_notification_connections_total', 'Notification requests by whether a pooled connection was reused',
+    ['host', 'reused'])
+notification_connect_saved_seconds = registry.counter(
+    'arlo_notification_connect_saved_seconds_total', 'Connection setup time avoided by reusing pooled connections',
+    ['host'])
+notifications_suppressed = registry.counter(
+    'arlo_notifications_suppressed_total', 'Motion pushes held back by rate limiting (sent in a digest)',
+    ['serial_number'])
+notification_digests = registry.counter(
+    'arlo_notification_digests_total', 'Digest pushes sent', ['serial_number'])
+notification_delivery_seconds = registry.histogram(
+    'arlo_notification_delivery_seconds', 'Time from queuing a notification to delivering it', ['destination'],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600))
+notification_deliveries = registry.counter(
+    'arlo_notification_deliveries_total', 'Notification delivery attempts by outcome (delivered/retry/dropped)',
+    ['destination', 'outcome'])
+ntfy_time_to_notification_seconds = registry.histogram(
+    'arlo_ntfy_time_to_notification_seconds',
+    'Time from the event to ntfy accepting the push, by attachment mode (upload/url/none)', ['kind', 'mode'],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600))
+
+# Profiling (only recorded with ProfilingEnabled)
+http_request_seconds = registry.histogram(
+    'arlo_http_request_seconds', 'API request handling time per route', ['route', 'method', 'status'])
+span_seconds = registry.histogram(
+    'arlo_span_seconds', 'Time spent in profiled hot paths', ['span'])
+
+# Storage
+sqlite_seconds = registry.histogram(
+    'arlo_sqlite_seconds', 'Time spent in SQLite operations', ['operation'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
@@ -0,0 +1,187 @@
+import collections
+import concurrent.futures
+import json
+import random
+import sqlite3
+import threading
+import time
+
+from helpers.safe_print import s_print
+from helpers.metrics import registry, sqlite_seconds, notification_delivery_seconds, notification_deliveries
+
+# Failed notifications are kept this long for inspection
+FAILED_RETENTION = 7 * 86400  # seconds
+# Upper bound on how long the scheduler sleeps without being woken
+SCHEDULER_POLL = 30  # seconds
+
+
+class NotificationOutbox:
+    """Durable queue of outgoing notifications
+
+    enqueue() only writes a row to SQLite and returns, so protocol and
+    recording threads never wait on the network. A scheduler hands due
+    rows to a small worker pool; each destination is drained by one
+    worker at a time, so a slow ntfy server doesn't hold up webhooks.
+    Failed deliveries are retried with exponential backoff and rows left
+    over from a previous run are picked up again on start().
+    """
+
+    def __init__(self, db_path='arlo.db', workers=4, max_attempts=10, retry_base=2, retry_max=600):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.senders = {}  # destination -> callable(payload, attempt), raises on failure
+        self.lock = threading.Lock()
+        self.pending = {}  # destination -> deque of rows being delivered
+        self.wake = threading.Event()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='notify')
+        self.thread = None
+
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("""CREATE TABLE IF NOT EXISTS notification_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                destination TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created REAL NOT NULL,
+                next_attempt REAL NOT NULL,
+                last_error TEXT)""")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_notification_outbox_due ON notification_outbox (state, next_attempt)")
+            conn.commit()
+
+        registry.gauge('arlo_notification_queue_depth', 'Notifications waiting to be delivered',
+                       ['destination'], callback=self.depths)
+
+    def register(self, destination, sender):
+        """Set the function that delivers a destination's payloads (called with the 1-based attempt number)"""
+        self.senders[destination] = sender
+
+    def start(self):
+        with self._db() as conn:
+            # Rows that were being sent when we last stopped go out again
+            conn.execute("UPDATE notification_outbox SET state = 'pending' WHERE state = 'sending'")
+            conn.execute("DELETE FROM notification_outbox WHERE state = 'failed' AND created < ?",
+                         (time.time() - FAILED_RETENTION,))
+        self.thread = threading.Thread(target=self._schedule, name='notification-outbox', daemon=True)
+        self.thread.start()
+
+    def enqueue(self, destination, payload):
+        """Queue a JSON-serialisable payload for delivery (never blocks on the network)"""
+        now = time.time()
+        with self._db() as conn:
+            conn.execute("INSERT INTO notification_outbox (destination, payload, created, next_attempt) VALUES (?, ?, ?, ?)",
+                         (destination, json.dumps(payload), now, now))
+        self.wake.set()
+
+    def depths(self):
+        """Undelivered notifications per destination, for /metrics"""
+        with self._db() as conn:
+            rows = conn.execute("SELECT destination, COUNT(*) FROM notification_outbox WHERE state != 'failed' GROUP BY destination").fetchall()
+        return {(destination,): count for destination, count in rows}
+
+    def _db(self):
+        return _TimedConnection(self.db_path)
+
+    def _schedule(self):
+        while True:
+            self.wake.clear()
+            try:
+                next_due = self._dispatch_due()
+            except Exception as e:
+                s_print(f"[OUTBOX] Scheduler error: {e}")
+                next_due = None
+            timeout = SCHEDULER_POLL if next_due is None else min(SCHEDULER_POLL, max(0, next_due - time.time()))
+            self.wake.wait(timeout)
+
+    def _dispatch_due(self):
+        """
+        Hand due rows to the worker pool
+
+        Returns:
+            float: When the next retry is due, or None if nothing is waiting
+        """
+        now = time.time()
+        with self._db() as conn:
+            rows = conn.execute("SELECT id, destination, payload, attempts, created FROM notification_outbox "
+                                "WHERE state = 'pending' AND next_attempt <= ? ORDER BY id", (now,)).fetchall()
+            conn.executemany("UPDATE notification_outbox SET state = 'sending' WHERE id = ?", [(row[0],) for row in rows])
+            next_due = conn.execute("SELECT MIN(next_attempt) FROM notification_outbox WHERE state = 'pending'").fetchone()[0]
+
+        start = []
+        with self.lock:
+            for row in rows:
+                destination = row[1]
+                queue = self.pending.get(destination)
+                if queue is None:
+                    queue = self.pending[destination] = collections.deque()
+                    start.append(destination)
+                queue.append(row)
+        for destination in start:
+            self.executor.submit(self._drain, destination)
+        return next_due
+
+    def _drain(self, destination):
+        while True:
+            with self.lock:
+                queue = self.pending[destination]
+                if not queue:
+                    del self.pending[destination]
+                    return
+                row = queue.popleft()
+            self._deliver(*row)
+
+    def _deliver(self, row_id, destination, payload, attempts, created):
+        sender = self.senders.get(destination)
+        try:
+            if sender is None:
+                raise RuntimeError(f"No sender registered for {destination}")
+            sender(json.loads(payload), attempts + 1)
+        except Exception as e:
+            self._failed(row_id, destination, attempts + 1, str(e))
+            return
+
+        with self._db() as conn:
+            conn.execute("DELETE FROM notification_outbox WHERE id = ?", (row_id,))
+        notification_delivery_seconds.observe(time.time() - created, destination=destination)
+        notification_deliveries.inc(destination=destination, outcome='delivered')
+
+    def _failed(self, row_id, destination, attempts, error):
+        if attempts >= self.max_attempts:
+            s_print(f"[OUTBOX] Giving up on {destination} notification {row_id} after {attempts} attempts: {error}")
+            with self._db() as conn:
+                conn.execute("UPDATE notification_outbox SET state = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                             (attempts, error, row_id))
+            notification_deliveries.inc(destination=destination, outcome='dropped')
+            return
+
+        # Exponential backoff with jitter so retries don't arrive in lockstep
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+        s_print(f"[OUTBOX] {destination} notification {row_id} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+        with self._db() as conn:
+            conn.execute("UPDATE notification_outbox SET state = 'pending', attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                         (attempts, time.time() + delay, error, row_id))
+        notification_deliveries.inc(destination=destination, outcome='retry')
+        self.wake.set()
+
+
+class _TimedConnection:
+    """sqlite3 connection that commits on exit and counts towards arlo_sqlite_seconds"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        self.conn = sqlite3.connect(self.db_path)
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+        finally:
+            self.conn.close()
+            sqlite_seconds.observe(time.monotonic() - self.started, operation='outbox')
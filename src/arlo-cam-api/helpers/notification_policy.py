@@ -0,0 +1,176 @@
+import json
+import sqlite3
+import threading
+import time
+
+from helpers.safe_print import s_print
+from helpers.metrics import notifications_suppressed, notification_digests
+
+
+class TokenBucket:
+    """Allows `capacity` notifications at once, refilling at `rate` per second"""
+
+    def __init__(self, capacity, rate, tokens=None, updated=None):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity if tokens is None else min(capacity, tokens)
+        self.updated = time.time() if updated is None else updated
+
+    def refill(self, now):
+        # Clock steps backwards (or a bucket stamped after `now`) add nothing
+        self.tokens = min(self.capacity, self.tokens + max(0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def to_dict(self):
+        return {"tokens": self.tokens, "updated": self.updated}
+
+
+class NotificationPolicy:
+    """Rate limits motion pushes and coalesces the excess into digests
+
+    Each camera and each ntfy topic has a token bucket. A motion alert is
+    pushed straight away only if both have a token; otherwise it is added
+    to the camera's digest, which is sent as one message ("Front Door: 7
+    motion events in 10 min", with the latest thumbnail) when its window
+    closes. Buckets and open digests are kept in SQLite so a restart
+    neither resets the limits nor loses pending events.
+    """
+
+    def __init__(self, config, on_digest, db_path='arlo.db'):
+        """
+        Args:
+            config: Parsed config.yaml
+            on_digest: Called as on_digest(serial_number, digest) when a
+                       digest window closes
+            db_path: SQLite database holding the policy state
+        """
+        self.enabled = config.get('NotifyRateLimitEnabled', True)
+        self.camera_burst = config.get('NotifyCameraBurst', 3)
+        self.camera_rate = config.get('NotifyCameraPerHour', 12) / 3600
+        self.topic_burst = config.get('NotifyTopicBurst', 10)
+        self.topic_rate = config.get('NotifyTopicPerHour', 60) / 3600
+        self.digest_window = config.get('NotifyDigestWindow', 600)
+        self.on_digest = on_digest
+        self.db_path = db_path
+
+        self.condition = threading.Condition()
+        self.buckets = {}  # "camera:<serial>" / "topic:<topic>" -> TokenBucket
+        self.digests = {}  # serial -> {"camera_name", "count", "first", "deadline", "zones", "file_name"}
+        self.thread = None
+
+        with sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("CREATE TABLE IF NOT EXISTS notification_policy (key TEXT PRIMARY KEY, state TEXT)")
+            conn.commit()
+            c.execute("SELECT key, state FROM notification_policy")
+            rows = c.fetchall()
+        for key, state in rows:
+            state = json.loads(state)
+            kind, _, name = key.partition(':')
+            if kind == 'bucket':
+                self.buckets[name] = self._new_bucket(name, **state)
+            elif kind == 'digest':
+                self.digests[name] = state
+
+    def _new_bucket(self, name, tokens=None, updated=None):
+        if name.startswith('topic:'):
+            return TokenBucket(self.topic_burst, self.topic_rate, tokens, updated)
+        return TokenBucket(self.camera_burst, self.camera_rate, tokens, updated)
+
+    def start(self):
+        """Start sending digests (including ones left open by the last run)"""
+        self.thread = threading.Thread(target=self._run, name='notification-digests', daemon=True)
+        self.thread.start()
+
+    def admit(self, serial_number, topic, camera_name, zone, file_name):
+        """
+        Decide whether a motion alert is pushed now
+
+        Returns:
+            bool: True to send it now, False if it went into the digest
+        """
+        if not self.enabled:
+            return True
+
+        now = time.time()
+        with self.condition:
+            camera = self._bucket(f"camera:{serial_number}", now)
+            topic_bucket = self._bucket(f"topic:{topic}", now)
+            # A camera with an open digest keeps adding to it until it is sent
+            if serial_number not in self.digests and camera.tokens >= 1 and topic_bucket.tokens >= 1:
+                camera.tokens -= 1
+                topic_bucket.tokens -= 1
+                self._save({f"bucket:camera:{serial_number}": camera.to_dict(),
+                            f"bucket:topic:{topic}": topic_bucket.to_dict()})
+                return True
+
+            digest = self.digests.get(serial_number)
+            if digest is None:
+                digest = self.digests[serial_number] = {
+                    "camera_name": camera_name,
+                    "count": 0,
+                    "first": now,
+                    "deadline": now + self.digest_window,
+                    "zones": []
+                }
+                self.condition.notify()
+            digest["count"] += 1
+            digest["file_name"] = file_name
+            if zone and zone not in digest["zones"]:
+                digest["zones"].append(zone)
+            self._save({f"digest:{serial_number}": digest})
+
+        notifications_suppressed.inc(serial_number=serial_number)
+        return False
+
+    def get_state(self):
+        with self.condition:
+            now = time.time()
+            return {
+                "enabled": self.enabled,
+                "buckets": {name: round(min(b.capacity, b.tokens + max(0, now - b.updated) * b.rate), 2)
+                            for name, b in self.buckets.items()},
+                "digests": {serial: dict(d) for serial, d in self.digests.items()}
+            }
+
+    def _bucket(self, name, now):
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            bucket = self.buckets[name] = self._new_bucket(name)
+        bucket.refill(now)
+        return bucket
+
+    def _save(self, states):
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.executemany("INSERT OR REPLACE INTO notification_policy (key, state) VALUES (?, ?)",
+                                 [(key, json.dumps(state)) for key, state in states.items()])
+                conn.commit()
+        except sqlite3.Error as e:
+            s_print(f"[NOTIFY] Could not save rate limit state: {e}")
+
+    def _run(self):
+        while True:
+            with self.condition:
+                now = time.time()
+                due = [serial for serial, d in self.digests.items() if d["deadline"] <= now]
+                if not due:
+                    deadlines = [d["deadline"] for d in self.digests.values()]
+                    self.condition.wait(min(deadlines) - now if deadlines else None)
+                    continue
+                closed = [(serial, self.digests.pop(serial)) for serial in due]
+
+            try:
+                with sqlite3.connect(self.db_path) as conn:
+                    conn.executemany("DELETE FROM notification_policy WHERE key = ?",
+                                     [(f"digest:{serial}",) for serial, _ in closed])
+                    conn.commit()
+            except sqlite3.Error as e:
+                s_print(f"[NOTIFY] Could not clear digest state: {e}")
+
+            for serial, digest in closed:
+                notification_digests.inc(serial_number=serial)
+                try:
+                    self.on_digest(serial, digest)
+                except Exception as e:
+                    s_print(f"[NOTIFY] Error sending digest for {serial}: {e}")
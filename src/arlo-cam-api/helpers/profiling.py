@@ -0,0 +1,107 @@
+import collections
+import functools
+import os
+import re
+import sys
+import threading
+import time
+
+from helpers.metrics import span_seconds
+
+# Opt-in profiling - set by server.py. While off, timed() and span() cost
+# one global lookup.
+ENABLED = False
+# Longest sampling profile the admin endpoint will record
+MAX_SAMPLE_SECONDS = 60
+
+
+class _Span:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        span_seconds.observe(time.monotonic() - self.started, span=self.name)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """Context manager timing a block into arlo_span_seconds when enabled"""
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(name)
+
+
+def timed(name):
+    """Decorator timing every call of a function into arlo_span_seconds when enabled"""
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return f(*args, **kwargs)
+            started = time.monotonic()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                span_seconds.observe(time.monotonic() - started, span=name)
+        return wrapper
+    return decorator
+
+
+def _thread_label(thread):
+    # Pool and per-connection threads are numbered; fold them together
+    name = thread.name if thread is not None else 'unknown'
+    return re.sub(r'[-_ ]?\d+$', '', name) or name
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+def sample_stacks(seconds, interval=0.01):
+    """
+    Sample every thread's stack for a while
+
+    Args:
+        seconds: How long to sample for (capped at MAX_SAMPLE_SECONDS)
+        interval: Seconds between samples
+
+    Returns:
+        str: Collapsed stacks ("thread;outer;...;inner count" per line),
+             the input format of flamegraph.pl and speedscope
+    """
+    seconds = min(float(seconds), MAX_SAMPLE_SECONDS)
+    me = threading.get_ident()
+    counts = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        threads = {t.ident: t for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(_thread_label(threads.get(ident)))
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
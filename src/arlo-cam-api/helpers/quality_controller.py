@@ -0,0 +1,176 @@
+import collections
+import threading
+import time
+from helpers.safe_print import s_print
+
+# Status counters that only ever go up (until the camera reboots)
+ERROR_COUNTERS = ('TxErr', 'TxFail', 'RtcpDiscCnt')
+
+
+class QualityController:
+    """Moves cameras up and down the RA quality ladder based on link health
+
+    Each status message is scored from SignalStrengthIndicator, the growth of
+    the TxErr/TxFail/RtcpDiscCnt counters since the previous status, and any
+    live stream drops reported by the stream manager. A camera steps down
+    after AdaptiveQualityDownAfter bad reports in a row and back up after
+    AdaptiveQualityUpAfter good ones, never changing more often than
+    AdaptiveQualityMinHold seconds.
+    """
+
+    def __init__(self, config):
+        self.enabled = config.get('AdaptiveQualityEnabled', False)
+        self.ladder = [q.lower() for q in config.get('AdaptiveQualityLadder', ['low', 'medium', 'high'])]
+        self.signal_low = config.get('AdaptiveQualitySignalLow', 2)
+        self.signal_good = config.get('AdaptiveQualitySignalGood', 4)
+        self.error_threshold = config.get('AdaptiveQualityErrorThreshold', 10)
+        self.down_after = config.get('AdaptiveQualityDownAfter', 2)
+        self.up_after = config.get('AdaptiveQualityUpAfter', 4)
+        self.min_hold = config.get('AdaptiveQualityMinHold', 600)
+
+        self.lock = threading.Lock()
+        self.cameras = {}  # serial -> per-camera state dict
+        self.decisions = collections.deque(maxlen=200)
+
+    def _state(self, serial):
+        state = self.cameras.get(serial)
+        if state is None:
+            # Registration applies 1080p at ~1 Mbit/s, i.e. the top of the ladder
+            state = {
+                "level": len(self.ladder) - 1,
+                "counters": None,
+                "stream_losses": 0,
+                "bad_streak": 0,
+                "good_streak": 0,
+                "last_change": 0,
+                "last_inputs": None
+            }
+            self.cameras[serial] = state
+        return state
+
+    def record_stream_loss(self, serial):
+        """Called by the stream manager when a live RTSP session drops"""
+        with self.lock:
+            self._state(serial)["stream_losses"] += 1
+
+    def set_manual(self, serial, quality):
+        """Keep the ladder position in sync with a quality chosen through the API"""
+        quality = quality.lower()
+        if quality not in self.ladder:
+            return
+        with self.lock:
+            state = self._state(serial)
+            state["level"] = self.ladder.index(quality)
+            state["last_change"] = time.time()
+            state["bad_streak"] = state["good_streak"] = 0
+
+    def on_registration(self, camera):
+        """Registration resets the camera to its defaults - re-apply our level"""
+        if not self.enabled:
+            return
+        with self.lock:
+            state = self._state(camera.serial_number)
+            state["counters"] = None
+            level = state["level"]
+        if level != len(self.ladder) - 1:
+            # Runs before the registration is acked - don't hold the camera's ack
+            threading.Thread(target=self._apply, args=(camera, self.ladder[level]), daemon=True).start()
+
+    def on_status(self, camera, status):
+        """Score a status message and step the camera's quality if warranted"""
+        if not self.enabled:
+            return
+
+        serial = camera.serial_number
+        with self.lock:
+            state = self._state(serial)
+
+            counters = {name: status.dictionary.get(name, 0) or 0 for name in ERROR_COUNTERS}
+            previous = state["counters"]
+            state["counters"] = counters
+            if previous is None:
+                # Nothing to diff against yet
+                return
+            errors = 0
+            for name in ERROR_COUNTERS:
+                delta = counters[name] - previous[name]
+                # Counters restart from zero when the camera reboots
+                errors += delta if delta >= 0 else counters[name]
+
+            signal = status.dictionary.get('SignalStrengthIndicator')
+            losses = state["stream_losses"]
+            state["stream_losses"] = 0
+            inputs = {"signal": signal, "errors": errors, "stream_losses": losses}
+            state["last_inputs"] = inputs
+
+            bad = (signal is not None and signal <= self.signal_low) \
+                or errors >= self.error_threshold or losses > 0
+            good = (signal is None or signal >= self.signal_good) \
+                and errors == 0 and losses == 0
+
+            if bad:
+                state["bad_streak"] += 1
+                state["good_streak"] = 0
+            elif good:
+                state["good_streak"] += 1
+                state["bad_streak"] = 0
+            else:
+                # In between - hold position and start counting again
+                state["bad_streak"] = state["good_streak"] = 0
+
+            level = state["level"]
+            new_level = level
+            if state["bad_streak"] >= self.down_after and level > 0:
+                new_level = level - 1
+                reason = "degraded link"
+            elif state["good_streak"] >= self.up_after and level < len(self.ladder) - 1:
+                new_level = level + 1
+                reason = "healthy link"
+
+            now = time.time()
+            if new_level == level or now - state["last_change"] < self.min_hold:
+                return
+
+            state["level"] = new_level
+            state["last_change"] = now
+            state["bad_streak"] = state["good_streak"] = 0
+            decision = {
+                "time": now,
+                "serial_number": serial,
+                "from": self.ladder[level],
+                "to": self.ladder[new_level],
+                "reason": reason,
+                "inputs": inputs
+            }
+            self.decisions.append(decision)
+
+        s_print(f"[QUALITY] {camera.friendly_name}: {decision['from']} -> {decision['to']} ({reason}, {inputs})")
+        # Camera round trips are slow - keep them off the protocol thread
+        threading.Thread(target=self._apply, args=(camera, decision['to']), daemon=True).start()
+
+    def _apply(self, camera, quality):
+        result = camera.set_quality({"quality": quality})
+        if not result:
+            s_print(f"[QUALITY] Failed to apply {quality} to {camera.friendly_name}")
+
+    def get_state(self, serial=None):
+        """Current ladder position and recent decisions (for the API)"""
+        with self.lock:
+            cameras = {}
+            for cam_serial, state in self.cameras.items():
+                if serial is not None and cam_serial != serial:
+                    continue
+                cameras[cam_serial] = {
+                    "quality": self.ladder[state["level"]],
+                    "bad_streak": state["bad_streak"],
+                    "good_streak": state["good_streak"],
+                    "last_change": state["last_change"] or None,
+                    "last_inputs": state["last_inputs"]
+                }
+            decisions = [d for d in self.decisions if serial is None or d["serial_number"] == serial]
+        return {
+            "enabled": self.enabled,
+            "ladder": self.ladder,
+            "cameras": cameras,
+            "decisions": decisions
+        }
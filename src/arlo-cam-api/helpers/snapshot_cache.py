@@ -0,0 +1,67 @@
+import hashlib
+import threading
+import time
+
+
+class SnapshotCache:
+    """Most recent JPEG per camera, kept in memory
+
+    Frames come from snapshot uploads, motion recording thumbnails and live
+    stream keyframes. Readers can wait for a newer frame than the one they
+    have (e.g. after asking a camera for a snapshot).
+    """
+
+    def __init__(self):
+        self.frames = {}  # serial -> {"data", "etag", "time", "source"}
+        self.condition = threading.Condition()
+
+    def put(self, serial, data, source):
+        """Store a new frame for a camera and wake anyone waiting for it"""
+        if not data:
+            return
+        frame = {
+            "data": data,
+            "etag": f'"{hashlib.md5(data).hexdigest()}"',
+            "time": time.time(),
+            "source": source
+        }
+        with self.condition:
+            self.frames[serial] = frame
+            self.condition.notify_all()
+
+    def put_file(self, serial, path, source):
+        """Store a frame read from a JPEG on disk"""
+        try:
+            with open(path, 'rb') as f:
+                self.put(serial, f.read(), source)
+        except OSError:
+            pass
+
+    def get(self, serial):
+        """
+        Returns:
+            dict: The latest frame ({data, etag, time, source}) or None
+        """
+        with self.condition:
+            return self.frames.get(serial)
+
+    def wait_for_newer(self, serial, since, timeout):
+        """
+        Block until a frame newer than `since` (unix time) arrives
+
+        Returns:
+            dict: The new frame, or None on timeout
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                frame = self.frames.get(serial)
+                if frame is not None and frame["time"] > since:
+                    return frame
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+
+snapshot_cache = SnapshotCache()
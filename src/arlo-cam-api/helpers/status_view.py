@@ -0,0 +1,108 @@
+import datetime
+import os
+import sqlite3
+import threading
+
+from arlo.messages import Message
+from helpers.metrics import sqlite_seconds
+
+# Unix epoch (1970-01-01 00:00:00) as a Julian day
+# Julian day 0 = noon on January 1, 4713 BC
+EPOCH_JULIAN = 2440587.5
+
+
+def julian_to_iso(julian_day):
+    """Convert SQLite julianday() to an ISO 8601 UTC timestamp"""
+    if julian_day is None:
+        return None
+    seconds_since_epoch = (julian_day - EPOCH_JULIAN) * 86400
+    return datetime.datetime.utcfromtimestamp(seconds_since_epoch).isoformat() + 'Z'
+
+
+def camera_status_from_row(row):
+    """Build the /cameras/status entry for one camera row"""
+    (ip, serial_number, hostname, status_json, registration_json, friendly_name, last_seen_db, mac_address, connected, armed) = row
+
+    # Use connectivity checker result
+    online = bool(connected) if connected is not None else False
+
+    # Parse status for battery and other info
+    status = {}
+    if status_json:
+        try:
+            status = Message.from_json(status_json).dictionary
+        except:
+            pass
+
+    return {
+        "serial_number": serial_number,
+        "friendly_name": friendly_name or hostname or serial_number,
+        "hostname": hostname,
+        "ip": ip if online else None,
+        "mac_address": mac_address,
+        "online": online,
+        "armed": bool(armed) if armed is not None else True,
+        "battery_percent": status.get('BatPercent'),
+        "signal_strength": status.get('SignalStrengthIndicator'),
+        "charging_state": status.get('ChargingState'),
+        "charger_tech": status.get('ChargerTech'),
+        "battery_voltage": status.get('Bat1Volt'),
+        "last_seen": julian_to_iso(last_seen_db)
+    }
+
+
+class StatusView:
+    """Materialized /cameras/status payload
+
+    Anything that changes a camera row (status, registration, arm state,
+    connectivity) calls invalidate(). The payload is rebuilt from the
+    database on the next read only, and each rebuild is tagged with the
+    version that was current when it started so clients can poll with
+    If-None-Match and get a 304 while nothing has changed.
+    """
+
+    def __init__(self, db_path='arlo.db'):
+        self.db_path = db_path
+        # Versions restart with the process, so tag ETags with a boot id
+        self.boot_id = os.urandom(4).hex()
+        self.lock = threading.Lock()
+        self.version = 1
+        self.built_version = 0
+        self.cameras = []
+
+    def invalidate(self):
+        """Mark the view stale after a camera row changed"""
+        with self.lock:
+            self.version += 1
+
+    def etag(self, version=None):
+        if version is None:
+            with self.lock:
+                version = self.version
+        return f'"{self.boot_id}-{version}"'
+
+    def get(self):
+        """
+        Returns:
+            tuple: (version, list of camera status dicts)
+        """
+        with self.lock:
+            if self.built_version == self.version:
+                return self.version, self.cameras
+            version = self.version
+
+        # Rebuild outside the lock so invalidate() never waits on SQLite
+        with sqlite_seconds.time(operation='status_view'), sqlite3.connect(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("SELECT ip, serialnumber, hostname, status, register_set, friendlyname, last_seen, mac_address, connected, armed FROM camera")
+            cameras = [camera_status_from_row(row) for row in c.fetchall()]
+
+        with self.lock:
+            # Don't overwrite a newer rebuild that finished first
+            if version > self.built_version:
+                self.built_version = version
+                self.cameras = cameras
+            return version, cameras
+
+
+status_view = StatusView()
@@ -1,8 +1,125 @@
 import os
 import subprocess
 import shutil
+import tempfile
 import threading
+import time
 from helpers.safe_print import s_print
+from helpers.hls_playlist import HlsPlaylist
+from helpers.event_bus import event_bus
+
+# Live-view DVR window in seconds (0 keeps only the last few segments)
+# and where exported ranges are saved. Set by server.py from config.yaml
+DVR_WINDOW = 0
+RECORDING_BASE_PATH = '/tmp/'
+
+STREAM_BASE_DIR = '/tmp/arlo-stream'
+
+# Seconds a live-view lease lasts; viewers renew it to keep watching
+LEASE_DURATION = 60
+# Extra seconds after the lease for the helper to flush its last segment
+LEASE_GRACE = 10
+
+# Exit code used by gst_hls_stream.py when the camera drops the RTSP session
+EXIT_SOURCE_LOST = 2
+
+# Reconnect policy for a dropped RTSP session within a live-view lease
+RECONNECT_MAX_ATTEMPTS = 5
+RECONNECT_BACKOFF_INITIAL = 1.0  # seconds
+RECONNECT_BACKOFF_MAX = 8.0  # seconds
+RECONNECT_STABLE_AFTER = 15.0  # seconds of streaming before attempts reset
+
+# Motion recordings that are also publishing a live HLS rendition, by serial.
+# Values are [ffmpeg process, adopted flag]
+prewarmed_streams = {}
+# Who is using STREAM_BASE_DIR/<serial>: 'prewarm' for a motion recording's
+# rendition or the StreamManager serving live view. Taken before the
+# directory is touched so the two never reset or delete it under each other
+stream_dir_owners = {}
+prewarmed_lock = threading.Lock()
+
+
+def reserve_prewarm(camera_serial):
+    """
+    Reserve a camera's stream directory for a motion recording's live HLS
+
+    A stopped live stream's retained DVR ring is given up; a running
+    stream (or one still starting) keeps the directory.
+
+    Returns:
+        str: The emptied directory to publish into, or None if it is in use
+    """
+    with prewarmed_lock:
+        owner = stream_dir_owners.get(camera_serial)
+        if owner is not None:
+            if owner == 'prewarm' or not owner.stopped:
+                return None
+            owner.discard()
+        stream_dir_owners[camera_serial] = 'prewarm'
+        prewarmed_streams[camera_serial] = [None, False]
+        prewarm_dir = f"{STREAM_BASE_DIR}/{camera_serial}"
+        shutil.rmtree(prewarm_dir, ignore_errors=True)
+        os.makedirs(prewarm_dir, exist_ok=True)
+        return prewarm_dir
+
+
+def register_prewarm(camera_serial, process):
+    """Announce that the motion recording's ffmpeg is publishing live HLS"""
+    with prewarmed_lock:
+        prewarmed_streams[camera_serial][0] = process
+
+
+def claim_stream_dir(camera_serial, stream_manager):
+    """
+    Take a camera's stream directory for live view
+
+    Args:
+        stream_manager: The StreamManager that will use it
+
+    Returns:
+        tuple: (claimed, process) - process is a running motion rendition to
+               attach to, or None for a cold start. claimed is False while
+               another stream owns the directory or a rendition is starting
+    """
+    with prewarmed_lock:
+        owner = stream_dir_owners.get(camera_serial)
+        process = None
+        if owner == 'prewarm':
+            entry = prewarmed_streams[camera_serial]
+            if entry[0] is None:
+                return False, None
+            # Adopted even if ffmpeg just exited, so release_prewarm leaves
+            # the directory alone for our cold start
+            entry[1] = True
+            if entry[0].poll() is None:
+                process = entry[0]
+        elif owner is not None and owner is not stream_manager:
+            if not owner.stopped:
+                return False, None
+            owner.discard()
+        stream_dir_owners[camera_serial] = stream_manager
+        return True, process
+
+
+def release_prewarm(camera_serial, process):
+    """
+    Called when the motion recording finishes (process None if ffmpeg never
+    started). Deletes the rendition unless a viewer adopted it.
+
+    Returns:
+        bool: True if the rendition was deleted
+    """
+    with prewarmed_lock:
+        entry = prewarmed_streams.get(camera_serial)
+        if entry is None or entry[0] is not process:
+            return False
+        del prewarmed_streams[camera_serial]
+        if entry[1]:
+            return False
+        if stream_dir_owners.get(camera_serial) == 'prewarm':
+            del stream_dir_owners[camera_serial]
+        shutil.rmtree(f"{STREAM_BASE_DIR}/{camera_serial}", ignore_errors=True)
+        return True
 
 
 class StreamManager:
@@ -12,29 +129,47 @@ class StreamManager:
     at 5-second intervals. FFmpeg sends RTCP at 10-second intervals (hardcoded) which
     causes the camera to kill the stream after ~10 seconds. GStreamer sends RTCP at
     the correct 5-second interval.
+
+    If the camera drops the RTSP session before the lease runs out, a supervisor
+    thread wakes the camera again and restarts the helper on the same playlist
+    (with a discontinuity) using bounded exponential backoff.
+
+    The lease deadline is also written to <stream dir>/.lease, which the
+    helper re-reads, so renew() keeps the same pipeline running. When the
+    stream stops, the DVR ring is kept for another DVR_WINDOW seconds so the
+    window can still be exported.
     """
 
-    def __init__(self, camera_serial, camera_ip, camera=None, is4k=False):
+    def __init__(self, camera_serial, camera_ip, camera=None, is4k=False, on_source_lost=None):
         self.camera_serial = camera_serial
         self.camera_ip = camera_ip
-        self.camera = camera  # Not used but kept for API compatibility
+        self.camera = camera  # Used to wake the camera again on reconnect
         self.is4k = is4k
         self.gst_process = None
+        self.prewarm_process = None
         self.cleanup_timer = None
+        self.supervisor_thread = None
+        self.stopped = False
+        self.reconnecting = False
+        self.reconnect_count = 0
+        self.epoch = 0
+        self.lease_deadline = None
+        self.ring_removed = False
+        self.on_source_lost = on_source_lost  # callback(camera_serial) for loss stats
 
         # Stream directory and file paths
-        self.stream_dir = f"/tmp/arlo-stream/{camera_serial}"
+        self.stream_dir = f"{STREAM_BASE_DIR}/{camera_serial}"
         self.playlist_path = f"{self.stream_dir}/stream.m3u8"
 
         # RTSP URL
         self.rtsp_url = f"rtsp://{camera_ip}/live"
 
-    def start(self, duration=60):
+    def start(self, duration=LEASE_DURATION):
         """
         Start GStreamer HLS streaming process
 
         Args:
-            duration: Stream duration in seconds (default 60)
+            duration: Initial lease in seconds (default LEASE_DURATION)
 
         Returns:
             bool: True if stream started successfully, False otherwise
@@ -43,30 +178,17 @@ class StreamManager:
             # Create stream directory
             os.makedirs(self.stream_dir, exist_ok=True)
 
-            # Use Python GStreamer helper script for audio+video pipeline
-            helper_script = os.path.join(os.path.dirname(__file__), 'gst_hls_stream.py')
-            gst_cmd = [
-                'python3', helper_script,
-                self.rtsp_url,
-                self.stream_dir,
-                str(duration)
-            ]
-
-            s_print(f"[StreamManager] Starting GStreamer for {self.camera_serial} at {self.rtsp_url}")
-            s_print(f"[StreamManager] Command: {' '.join(gst_cmd)}")
+            self.lease_deadline = time.time() + duration
+            self._write_lease()
+            self._launch(duration)
+            self._schedule_expiry()
 
-            # Start GStreamer process
-            self.gst_process = subprocess.Popen(
-                gst_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-
-            # Schedule cleanup after duration (with buffer for EOS handling)
-            self.cleanup_timer = threading.Timer(duration + 10, self._cleanup)
-            self.cleanup_timer.start()
+            # Watch for the camera dropping the session mid-lease
+            self.supervisor_thread = threading.Thread(target=self._supervise, daemon=True)
+            self.supervisor_thread.start()
 
             s_print(f"[StreamManager] GStreamer started successfully for {self.camera_serial}")
+            event_bus.publish('stream_up', serial_number=self.camera_serial, prewarmed=False)
             return True
 
         except Exception as e:
@@ -74,6 +196,163 @@ class StreamManager:
             self._cleanup()
             return False
 
+    def attach(self, process, duration=LEASE_DURATION):
+        """
+        Take over a live rendition already published by a motion recording
+
+        The camera is already awake and streaming, so the viewer can start
+        playing straight away. When the recording finishes the supervisor
+        carries the same playlist on with GStreamer for the rest of the lease.
+
+        Args:
+            process: The motion recording's ffmpeg process (from take_prewarm)
+            duration: Initial lease in seconds (default LEASE_DURATION)
+        """
+        s_print(f"[StreamManager] Attaching to motion rendition for {self.camera_serial}")
+        self.prewarm_process = process
+        self.lease_deadline = time.time() + duration
+        self._write_lease()
+        self._schedule_expiry()
+
+        self.supervisor_thread = threading.Thread(target=self._supervise, daemon=True)
+        self.supervisor_thread.start()
+        event_bus.publish('stream_up', serial_number=self.camera_serial, prewarmed=True)
+        return True
+
+    def renew(self, duration=LEASE_DURATION):
+        """
+        Extend the lease so the stream keeps running (viewer keep-alive)
+
+        Args:
+            duration: Seconds from now the stream should run for at least
+
+        Returns:
+            bool: False if the stream has already stopped
+        """
+        if self.stopped:
+            return False
+        self.lease_deadline = max(self.lease_deadline, time.time() + duration)
+        self._write_lease()
+        self._schedule_expiry()
+        return True
+
+    def _write_lease(self):
+        """Publish the lease deadline for the helper (atomically)"""
+        lease_path = f"{self.stream_dir}/.lease"
+        try:
+            with open(f"{lease_path}.tmp", 'w') as lease:
+                lease.write(str(self.lease_deadline))
+            os.replace(f"{lease_path}.tmp", lease_path)
+        except OSError as e:
+            s_print(f"[StreamManager] Could not write lease for {self.camera_serial}: {e}")
+
+    def _schedule_expiry(self):
+        """(Re)arm the timer that stops the stream after the lease"""
+        if self.cleanup_timer is not None:
+            self.cleanup_timer.cancel()
+        delay = max(0, self.lease_deadline - time.time()) + LEASE_GRACE
+        self.cleanup_timer = threading.Timer(delay, self._expire)
+        self.cleanup_timer.daemon = True
+        self.cleanup_timer.start()
+
+    def _expire(self):
+        """Lease timer: stop streaming, keep the DVR ring for export"""
+        if not self.stopped and time.time() < self.lease_deadline:
+            # Renewed after the timer fired
+            self._schedule_expiry()
+            return
+        self._retire()
+
+    def _launch(self, duration):
+        """Start the GStreamer helper for the current epoch"""
+        # Use Python GStreamer helper script for audio+video pipeline
+        helper_script = os.path.join(os.path.dirname(__file__), 'gst_hls_stream.py')
+        gst_cmd = [
+            'python3', helper_script,
+            self.rtsp_url,
+            self.stream_dir,
+            str(int(duration)),
+            str(self.epoch),
+            str(int(DVR_WINDOW))
+        ]
+
+        s_print(f"[StreamManager] Starting GStreamer for {self.camera_serial} at {self.rtsp_url}")
+        s_print(f"[StreamManager] Command: {' '.join(gst_cmd)}")
+
+        # Helper output is not read, so don't let it fill a pipe and block
+        self.gst_process = subprocess.Popen(
+            gst_cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+    def _supervise(self):
+        """Restart the helper whenever the camera drops the RTSP session"""
+        if self.prewarm_process is not None:
+            # The motion recording owns the RTSP session until it finishes
+            self.prewarm_process.wait()
+            self.reconnecting = True
+            try:
+                self.prewarm_process = None
+                if self.stopped or not self._reconnect():
+                    return
+            finally:
+                self.reconnecting = False
+
+        attempts = 0
+        while not self.stopped:
+            process = self.gst_process
+            if process is None:
+                return
+            launched_at = time.time()
+            returncode = process.wait()
+            if self.stopped or returncode != EXIT_SOURCE_LOST:
+                return
+            if self.on_source_lost is not None:
+                self.on_source_lost(self.camera_serial)
+
+            if time.time() - launched_at >= RECONNECT_STABLE_AFTER:
+                attempts = 0
+            if attempts >= RECONNECT_MAX_ATTEMPTS:
+                s_print(f"[StreamManager] Giving up on {self.camera_serial} after {attempts} reconnect attempts")
+                return
+
+            delay = min(RECONNECT_BACKOFF_INITIAL * (2 ** attempts), RECONNECT_BACKOFF_MAX)
+            attempts += 1
+            s_print(f"[StreamManager] RTSP session lost for {self.camera_serial} - reconnect {attempts}/{RECONNECT_MAX_ATTEMPTS} in {delay:.0f}s")
+            event_bus.publish('stream_reconnecting', serial_number=self.camera_serial, attempt=attempts)
+            self.reconnecting = True
+            try:
+                time.sleep(delay)
+                if not self._reconnect():
+                    return
+            finally:
+                self.reconnecting = False
+
+    def _reconnect(self):
+        """Wake the camera and resume the same playlist in a new epoch"""
+        # Same wake-up sequence as the API uses for a cold start
+        if self.camera is not None:
+            self.camera.status_request()
+            time.sleep(2)
+            if self.stopped:
+                return False
+            self.camera.set_user_stream_active(1)
+            time.sleep(1)
+
+        remaining = self.lease_deadline - time.time()
+        if self.stopped or remaining < 1:
+            return False
+
+        self.epoch += 1
+        self.reconnect_count += 1
+        self._launch(remaining)
+        if self.stopped:
+            # Stopped while we were launching - don't leave an orphan helper
+            self.gst_process.terminate()
+            return False
+        return True
+
     def stop(self):
         """
         Stop the GStreamer streaming process and cleanup
@@ -82,14 +361,32 @@ class StreamManager:
             bool: True if stopped successfully
         """
         s_print(f"[StreamManager] Stopping stream for {self.camera_serial}")
-        self._cleanup()
+        self._retire()
         return True
 
+    def _retire(self):
+        """Stop streaming and remove the DVR ring once its window has passed"""
+        self._stop_stream()
+        if DVR_WINDOW > 0 and not self.ring_removed:
+            self.cleanup_timer = threading.Timer(DVR_WINDOW, self._remove_ring)
+            self.cleanup_timer.daemon = True
+            self.cleanup_timer.start()
+        else:
+            self._remove_ring()
+
     def _cleanup(self):
         """Internal cleanup method - terminates GStreamer and deletes temp files"""
+        self._stop_stream()
+        self._remove_ring()
+
+    def _stop_stream(self):
+        """Terminate GStreamer, leaving the stream directory in place"""
+        if not self.stopped:
+            event_bus.publish('stream_down', serial_number=self.camera_serial)
+        self.stopped = True
         try:
-            # Cancel cleanup timer if running
-            if self.cleanup_timer and self.cleanup_timer.is_alive():
+            # Cancel the lease or ring timer if running
+            if self.cleanup_timer is not None:
                 self.cleanup_timer.cancel()
                 self.cleanup_timer = None
 
@@ -107,15 +404,128 @@ class StreamManager:
 
                 self.gst_process = None
 
-            # Delete stream directory and all files
+        except Exception as e:
+            s_print(f"[StreamManager] Error during cleanup for {self.camera_serial}: {e}")
+
+    def _remove_ring(self):
+        """Delete the stream directory and all files (unless it changed hands)"""
+        with prewarmed_lock:
+            if self.ring_removed:
+                return
+            self.ring_removed = True
+            if stream_dir_owners.get(self.camera_serial, self) is not self:
+                return
+            stream_dir_owners.pop(self.camera_serial, None)
             if os.path.exists(self.stream_dir):
                 s_print(f"[StreamManager] Cleaning up stream directory: {self.stream_dir}")
                 shutil.rmtree(self.stream_dir, ignore_errors=True)
+        s_print(f"[StreamManager] Cleanup complete for {self.camera_serial}")
 
-            s_print(f"[StreamManager] Cleanup complete for {self.camera_serial}")
+    def discard(self):
+        """
+        Give up a stopped stream's retained ring to the next owner of the
+        directory without deleting it (called under prewarmed_lock)
+        """
+        self.ring_removed = True
+        if self.cleanup_timer is not None:
+            self.cleanup_timer.cancel()
+            self.cleanup_timer = None
 
-        except Exception as e:
-            s_print(f"[StreamManager] Error during cleanup for {self.camera_serial}: {e}")
+    def is_exportable(self):
+        """
+        Returns:
+            bool: True while the stream or its retained DVR ring is available
+        """
+        return not self.ring_removed
+
+    def export_range(self, start=None, end=None):
+        """
+        Save part of the DVR window as a permanent recording (no re-encode)
+
+        Args:
+            start: Unix time of the first frame wanted (default: oldest in window)
+            end: Unix time of the last frame wanted (default: live edge)
+
+        Returns:
+            str: Path of the exported .mkv, or None if nothing could be exported
+        """
+        playlist = HlsPlaylist.load(self.playlist_path)
+        segments = playlist.segments_between(start, end)
+        if not segments:
+            return None
+
+        first = int(segments[0]["program_date_time"] or time.time())
+        # Same naming as motion recordings so the viewer lists it. A
+        # recording may already own that second, so step back to a free one
+        # (never forward, where a new motion recording would be named)
+        while True:
+            timestr = time.strftime("%Y%m%d-%H%M%S", time.localtime(first))
+            output_path = f"{RECORDING_BASE_PATH}arlo-{self.camera_serial}-{timestr}.mkv"
+            if not os.path.exists(output_path):
+                break
+            first -= 1
+
+        with tempfile.TemporaryDirectory(prefix='arlo-export-') as work_dir:
+            # Copy out of the ring first - the slots keep being overwritten
+            list_path = os.path.join(work_dir, 'segments.txt')
+            with open(list_path, 'w') as segment_list:
+                for index, segment in enumerate(segments):
+                    source = os.path.join(self.stream_dir, segment["uri"].split('?', 1)[0])
+                    copy = os.path.join(work_dir, f"{index:05d}.ts")
+                    if segment.get("length") is None:
+                        shutil.copyfile(source, copy)
+                    else:
+                        # Ring slot: only the head belongs to this segment
+                        with open(source, 'rb') as src, open(copy, 'wb') as dst:
+                            dst.write(src.read(segment["length"]))
+                    segment_list.write(f"file '{copy}'\n")
+
+            ffmpeg_cmd = [
+                'ffmpeg', '-n',
+                '-f', 'concat', '-safe', '0',
+                '-i', list_path,
+                '-c', 'copy',
+                '-f', 'matroska',
+                output_path
+            ]
+            result = subprocess.run(ffmpeg_cmd, capture_output=True, timeout=60)
+
+        if result.returncode != 0:
+            s_print(f"[StreamManager] Export failed for {self.camera_serial}: {result.stderr.decode()[-500:]}")
+            return None
+
+        s_print(f"[StreamManager] Exported {len(segments)} segments for {self.camera_serial} to {output_path}")
+        return output_path
+
+    def grab_keyframe(self):
+        """
+        Decode the first frame of the newest segment as a JPEG
+
+        Segments start on a keyframe, so this is a single-frame decode.
+
+        Returns:
+            bytes: JPEG data, or None if no segment is available yet
+        """
+        playlist = HlsPlaylist.load(self.playlist_path)
+        if not playlist.segments:
+            return None
+        newest = os.path.join(self.stream_dir, playlist.segments[-1]["uri"].split('?', 1)[0])
+        ffmpeg_cmd = [
+            'ffmpeg',
+            '-i', newest,
+            '-frames:v', '1',
+            '-q:v', '2',
+            '-f', 'image2',
+            '-c:v', 'mjpeg',
+            'pipe:1'
+        ]
+        try:
+            result = subprocess.run(ffmpeg_cmd, capture_output=True, timeout=5)
+        except subprocess.TimeoutExpired:
+            return None
+        if result.returncode != 0 or not result.stdout:
+            return None
+        return result.stdout
 
     def get_playlist_path(self):
         """
@@ -131,6 +541,12 @@ class StreamManager:
         Check if the stream is currently active
 
         Returns:
-            bool: True if GStreamer process is running, False otherwise
+            bool: True if GStreamer is running or being reconnected, False otherwise
         """
+        if self.stopped:
+            return False
+        if self.reconnecting:
+            return True
+        if self.prewarm_process is not None and self.prewarm_process.poll() is None:
+            return True
         return self.gst_process is not None and self.gst_process.poll() is None
@@ -0,0 +1,33 @@
+import subprocess
+
+from helpers.safe_print import s_print
+
+
+def downscale_jpeg(data, max_width=640, quality=5):
+    """
+    Shrink a JPEG in memory with ffmpeg
+
+    Args:
+        data: JPEG bytes
+        max_width: Width to scale down to (never scales up)
+        quality: ffmpeg -q:v (2 best .. 31 worst)
+
+    Returns:
+        bytes: The smaller JPEG, or the original if ffmpeg failed
+    """
+    ffmpeg_cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-f', 'image2pipe', '-i', '-',
+        '-vf', f"scale='min({int(max_width)},iw)':-2",
+        '-frames:v', '1',
+        '-q:v', str(quality),
+        '-f', 'image2', '-c:v', 'mjpeg', '-'
+    ]
+    try:
+        result = subprocess.run(ffmpeg_cmd, input=data, capture_output=True, timeout=5)
+        if result.returncode == 0 and result.stdout:
+            return result.stdout
+        s_print(f"[THUMBNAIL] Downscale failed: {result.stderr.decode(errors='replace').strip()}")
+    except (OSError, subprocess.TimeoutExpired) as e:
+        s_print(f"[THUMBNAIL] Downscale failed: {e}")
+    return data
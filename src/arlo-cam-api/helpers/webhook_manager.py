@@ -1,98 +1,175 @@
+import base64
 import time
-import requests
+import uuid
 from helpers.safe_print import s_print
-from webhooks import webhook
-from webhooks.senders import targeted
+from helpers.metrics import notification_seconds, notification_errors, ntfy_time_to_notification_seconds
+from helpers.snapshot_cache import snapshot_cache
+from helpers.thumbnail import downscale_jpeg
+from helpers.notification_outbox import NotificationOutbox
+from helpers.http_pool import HttpSessionPool
+from helpers.notification_policy import NotificationPolicy
 
 class WebHookManager:
 
     def __init__(self,config):
         self.config = config
+        # Callers only queue notifications; the outbox workers deliver them
+        self.outbox = NotificationOutbox(
+            workers=config.get('NotificationWorkers', 4),
+            max_attempts=config.get('NotificationMaxAttempts', 10),
+            retry_max=config.get('NotificationRetryMax', 600)
+        )
+        self.outbox.register('webhook', self.deliver_webhook)
+        self.outbox.register('ntfy', self.deliver_ntfy)
+        # Keep-alive connections per destination host
+        self.http = HttpSessionPool(pool_size=config.get('NotificationPoolSize', 4))
+        # Rate limits motion pushes; the excess is sent as digests
+        self.policy = NotificationPolicy(config, on_digest=self.send_ntfy_digest)
+
+    def start(self):
+        """Start delivering queued notifications (including ones left from the last run)"""
+        self.outbox.start()
+        self.policy.start()
 
     def motion_detected(self, ip,friendly_name,hostname,serial_number,zone,file_name):
-        # Send standard webhook
-        r = self.motion(ip,friendly_name,hostname, serial_number,zone,file_name,time.time(), url=self.config['MotionRecordingWebHookUrl'],encoding="application/json", timeout=5)
-        # s_print(str(r))  # Disabled - too verbose
+        # Queue standard webhook
+        self.outbox.enqueue('webhook', {
+            "ip": ip,
+            "friendly_name": friendly_name,
+            "hostname": hostname,
+            "serial_number": serial_number,
+            "zone": zone,
+            "file_name": file_name,
+            "time": time.time(),
+            # Same for every attempt so receivers can drop repeats
+            "hash": uuid.uuid4().hex
+        })
 
-        # Send ntfy alert if enabled
+        # Queue ntfy alert if enabled and the camera/topic isn't over its rate limit
         if self.config.get('NtfyEnabled', False):
-            self.send_ntfy_alert(friendly_name, hostname, serial_number, zone, file_name)
+            camera_name = friendly_name or hostname or serial_number
+            topic = self.config.get('NtfyTopic', 'arlo-alerts')
+            if self.policy.admit(serial_number, topic, camera_name, zone, file_name):
+                self.send_ntfy_alert(friendly_name, hostname, serial_number, zone, file_name)
 
     def send_ntfy_alert(self, friendly_name, hostname, serial_number, zone, file_name):
-        """Send push notification via ntfy.sh"""
+        """Queue a push notification via ntfy.sh"""
         try:
-            ntfy_url = self.config.get('NtfyUrl', 'https://ntfy.sh')
-            ntfy_topic = self.config.get('NtfyTopic', 'arlo-alerts')
-
             # Construct message
             camera_name = friendly_name or hostname or serial_number
             zone_text = f" (Zone: {zone})" if zone else ""
             message = f"Motion detected: {camera_name}{zone_text}"
 
-            # Prepare headers
-            headers = {
-                "Title": "Arlo Motion Alert",
-                "Priority": self.config.get('NtfyPriority', 'high'),
-                "Tags": "rotating_light,camera,motion"
-            }
+            headers = self.motion_headers("Arlo Motion Alert", file_name)
 
-            # Add thumbnail if configured
-            if self.config.get('NtfyIncludeThumbnail', False):
-                # Convert to .jpg filename for the thumbnail URL
-                thumbnail_url = self.config.get('NtfyThumbnailBaseUrl', '')
-                if thumbnail_url:
-                    # Extract filename and convert .mkv to .jpg
-                    video_filename = file_name.split('/')[-1]
-                    thumbnail_filename = video_filename.replace('.mkv', '.jpg')
-                    headers["Attach"] = f"{thumbnail_url}/{thumbnail_filename}"
-
-            # Add click action to video viewer
-            base_url = self.config.get('NtfyClickUrl', 'https://security.example.com')
-            # TODO: Add specific video linking when arlo-viewer supports URL parameters
+            self.outbox.enqueue('ntfy', {
+                "kind": "ntfy",
+                "message": message,
+                "headers": headers,
+                "thumbnail": self.motion_thumbnail(serial_number, file_name, latest=False),
+                "time": time.time(),
+                "log": f"[NTFY] Alert sent for {camera_name}"
+            })
 
-            headers["Click"] = base_url
-            # Add action button with custom text
-            headers["Actions"] = f"view, See video, {base_url}, clear=true"
+        except Exception as e:
+            s_print(f"[NTFY] Error queuing alert: {e}")
 
-            # Send notification
-            response = requests.post(
-                f"{ntfy_url}/{ntfy_topic}",
-                data=message.encode('utf-8'),
-                headers=headers,
-                timeout=5
-            )
+    def send_ntfy_digest(self, serial_number, digest):
+        """Queue one ntfy message summing up motion alerts held back by the rate limit"""
+        minutes = max(1, round(self.policy.digest_window / 60))
+        message = f"{digest['camera_name']}: {digest['count']} motion events in {minutes} min"
+        if digest["zones"]:
+            message += f" (Zones: {', '.join(digest['zones'])})"
 
-            if response.status_code == 200:
-                s_print(f"[NTFY] Alert sent for {camera_name}")
-            else:
-                s_print(f"[NTFY] Failed to send alert: {response.status_code}")
+        # Latest recording's thumbnail
+        headers = self.motion_headers("Arlo Motion Digest", digest.get("file_name"))
+        self.outbox.enqueue('ntfy', {
+            "kind": "ntfy_digest",
+            "message": message,
+            "headers": headers,
+            "thumbnail": self.motion_thumbnail(serial_number, digest.get("file_name"), latest=True),
+            "time": time.time(),
+            "log": f"[NTFY] Digest sent for {digest['camera_name']} ({digest['count']} events)"
+        })
 
-        except Exception as e:
-            s_print(f"[NTFY] Error sending alert: {e}")
+    def motion_headers(self, title, file_name):
+        """ntfy headers for a motion push: thumbnail attachment and viewer links"""
+        headers = {
+            "Title": title,
+            "Priority": self.config.get('NtfyPriority', 'high'),
+            "Tags": "rotating_light,camera,motion"
+        }
 
-    def send_battery_warning(self, friendly_name, hostname, serial_number, battery_percent, is_critical=False):
-        """Send battery low/critical warning via ntfy"""
-        try:
-            if not self.config.get('BatteryWarningEnabled', False):
-                return
+        # Add thumbnail if configured
+        if self.config.get('NtfyIncludeThumbnail', False) and file_name:
+            # Convert to .jpg filename for the thumbnail URL
+            thumbnail_url = self.config.get('NtfyThumbnailBaseUrl', '')
+            if thumbnail_url:
+                # Extract filename and convert .mkv to .jpg
+                video_filename = file_name.split('/')[-1]
+                thumbnail_filename = video_filename.replace('.mkv', '.jpg')
+                headers["Attach"] = f"{thumbnail_url}/{thumbnail_filename}"
 
-            if not self.config.get('NtfyEnabled', False):
-                return
+        # Add click action to video viewer
+        base_url = self.config.get('NtfyClickUrl', 'https://security.example.com')
+        # TODO: Add specific video linking when arlo-viewer supports URL parameters
 
-            ntfy_url = self.config.get('NtfyUrl', 'https://ntfy.sh')
-            ntfy_topic = self.config.get('NtfyTopic', 'arlo-alerts')
+        headers["Click"] = base_url
+        # Add action button with custom text
+        headers["Actions"] = f"view, See video, {base_url}, clear=true"
+        return headers
 
-            # Construct message
-            camera_name = friendly_name or hostname or serial_number
-            level = "CRITICAL" if is_critical else "LOW"
-            message = f"Battery {level}: {camera_name} at {battery_percent}%"
+    def motion_thumbnail(self, serial_number, file_name, latest):
+        """
+        Where deliver_ntfy finds the JPEG to upload (NtfyAttachMode: upload)
+
+        Args:
+            serial_number: Camera the thumbnail belongs to
+            file_name: Recording (.mkv) whose .jpg sits next to it
+            latest: Accept the camera's latest recording thumbnail from the
+                    in-memory cache rather than only this exact frame
+
+        Returns:
+            dict: {serial_number, path, etag, latest}, or None when not uploading
+        """
+        if (self.config.get('NtfyAttachMode', 'url') != 'upload'
+                or not self.config.get('NtfyIncludeThumbnail', False) or not file_name):
+            return None
+        # The recording thread caches the thumbnail just before queuing the alert
+        frame = snapshot_cache.get(serial_number)
+        return {
+            "serial_number": serial_number,
+            "path": file_name.replace('.mkv', '.jpg'),
+            "etag": frame["etag"] if frame is not None and frame["source"] == 'recording' else None,
+            "latest": latest
+        }
 
-            # Prepare headers
-            priority = "urgent" if is_critical else "high"
-            tags = "warning,battery" if not is_critical else "warning,battery,rotating_light"
+    def load_thumbnail(self, thumbnail):
+        """
+        Read a queued alert's thumbnail, from memory if still cached, and shrink it
+
+        Returns:
+            bytes: Downscaled JPEG, or None if it can't be found
+        """
+        frame = snapshot_cache.get(thumbnail["serial_number"])
+        if frame is not None and frame["source"] == 'recording' and (thumbnail["latest"] or thumbnail["etag"] == frame["etag"]):
+            data = frame["data"]
+        else:
+            try:
+                with open(thumbnail["path"], 'rb') as f:
+                    data = f.read()
+            except OSError:
+                return None
+        return downscale_jpeg(data, self.config.get('NtfyAttachMaxWidth', 640))
+
+    def send_status_alert(self, kind, title, message, priority, tags, log):
+        """Queue a status alert (battery, temperature, signal, offline) via ntfy"""
+        try:
+            if not self.config.get('NtfyEnabled', False):
+                return
 
             headers = {
-                "Title": f"Arlo Battery {level}",
+                "Title": title,
                 "Priority": priority,
                 "Tags": tags
             }
@@ -101,22 +178,114 @@ class WebHookManager:
             base_url = self.config.get('NtfyClickUrl', 'https://security.example.com')
             headers["Click"] = base_url
 
+            self.outbox.enqueue('ntfy', {
+                "kind": kind,
+                "message": message,
+                "headers": headers,
+                "time": time.time(),
+                "log": log
+            })
+
+        except Exception as e:
+            s_print(f"[ALERTS] Error queuing {kind}: {e}")
+
+    def deliver_webhook(self, payload, attempt=1):
+        """Outbox sender for the motion webhook; raises so failures are retried"""
+        url = self.config['MotionRecordingWebHookUrl']
+        started = time.monotonic()
+        try:
+            body = self.motion(payload["ip"], payload["friendly_name"], payload["hostname"], payload["serial_number"],
+                               payload["zone"], payload["file_name"], payload["time"])
+            # Same form-encoded fields the webhooks package used to post
+            body["url"] = url
+            body["attempt"] = attempt
+            if "hash" in payload:
+                # Rows queued before the hash was added go without, as
+                # with the package's placebo hash
+                body["hash"] = payload["hash"]
+            response = self.http.post(url, data=body, timeout=5)
+            if not 200 <= response.status_code < 300:
+                raise RuntimeError(f"Webhook returned {response.status_code}")
+        except Exception:
+            notification_errors.inc(kind='webhook')
+            raise
+        finally:
+            notification_seconds.observe(time.monotonic() - started, kind='webhook')
+
+    def deliver_ntfy(self, payload, attempt=1):
+        """Outbox sender for ntfy messages; raises so failures are retried"""
+        ntfy_url = self.config.get('NtfyUrl', 'https://ntfy.sh')
+        ntfy_topic = self.config.get('NtfyTopic', 'arlo-alerts')
+        kind = payload.get("kind", "ntfy")
+        headers = payload["headers"]
+
+        # Upload mode: PUT the thumbnail as the attachment so ntfy doesn't
+        # have to fetch it back through the tunnel; any failure falls back
+        # to the Attach URL below
+        thumbnail = payload.get("thumbnail")
+        if thumbnail is not None:
+            if self.upload_ntfy(ntfy_url, ntfy_topic, kind, payload, thumbnail):
+                self.notified(payload, kind, 'upload')
+                return
+
+        try:
             # Send notification
-            response = requests.post(
-                f"{ntfy_url}/{ntfy_topic}",
-                data=message.encode('utf-8'),
-                headers=headers,
-                timeout=5
-            )
+            with notification_seconds.time(kind=kind):
+                response = self.http.post(
+                    f"{ntfy_url}/{ntfy_topic}",
+                    data=payload["message"].encode('utf-8'),
+                    headers=headers,
+                    timeout=5
+                )
+            if response.status_code != 200:
+                raise RuntimeError(f"ntfy returned {response.status_code}")
+        except Exception:
+            notification_errors.inc(kind=kind)
+            raise
 
-            if response.status_code == 200:
-                s_print(f"[BATTERY] Warning sent for {camera_name}: {battery_percent}% ({level})")
-            else:
-                s_print(f"[BATTERY] Failed to send warning: {response.status_code}")
+        self.notified(payload, kind, 'url' if "Attach" in headers else 'none')
+
+    def upload_ntfy(self, ntfy_url, ntfy_topic, kind, payload, thumbnail):
+        """
+        Send an ntfy message with the thumbnail as its attachment body
+
+        Returns:
+            bool: True if ntfy accepted it
+        """
+        jpeg = self.load_thumbnail(thumbnail)
+        if jpeg is None:
+            s_print(f"[NTFY] Thumbnail {thumbnail['path']} not found, using attachment URL")
+            return False
 
+        # With a file body the message text travels in a header
+        headers = {name: value for name, value in payload["headers"].items() if name != "Attach"}
+        headers["Message"] = header_value(payload["message"])
+        headers["Filename"] = thumbnail["path"].split('/')[-1]
+        try:
+            with notification_seconds.time(kind=f"{kind}_upload"):
+                response = self.http.put(f"{ntfy_url}/{ntfy_topic}", data=jpeg, headers=headers, timeout=10)
+            if response.status_code == 200:
+                return True
+            # e.g. 413 when the server has attachments disabled
+            s_print(f"[NTFY] Thumbnail upload returned {response.status_code}, using attachment URL")
         except Exception as e:
-            s_print(f"[BATTERY] Error sending warning: {e}")
+            s_print(f"[NTFY] Thumbnail upload failed, using attachment URL: {e}")
+        notification_errors.inc(kind=f"{kind}_upload")
+        return False
+
+    def notified(self, payload, kind, mode):
+        if "time" in payload:
+            ntfy_time_to_notification_seconds.observe(time.time() - payload["time"], kind=kind, mode=mode)
+        s_print(payload["log"])
 
-    @webhook(sender_callable=targeted.sender)
-    def motion(self, ip, friendly_name,hostname,serial_number,zone,file_name,_time, url, encoding, timeout):
+    def motion(self, ip, friendly_name,hostname,serial_number,zone,file_name,_time):
         return {"ip":ip,"friendly_name":friendly_name,"hostname":hostname,"serial_number":serial_number,"zone":zone,"file_name":file_name,"time":_time}
+
+
+def header_value(text):
+    """RFC 2047 encode non-ASCII text for an HTTP header (ntfy decodes it)"""
+    try:
+        text.encode('ascii')
+        return text
+    except UnicodeEncodeError:
+        return f"=?UTF-8?B?{base64.b64encode(text.encode('utf-8')).decode('ascii')}?="
@@ -1,6 +1,7 @@
 import socket
 import sys
 import json
+import signal
 import threading
 import sqlite3
 import time
@@ -14,8 +15,15 @@ from arlo.camera import Camera
 from helpers.safe_print import s_print
 from helpers.recorder import Recorder
 from helpers.webhook_manager import WebHookManager
+from helpers.quality_controller import QualityController
+from helpers.alert_rules import AlertRuleEngine
+from helpers.battery_forecast import BatteryForecaster
+from helpers.snapshot_cache import snapshot_cache
+from helpers.event_bus import event_bus
+from helpers.metrics import messages_received, alert_ack_seconds, recording_start_seconds, recording_duration_seconds, recording_exits
 import api.api
 from helpers.connectivity_checker import ConnectivityChecker
+from helpers.dhcp_leases import lease_index
 
 # Configure logging to file for easy access
 logging.basicConfig(
@@ -36,6 +44,17 @@ import arlo.camera
 arlo.camera.CAMERA_ALIASES = config.get('CameraAliases', {})
 
 webhook_manager = WebHookManager(config)
+quality_controller = QualityController(config)
+alert_rules = AlertRuleEngine(config, notify=webhook_manager.send_status_alert)
+api.api.alert_rules = alert_rules
+battery_forecaster = BatteryForecaster(config)
+api.api.battery_forecaster = battery_forecaster
+api.api.quality_controller = quality_controller
+api.api.notification_policy = webhook_manager.policy
+api.api.SNAPSHOT_CALLBACK_URL = config.get('SnapshotCallbackUrl', api.api.SNAPSHOT_CALLBACK_URL)
+api.api.ASYNC_COMMANDS = config.get('ApiAsyncCommands', False)
+api.api.SNAPSHOT_DIR = config.get('SnapshotDir', api.api.SNAPSHOT_DIR)
+api.api.SNAPSHOT_MAX_BYTES = config.get('SnapshotMaxBytes', api.api.SNAPSHOT_MAX_BYTES)
 
 with sqlite3.connect('arlo.db') as conn:
     c = conn.cursor()
@@ -49,19 +68,31 @@ with sqlite3.connect('arlo.db') as conn:
 recorder_lock = threading.Lock()
 recorders = {}
 
-# Battery warning tracking
-# Stores last warned level for each camera: {serial_number: last_warned_level}
-# Levels: None (not warned), 'low' (warned at 25%), 'critical' (warned at 10%)
-battery_warning_state = {}
-battery_warning_lock = threading.Lock()
-
 WIFI_COUNTRY_CODE=config['WifiCountryCode']
 MOTION_RECORDING_TIMEOUT=config['MotionRecordingTimeout']
+# Address the camera socket server binds ('' = all); a single address lets
+# simulated cameras listen on port 4000 of other loopback addresses
+CAMERA_LISTEN_ADDRESS=config.get('CameraListenAddress', '')
 AUDIO_RECORDING_TIMEOUT=config['AudioRecordingTimeout']
 RECORDING_BASE_PATH=config['RecordingBasePath']
 RECORD_ON_MOTION_ALERT=config['RecordOnMotionAlert']
 RECORD_ON_AUDIO_ALERT=config['RecordOnAudioAlert']
 
+# Live-view DVR window and export location for the stream manager
+import helpers.stream_manager
+helpers.stream_manager.DVR_WINDOW = config.get('LiveDvrWindow', 0)
+helpers.stream_manager.RECORDING_BASE_PATH = RECORDING_BASE_PATH
+PREWARM_ON_MOTION = config.get('LiveViewPrewarmOnMotion', True)
+
+import helpers.profiling
+helpers.profiling.ENABLED = config.get('ProfilingEnabled', False)
+
+import helpers.camera_latency
+helpers.camera_latency.MIN_TIMEOUT = config.get('SendMessageMinTimeout', helpers.camera_latency.MIN_TIMEOUT)
+helpers.camera_latency.MAX_TIMEOUT = config.get('SendMessageMaxTimeout', helpers.camera_latency.MAX_TIMEOUT)
+helpers.camera_latency.CONNECT_RETRIES = config.get('SendMessageConnectRetries', helpers.camera_latency.CONNECT_RETRIES)
+helpers.camera_latency.AWAKE_WINDOW = config.get('SendMessageAwakeWindow', helpers.camera_latency.AWAKE_WINDOW)
+
 def generate_thumbnail(video_filename):
     """Generate thumbnail from video file using ffmpeg"""
     import subprocess
@@ -95,10 +126,11 @@ def generate_thumbnail(video_filename):
         s_print(f"[THUMBNAIL] Error generating thumbnail: {e}")
         return False
 
-def monitor_and_record(ip, rtsp_url, filename, serial_number, zones, webhook_manager, friendly_name, hostname):
+def monitor_and_record(ip, rtsp_url, filename, serial_number, zones, webhook_manager, friendly_name, hostname, alert_time=None):
     """Background thread: monitor port 554, then record immediately when port opens"""
     import subprocess
     import socket as sock_module
+    import os
 
     recording_duration = 10  # seconds - matches battery camera stream duration
     max_wait = 3.0  # seconds - maximum time to wait for port to open
@@ -133,6 +165,35 @@ def monitor_and_record(ip, rtsp_url, filename, serial_number, zones, webhook_man
     # Generate thumbnail filename
     thumbnail_filename = filename.replace('.mkv', '.jpg')
 
+    # Publish a live HLS rendition from the same RTSP session so opening live
+    # view from the notification doesn't have to wake the camera again.
+    # Skipped when someone is already watching (their stream owns the directory)
+    prewarm_dir = None
+    if PREWARM_ON_MOTION:
+        prewarm_dir = helpers.stream_manager.reserve_prewarm(serial_number)
+
+    if prewarm_dir is None:
+        video_output = [
+            '-avoid_negative_ts', 'make_zero',
+            '-f', 'matroska',
+            filename
+        ]
+    else:
+        # tee keeps one demux for both; onfail=ignore so a viewer tearing
+        # down the HLS directory can never break the recording
+        hls_options = ':'.join([
+            'f=hls',
+            'hls_time=2',
+            'hls_list_size=5',
+            'hls_flags=delete_segments+omit_endlist',
+            f'hls_segment_filename={prewarm_dir}/prewarm-%05d.ts',
+            'onfail=ignore'
+        ])
+        video_output = [
+            '-f', 'tee',
+            f"[f=matroska:avoid_negative_ts=make_zero]{filename}|[{hls_options}]{prewarm_dir}/stream.m3u8"
+        ]
+
     # Stream is ready - start recording with dual output (video + thumbnail)
     ffmpeg_cmd = [
         'ffmpeg',
@@ -142,13 +203,11 @@ def monitor_and_record(ip, rtsp_url, filename, serial_number, zones, webhook_man
         '-probesize', '10000000',
         '-rtsp_transport', 'udp',
         '-i', rtsp_url,
-        # First output: full video (10 seconds)
+        # First output: full video (10 seconds), plus live HLS when pre-warming
         '-t', str(recording_duration),
         '-c:v', 'copy',
         '-c:a', 'copy',
-        '-avoid_negative_ts', 'make_zero',
-        '-f', 'matroska',
-        filename,
+    ] + video_output + [
         # Second output: thumbnail (first frame only)
         '-frames:v', '1',
         '-q:v', '2',
@@ -158,8 +217,19 @@ def monitor_and_record(ip, rtsp_url, filename, serial_number, zones, webhook_man
     # Run ffmpeg and wait for completion
     logfile = f"{RECORDING_BASE_PATH}ffmpeg-{serial_number}-{time.strftime('%Y%m%d-%H%M%S')}.log"
     log = open(logfile, 'w')
-    proc = subprocess.Popen(ffmpeg_cmd, stdout=log, stderr=log)
+    try:
+        proc = subprocess.Popen(ffmpeg_cmd, stdout=log, stderr=log)
+    except OSError:
+        log.close()
+        if prewarm_dir is not None:
+            helpers.stream_manager.release_prewarm(serial_number, None)
+        raise
+    recording_started = time.monotonic()
+    if alert_time is not None:
+        recording_start_seconds.observe(recording_started - alert_time)
     s_print(f"[{ip}] Recording started: {filename} (log: {logfile})")
+    if prewarm_dir is not None:
+        helpers.stream_manager.register_prewarm(serial_number, proc)
 
     # Wait briefly for thumbnail to be generated (first frame capture)
     import os
@@ -168,6 +238,7 @@ def monitor_and_record(ip, rtsp_url, filename, serial_number, zones, webhook_man
     for _ in range(int(max_wait / wait_interval)):
         if os.path.exists(thumbnail_filename):
             s_print(f"[{ip}] Thumbnail ready: {thumbnail_filename}")
+            snapshot_cache.put_file(serial_number, thumbnail_filename, 'recording')
             break
         time.sleep(wait_interval)
     else:
@@ -181,6 +252,7 @@ def monitor_and_record(ip, rtsp_url, filename, serial_number, zones, webhook_man
     recording_success = False
     try:
         returncode = proc.wait(timeout=timeout)
+        recording_exits.inc(code=returncode)
         if returncode == 0:
             s_print(f"[{ip}] Recording completed successfully")
             recording_success = True
@@ -190,6 +262,7 @@ def monitor_and_record(ip, rtsp_url, filename, serial_number, zones, webhook_man
         s_print(f"[{ip}] Recording timeout - killing ffmpeg process")
         proc.kill()
         proc.wait()
+        recording_exits.inc(code='timeout')
         # Even though ffmpeg timed out, if video file exists with content, consider it successful
         import os
         if os.path.exists(filename) and os.path.getsize(filename) > 100000:  # > 100KB
@@ -197,7 +270,17 @@ def monitor_and_record(ip, rtsp_url, filename, serial_number, zones, webhook_man
             recording_success = True
     finally:
         log.close()
+        recording_duration_seconds.observe(time.monotonic() - recording_started)
         # Thumbnail already generated during recording (dual output)
+        event_bus.publish('recording_finished',
+                          serial_number=serial_number,
+                          friendly_name=friendly_name,
+                          filename=os.path.basename(filename),
+                          thumbnail=os.path.basename(thumbnail_filename) if os.path.exists(thumbnail_filename) else None,
+                          success=recording_success)
+        if prewarm_dir is not None:
+            # Drops the rendition unless live view adopted it
+            helpers.stream_manager.release_prewarm(serial_number, proc)
 
 class ConnectionThread(threading.Thread):
     def __init__(self,connection,ip,port):
@@ -207,10 +290,16 @@ class ConnectionThread(threading.Thread):
         self.port = port
 
     def run(self):
+        with helpers.profiling.span('ConnectionThread.run'):
+            self.handle_connection()
+
+    def handle_connection(self):
         while True:
             timestr = time.strftime("%Y%m%d-%H%M%S")
             msg = self.connection.receive()
+            received_at = time.monotonic()
             if msg != None:
+                messages_received.inc(type=msg['Type'])
                 # RAW MESSAGE LOGGING - see everything camera sends (disabled - too verbose)
                 # logging.info(f"RAW MESSAGE from {self.ip}: {json.dumps(msg.dictionary, indent=2)}")
 
@@ -241,47 +330,39 @@ class ConnectionThread(threading.Thread):
                     # else: keep REGISTER_SET_INITIAL defaults (Armed, VME enabled, Audio disarmed)
 
                     camera.send_message(registerSet)
+                    quality_controller.on_registration(camera)
+                    alert_rules.on_registration(camera)
+                    lease_index.match_camera(camera.serial_number)
+                    connectivity_thread.note_traffic(camera.serial_number)
                 elif (msg['Type'] == "status"):
                     s_print(f"<[{self.ip}][{msg['ID']}] Status from {msg['SystemSerialNumber']}")
                     camera = Camera.from_db_serial(msg['SystemSerialNumber'])
+                    previous_status = camera.status.dictionary if camera.status else {}
                     camera.ip = self.ip
                     camera.status = msg
                     camera.persist()
 
-                    # Check battery level and send warnings if enabled
-                    if config.get('BatteryWarningEnabled', False):
-                        battery_percent = msg.dictionary.get('BatPercent')
-                        if battery_percent is not None:
-                            serial = camera.serial_number
-                            warning_low = config.get('BatteryWarningLow', 25)
-                            warning_critical = config.get('BatteryWarningCritical', 10)
-
-                            with battery_warning_lock:
-                                last_warned = battery_warning_state.get(serial)
-
-                                # Check critical threshold (10%)
-                                if battery_percent <= warning_critical and last_warned != 'critical':
-                                    webhook_manager.send_battery_warning(
-                                        camera.friendly_name, camera.hostname, serial,
-                                        battery_percent, is_critical=True
-                                    )
-                                    battery_warning_state[serial] = 'critical'
-
-                                # Check low threshold (25%) - only if not already critical
-                                elif battery_percent <= warning_low and last_warned is None:
-                                    webhook_manager.send_battery_warning(
-                                        camera.friendly_name, camera.hostname, serial,
-                                        battery_percent, is_critical=False
-                                    )
-                                    battery_warning_state[serial] = 'low'
-
-                                # Reset warning state if battery recovers above low threshold
-                                elif battery_percent > warning_low and last_warned is not None:
-                                    s_print(f"[BATTERY] {camera.friendly_name} recovered to {battery_percent}% - resetting warnings")
-                                    battery_warning_state[serial] = None
+                    # Only the fields that changed since the last status
+                    delta = {k: v for k, v in msg.dictionary.items()
+                             if k not in ('ID', 'Type') and previous_status.get(k) != v}
+                    if delta:
+                        event_bus.publish('status', serial_number=camera.serial_number, changes=delta)
+                    quality_controller.on_status(camera, msg)
+
+                    # Battery, temperature and signal warnings
+                    alert_rules.on_status(camera, msg)
+                    battery_forecaster.record(camera.serial_number, msg)
+                    connectivity_thread.note_traffic(camera.serial_number)
                 elif (msg['Type'] == "alert"):
                     camera = Camera.from_db_ip(self.ip)
                     alert_type = msg['AlertType']
+                    if camera is not None:
+                        alert_rules.seen(camera)
+                        connectivity_thread.note_traffic(camera.serial_number)
+                        if alert_type == "pirMotionAlert":
+                            event_bus.publish('motion_start', serial_number=camera.serial_number, friendly_name=camera.friendly_name)
+                        elif alert_type == "motionTimeoutAlert":
+                            event_bus.publish('motion_stop', serial_number=camera.serial_number, friendly_name=camera.friendly_name)
                     s_print(f"<[{self.ip}][{msg['ID']}] {msg['AlertType']}")
 
                     # For pirMotionAlert: ACK immediately, then monitor port and record
@@ -293,6 +374,7 @@ class ConnectionThread(threading.Thread):
                        ack['ID'] = msg['ID']
                        s_print(f">[{self.ip}][{msg['ID']}] Ack (immediate)")
                        self.connection.send(ack)
+                       alert_ack_seconds.observe(time.monotonic() - received_at, alert_type=alert_type)
 
                        # Spawn background thread to monitor port and record
                        filename = f"{RECORDING_BASE_PATH}arlo-{camera.serial_number}-{timestr}.mkv"
@@ -301,7 +383,7 @@ class ConnectionThread(threading.Thread):
 
                        monitor_thread = threading.Thread(
                            target=monitor_and_record,
-                           args=(self.ip, rtsp_url, filename, camera.serial_number, zones, webhook_manager, camera.friendly_name, camera.hostname),
+                           args=(self.ip, rtsp_url, filename, camera.serial_number, zones, webhook_manager, camera.friendly_name, camera.hostname, received_at),
                            daemon=True
                        )
                        monitor_thread.start()
@@ -330,6 +412,8 @@ class ConnectionThread(threading.Thread):
                 ack['ID'] = msg['ID']
                 s_print(f">[{self.ip}][{msg['ID']}] Ack")
                 self.connection.send(ack)
+                if msg['Type'] == "alert":
+                    alert_ack_seconds.observe(time.monotonic() - received_at, alert_type=msg['AlertType'])
                 self.connection.close()
                 break
 
@@ -341,7 +425,7 @@ class ServerThread(threading.Thread):
         threads = []
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            server_address = ('', 4000)
+            server_address = (CAMERA_LISTEN_ADDRESS, 4000)
             sock.bind(server_address)
 
             sock.listen(12)
@@ -361,9 +445,27 @@ class ServerThread(threading.Thread):
 
 
 server_thread = ServerThread()
-connectivity_thread = ConnectivityChecker()
+server_thread.daemon = True
+connectivity_thread = ConnectivityChecker(
+    netlink=config.get('ConnectivityNetlinkEvents', True),
+    interval=config.get('ConnectivityCheckInterval', 300),
+    tick=config.get('ConnectivityTick', 60)
+)
 connectivity_thread.start()
+if config.get('DhcpLeaseFile'):
+    lease_index.start(config['DhcpLeaseFile'])
+webhook_manager.start()
+alert_rules.start()
 server_thread.start()
-flask_thread = api.api.get_thread()
-server_thread.join()
+flask_thread = api.api.get_thread(config)
+flask_thread.start()
+
+# systemd stops us with SIGTERM - let in-flight API requests drain first
+shutdown_event = threading.Event()
+signal.signal(signal.SIGTERM, lambda signum, frame: shutdown_event.set())
+signal.signal(signal.SIGINT, lambda signum, frame: shutdown_event.set())
+shutdown_event.wait()
+
+s_print("[SERVER] Shutting down - draining API requests")
+flask_thread.stop()
 flask_thread.join()
@@ -0,0 +1,5 @@
+"""Virtual Arlo cameras for load and latency testing without hardware.
+
+Run with `python -m simulator --help` from src/arlo-cam-api.
+"""
+from simulator.camera import VirtualCamera, SimulatorStats
@@ -0,0 +1,79 @@
+"""Run N virtual Arlo cameras against a base station.
+
+Each camera gets its own address (--ip-prefix plus --first, --first+1, ...;
+on Linux all of 127.0.0.0/8 is loopback, so the defaults need no setup),
+registers from it, listens for commands on its own port 4000 and sends
+status and motion traffic until --duration runs out or Ctrl-C. Set
+CameraListenAddress in config.yaml (e.g. 127.0.0.1) so the base station
+doesn't hold port 4000 on the cameras' addresses too.
+
+Usage: python -m simulator [--cameras N] [--base HOST] [--ip-prefix P]
+                           [--status-interval S] [--motion-interval S]
+                           [--wake-delay S] [--loss P] [--rtsp] [--duration S]
+"""
+import argparse
+import random
+import sys
+import time
+
+from simulator.camera import SimulatorStats, VirtualCamera
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--cameras', type=int, default=10, help='number of virtual cameras')
+    parser.add_argument('--base', default='127.0.0.1', help='base station address')
+    parser.add_argument('--base-port', type=int, default=4000)
+    parser.add_argument('--ip-prefix', default='127.0.1.', help='camera addresses are this plus a number')
+    parser.add_argument('--first', type=int, default=1, help='number of the first camera address')
+    parser.add_argument('--serial-prefix', default='SIM')
+    parser.add_argument('--model', default='VMC4030P')
+    parser.add_argument('--status-interval', type=float, default=60, help='seconds between status messages')
+    parser.add_argument('--motion-interval', type=float, default=120,
+                        help='mean seconds between motion alerts (0 for none)')
+    parser.add_argument('--motion-duration', type=float, default=10, help='seconds before motionTimeoutAlert')
+    parser.add_argument('--wake-delay', type=float, default=0, help='seconds a sleeping camera takes to answer')
+    parser.add_argument('--awake-for', type=float, default=10, help='idle seconds before a camera sleeps')
+    parser.add_argument('--loss', type=float, default=0, help='probability of dropping a message or ack')
+    parser.add_argument('--rtsp', action='store_true', help='serve a GStreamer test stream while recording')
+    parser.add_argument('--rtsp-port', type=int, default=554)
+    parser.add_argument('--duration', type=float, default=0, help='seconds to run (0 until Ctrl-C)')
+    parser.add_argument('--seed', type=int, help='random seed, for repeatable runs')
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    rtsp = None
+    if args.rtsp:
+        try:
+            from simulator.rtsp import RtspSource
+        except (ImportError, ValueError) as e:
+            sys.exit(f"--rtsp needs PyGObject and gst-rtsp-server: {e}")
+        rtsp = RtspSource(args.rtsp_port)
+
+    stats = SimulatorStats()
+    cameras = [VirtualCamera(i, f"{args.ip_prefix}{args.first + i}", args.base, stats,
+                             serial_prefix=args.serial_prefix, model=args.model, base_port=args.base_port,
+                             status_interval=args.status_interval, motion_interval=args.motion_interval,
+                             motion_duration=args.motion_duration, wake_delay=args.wake_delay,
+                             awake_for=args.awake_for, loss=args.loss, rtsp=rtsp)
+               for i in range(args.cameras)]
+    for camera in cameras:
+        camera.start()
+    print(f"{len(cameras)} cameras {cameras[0].ip}..{cameras[-1].ip} -> {args.base}:{args.base_port}")
+
+    started = time.time()
+    try:
+        while not args.duration or time.time() - started < args.duration:
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    for camera in cameras:
+        camera.stop()
+    print(f"\nafter {time.time() - started:.0f}s:")
+    print(stats.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+import collections
+import copy
+import random
+import socket
+import threading
+import time
+
+import arlo.messages
+from arlo.messages import Message
+from arlo.socket import ArloSocket
+
+# How long a virtual camera waits for the base station to ack a message
+ACK_TIMEOUT = 10  # seconds
+
+
+class SimulatorStats:
+    """Counters and base station ack latencies across all virtual cameras"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.latencies = collections.defaultdict(list)  # message type -> seconds
+
+    def inc(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def record(self, kind, seconds):
+        with self.lock:
+            self.latencies[kind].append(seconds)
+
+    def summary(self):
+        """
+        Returns:
+            str: One line per counter and per acked message type (p50/p95/p99/max)
+        """
+        with self.lock:
+            lines = [f"{name}: {count}" for name, count in sorted(self.counts.items())]
+            for kind, samples in sorted(self.latencies.items()):
+                samples = sorted(samples)
+
+                def percentile(p):
+                    return samples[min(len(samples) - 1, int(p / 100 * len(samples)))] * 1000
+
+                lines.append(f"{kind} ack: n={len(samples)} p50={percentile(50):.1f}ms p95={percentile(95):.1f}ms "
+                             f"p99={percentile(99):.1f}ms max={samples[-1] * 1000:.1f}ms")
+            return '\n'.join(lines)
+
+
+class VirtualCamera:
+    """One simulated VMC4030-style camera
+
+    The camera registers with the base station's port 4000 from its own
+    address, then sends status messages every `status_interval` seconds
+    and motion alerts at random (on average every `motion_interval`
+    seconds), each followed by a motionTimeoutAlert. Commands from the base
+    station (registerSet, statusRequest, ...) arrive on the camera's own
+    port 4000 listener and are acked.
+
+    A camera idle for `awake_for` seconds falls asleep; the next command
+    then waits `wake_delay` seconds before it is answered. With `loss`,
+    that fraction of messages and acks is dropped (the connection is
+    closed without sending).
+    """
+
+    def __init__(self, index, ip, base, stats, serial_prefix='SIM', model='VMC4030P', base_port=4000,
+                 status_interval=300, motion_interval=0, motion_duration=10,
+                 wake_delay=0, awake_for=10, loss=0.0, rtsp=None):
+        """
+        Args:
+            index: Camera number, used in the serial
+            ip: Address the camera sends from and listens on (e.g. 127.0.1.1)
+            base: Base station address
+            stats: Shared SimulatorStats
+            rtsp: RtspSource to stream from while "recording", or None
+        """
+        self.ip = ip
+        self.base = base
+        self.base_port = base_port
+        self.stats = stats
+        self.serial_number = f"{serial_prefix}{index:05d}"
+        self.model = model
+        self.status_interval = status_interval
+        self.motion_interval = motion_interval
+        self.motion_duration = motion_duration
+        self.wake_delay = wake_delay
+        self.awake_for = awake_for
+        self.loss = loss
+        self.rtsp = rtsp
+
+        self.id = 0
+        self.battery = random.randint(60, 100)
+        self.wifi_connections = 1
+        self.awake_until = 0
+        self.stop_event = threading.Event()
+        self.listener = None
+
+    def start(self):
+        # Listen first: the base station answers a registration with a registerSet
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.ip, 4000))
+        self.listener.listen(4)
+        threading.Thread(target=self._listen, name=f'sim-{self.serial_number}-listen', daemon=True).start()
+        threading.Thread(target=self._run, name=f'sim-{self.serial_number}', daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.listener is not None:
+            self.listener.close()
+        if self.rtsp is not None:
+            self.rtsp.stop(self.ip)
+
+    def _dropped(self):
+        return self.loss > 0 and random.random() < self.loss
+
+    def _wake(self):
+        self.awake_until = time.time() + self.awake_for
+
+    def send(self, template, **fields):
+        """
+        Send a message to the base station and wait for its ack
+
+        Returns:
+            bool: True if the base station acked it
+        """
+        message = Message(copy.deepcopy(template))
+        self.id += 1
+        message['ID'] = self.id
+        for key, value in fields.items():
+            message[key] = value
+        kind = message['AlertType'] if message['Type'] == 'alert' else message['Type']
+        self._wake()
+        if self._dropped():
+            self.stats.inc('dropped_to_base')
+            return False
+
+        started = time.monotonic()
+        try:
+            with socket.create_connection((self.base, self.base_port), timeout=ACK_TIMEOUT,
+                                          source_address=(self.ip, 0)) as sock:
+                arlo_sock = ArloSocket(sock)
+                arlo_sock.send(message)
+                ack = arlo_sock.receive()
+        except (OSError, ValueError, RuntimeError) as e:
+            self.stats.inc(f'{kind}_failed')
+            print(f"[{self.serial_number}] {kind} failed: {e}")
+            return False
+        if ack is None or ack['ID'] != message['ID']:
+            self.stats.inc(f'{kind}_not_acked')
+            return False
+        self.stats.record(kind, time.monotonic() - started)
+        self.stats.inc(f'{kind}_sent')
+        return True
+
+    def send_registration(self):
+        return self.send(arlo.messages.REGISTRATION, SystemSerialNumber=self.serial_number,
+                         SystemModelNumber=self.model, UpdateSystemModelNumber=self.model,
+                         BatPercent=self.battery)
+
+    def send_status(self):
+        # Drain a little and wander the readings so status deltas aren't empty
+        if random.random() < 0.3:
+            self.battery = max(0, self.battery - 1)
+        if random.random() < 0.05:
+            self.wifi_connections += 1
+        return self.send(arlo.messages.STATUS, SystemSerialNumber=self.serial_number,
+                         UpdateSystemModelNumber=self.model, BatPercent=self.battery,
+                         Temperature=random.randint(15, 30),
+                         SignalStrengthIndicator=random.randint(2, 5),
+                         WifiConnectionCount=self.wifi_connections)
+
+    def motion(self):
+        """A motion event: alert, stream for motion_duration, then the timeout alert"""
+        if self.rtsp is not None:
+            self.rtsp.start(self.ip)
+        self.send(arlo.messages.ALERT)
+        self.stop_event.wait(self.motion_duration)
+        if self.rtsp is not None:
+            self.rtsp.stop(self.ip)
+        self.send(arlo.messages.ALERT_TIMEOUT, StreamDuration=int(self.motion_duration))
+
+    def _run(self):
+        # Keep trying until the base station knows us
+        delay = 1
+        while not self.stop_event.is_set() and not self.send_registration():
+            self.stop_event.wait(delay)
+            delay = min(delay * 2, 30)
+
+        now = time.time()
+        # Spread the cameras' status messages over the interval
+        next_status = now + random.uniform(0, self.status_interval)
+        next_motion = now + random.expovariate(1 / self.motion_interval) if self.motion_interval else None
+        while not self.stop_event.is_set():
+            now = time.time()
+            if now >= next_status:
+                self.send_status()
+                next_status = now + self.status_interval
+            if next_motion is not None and now >= next_motion:
+                self.motion()
+                next_motion = time.time() + random.expovariate(1 / self.motion_interval)
+            wake_at = min(t for t in (next_status, next_motion) if t is not None)
+            self.stop_event.wait(max(0, wake_at - time.time()))
+
+    def _listen(self):
+        while not self.stop_event.is_set():
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            with connection:
+                self._handle(connection)
+
+    def _handle(self, connection):
+        if time.time() > self.awake_until and self.wake_delay:
+            # Asleep: the radio takes a while to notice it is being called
+            self.stats.inc('woken')
+            time.sleep(self.wake_delay)
+        self._wake()
+        try:
+            connection.settimeout(ACK_TIMEOUT)
+            arlo_sock = ArloSocket(connection)
+            message = arlo_sock.receive()
+            if message is None:
+                return
+            self.stats.inc(f"command_{message['Type']}")
+            if self._dropped():
+                self.stats.inc('dropped_to_camera')
+                return
+            response = Message(copy.deepcopy(arlo.messages.RESPONSE))
+            response['ID'] = message['ID']
+            arlo_sock.send(response)
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"[{self.serial_number}] command failed: {e}")
+            return
+
+        if message['Type'] == 'statusRequest':
+            threading.Thread(target=self.send_status, daemon=True).start()
+        elif message['Type'] == 'registerSet' and self.rtsp is not None:
+            stream = message['SetValues'].get('UserStreamActive') if 'SetValues' in message else None
+            if stream == 1:
+                self.rtsp.start(self.ip)
+            elif stream == 0:
+                self.rtsp.stop(self.ip)
@@ -0,0 +1,68 @@
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstRtspServer', '1.0')
+from gi.repository import Gst, GstRtspServer, GLib
+
+# H.264 test pattern at roughly what a camera sends on its default quality
+TEST_PIPELINE = (
+    "( videotestsrc is-live=true pattern=ball "
+    "! video/x-raw,width=1280,height=720,framerate=24/1 "
+    "! clockoverlay "
+    "! x264enc tune=zerolatency speed-preset=ultrafast bitrate=1000 key-int-max=48 "
+    "! rtph264pay name=pay0 pt=96 )"
+)
+
+
+class RtspSource:
+    """rtsp://<camera ip>:<port>/live from a GStreamer test source
+
+    Like a real camera, a virtual camera's RTSP port is only open while it
+    is streaming (after a motion alert or UserStreamActive). Needs
+    gst-rtsp-server (gir1.2-gst-rtsp-server-1.0) and, for port 554, root
+    or CAP_NET_BIND_SERVICE.
+    """
+
+    def __init__(self, port=554):
+        Gst.init(None)
+        self.port = port
+        self.lock = threading.Lock()
+        self.servers = {}  # ip -> GLib source id while streaming
+        self.loop = GLib.MainLoop()
+        threading.Thread(target=self.loop.run, name='sim-rtsp', daemon=True).start()
+
+    def start(self, ip):
+        """Open the camera's RTSP port"""
+        with self.lock:
+            if ip in self.servers:
+                return
+            self.servers[ip] = None
+        GLib.idle_add(self._attach, ip)
+
+    def stop(self, ip):
+        """Close the camera's RTSP port (sessions already playing carry on)"""
+        with self.lock:
+            if ip not in self.servers:
+                return
+        GLib.idle_add(self._detach, ip)
+
+    def _attach(self, ip):
+        server = GstRtspServer.RTSPServer()
+        server.set_address(ip)
+        server.set_service(str(self.port))
+        factory = GstRtspServer.RTSPMediaFactory()
+        factory.set_launch(TEST_PIPELINE)
+        factory.set_shared(True)
+        server.get_mount_points().add_factory('/live', factory)
+        source_id = server.attach(None)
+        with self.lock:
+            self.servers[ip] = source_id
+        return False
+
+    def _detach(self, ip):
+        with self.lock:
+            source_id = self.servers.pop(ip, None)
+        if source_id:
+            GLib.source_remove(source_id)
+        return False
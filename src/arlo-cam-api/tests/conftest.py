@@ -0,0 +1,29 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def camera_db(tmp_path, monkeypatch):
+    """Run in a temporary directory whose arlo.db holds one registered camera"""
+    monkeypatch.chdir(tmp_path)
+    with sqlite3.connect('arlo.db') as conn:
+        conn.execute("CREATE TABLE camera (ip text, serialnumber text, hostname text, status text, register_set text, "
+                     "friendlyname text, last_seen real, mac_address text, connected integer, armed integer)")
+        conn.execute("CREATE UNIQUE INDEX idx_camera_serialnumber ON camera (serialnumber)")
+        conn.execute("INSERT INTO camera VALUES ('172.14.0.100', 'SER1', 'VMC4030P-SER1', "
+                     "'{\"Type\":\"status\",\"BatPercent\":50}', "
+                     "'{\"SystemSerialNumber\":\"SER1\",\"SystemModelNumber\":\"VMC4030P\"}', "
+                     "'Front', julianday('now'), 'aa:bb:cc:dd:ee:01', 1, 1)")
+    return tmp_path / 'arlo.db'
+
+
+@pytest.fixture
+def client(camera_db):
+    import api.api
+    api.api.app.config['TESTING'] = True
+    return api.api.app.test_client()
@@ -0,0 +1,91 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from helpers.alert_rules import AlertRuleEngine, LevelRule
+
+
+def make_camera(registration=None):
+    return SimpleNamespace(serial_number="SER1", friendly_name="Front", hostname=None,
+                           registration=SimpleNamespace(dictionary=registration or {}))
+
+
+def status(**fields):
+    return SimpleNamespace(dictionary=fields)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    sent = []
+    config = {"BatteryWarningEnabled": True, "TemperatureWarningEnabled": True, "AlertRuleCooldown": 3600}
+    engine = AlertRuleEngine(config, lambda *args: sent.append(args), db_path=str(tmp_path / "arlo.db"))
+    engine.sent = sent
+    return engine
+
+
+def test_level_rule_hysteresis():
+    rule = LevelRule('battery', 'BatPercent', [('low', 25, 'high'), ('critical', 10, 'urgent')], hysteresis=2)
+    assert rule.evaluate(30, -1) == -1
+    assert rule.evaluate(25, -1) == 0
+    assert rule.evaluate(26, 0) == 0  # not cleared by the hysteresis yet
+    assert rule.evaluate(28, 0) == -1
+    assert rule.evaluate(11, 1) == 1
+    assert rule.evaluate(13, 1) == 0
+
+
+def test_above_rule_binds_registration_thresholds():
+    rule = LevelRule('temp', 'Temperature', [('hot', ('ThermalShutdownMaxTemp', -5), 'high')], direction='above')
+    assert rule.bind({}) is None
+    bound = rule.bind({"ThermalShutdownMaxTemp": 60})
+    assert bound.levels == [('hot', 55, 'high')]
+    assert bound.evaluate(54, -1) == -1
+    assert bound.evaluate(55, -1) == 0
+
+
+def test_battery_bouncing_around_critical_alerts_once(engine):
+    camera = make_camera()
+    for percent in (24, 10, 11, 10, 11, 10):
+        engine.on_status(camera, status(BatPercent=percent))
+    assert [args[1] for args in engine.sent] == ["Arlo Battery LOW", "Arlo Battery CRITICAL"]
+
+
+def test_recovery_then_relapse_within_cooldown_is_not_renotified(engine, caplog):
+    caplog.set_level(logging.INFO)
+    camera = make_camera()
+    engine.on_status(camera, status(BatPercent=20))
+    engine.on_status(camera, status(BatPercent=50))
+    engine.on_status(camera, status(BatPercent=20))
+    assert len(engine.sent) == 1
+    assert "within cooldown" in caplog.text
+
+
+def test_improvement_is_logged_as_improvement(engine, caplog):
+    caplog.set_level(logging.INFO)
+    camera = make_camera()
+    engine.on_status(camera, status(BatPercent=5))
+    caplog.clear()
+    engine.on_status(camera, status(BatPercent=20))
+    assert "improved to low" in caplog.text
+    assert "within cooldown" not in caplog.text
+    assert len(engine.sent) == 1
+
+
+def test_state_survives_restart(engine, tmp_path):
+    camera = make_camera()
+    engine.on_status(camera, status(BatPercent=20))
+    sent = []
+    restarted = AlertRuleEngine({"BatteryWarningEnabled": True}, lambda *args: sent.append(args),
+                                db_path=str(tmp_path / "arlo.db"))
+    restarted.on_status(camera, status(BatPercent=20))
+    assert sent == []
+    assert restarted.get_state()["cameras"]["SER1"]["battery"]["level"] == 0
+
+
+def test_temperature_rule_needs_registration_limits(engine):
+    engine.on_status(make_camera(), status(Temperature=80))
+    assert engine.sent == []
+    hot = make_camera({"ThermalShutdownMaxTemp": 60, "ThermalShutdownMinTemp": -10})
+    engine.on_registration(hot)
+    engine.on_status(hot, status(Temperature=56))
+    assert [args[0] for args in engine.sent] == ["ntfy_temperature_high"]
@@ -0,0 +1,108 @@
+import pytest
+
+
+def test_metrics_scrape(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'arlo_active_streams' in body
+
+
+def test_bulk_rejects_bad_bodies(client):
+    for route in ('/cameras/arm', '/cameras/disarm', '/cameras/statusrequest'):
+        assert client.post(route, json=[1]).status_code == 400
+        assert client.post(route, json={"serials": "SER1"}).status_code == 400
+        assert client.post(route, json={"deadline": "x"}).status_code == 400
+        assert client.post(route, json={"deadline": 0}).status_code == 400
+
+
+def test_bulk_reports_unknown_cameras(client):
+    response = client.post('/cameras/arm', json={"serials": ["NOPE"], "deadline": 1})
+    assert response.status_code == 200
+    assert response.get_json()["cameras"]["NOPE"] == {"result": False, "error": "Unknown camera"}
+
+
+@pytest.fixture
+def acking_camera(monkeypatch):
+    """Camera commands are acked without touching the network"""
+    from arlo.camera import Camera
+    monkeypatch.setattr(Camera, 'arm', lambda self, args: True)
+    monkeypatch.setattr(Camera, 'status_request', lambda self: True)
+
+
+class FakeStream:
+    lease_deadline = 1234.5
+
+    def is_active(self):
+        return True
+
+    def is_exportable(self):
+        return True
+
+    def renew(self, duration):
+        return True
+
+    def export_range(self, start, end):
+        return '/tmp/arlo-SER1-20260101-000000.mkv'
+
+
+def test_read_only_routes(client):
+    for route in ('/cameras/latency', '/camera/SER1/latency', '/quality', '/camera/SER1/quality',
+                  '/notifications/policy', '/alerts/rules', '/battery/forecast', '/camera/SER1/stream/status'):
+        response = client.get(route)
+        assert response.status_code == 200, route
+        assert response.is_json, route
+    for route in ('/camera/NOPE/latency', '/camera/NOPE/quality', '/camera/NOPE/battery/forecast',
+                  '/camera/SER1/battery/forecast', '/commands/nope', '/admin/profile', '/camera/SER1/latest.jpg'):
+        assert client.get(route).status_code == 404, route
+
+
+def test_events_stream_starts_with_cursor(client):
+    response = client.get('/events', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    first = next(response.iter_encoded())
+    assert first.startswith(b"retry: 3000\n: connected at ")
+    response.close()
+
+
+def test_latest_jpg_from_cache(client):
+    from helpers.snapshot_cache import snapshot_cache
+    snapshot_cache.put('SER1', b'\xff\xd8jpeg', 'snapshot')
+    response = client.get('/camera/SER1/latest.jpg')
+    assert response.status_code == 200
+    assert response.data == b'\xff\xd8jpeg'
+    assert response.headers['X-Snapshot-Source'] == 'snapshot'
+    again = client.get('/camera/SER1/latest.jpg', headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_bulk_commands(client, acking_camera):
+    for route in ('/cameras/arm', '/cameras/disarm', '/cameras/statusrequest'):
+        response = client.post(route, json={"deadline": 5})
+        assert response.status_code == 200, route
+        assert response.get_json() == {"result": True, "cameras": {"SER1": {"result": True}}}, route
+
+
+def test_async_command_and_its_status(client, acking_camera):
+    from helpers.command_queue import command_queue
+    response = client.post('/camera/SER1/statusrequest?async=1', json={})
+    assert response.status_code == 202
+    command_id = response.get_json()["command_id"]
+    command_queue.wait(command_id, 5)
+    status = client.get(response.headers['Location'])
+    assert status.status_code == 200
+    assert status.get_json()["status"] == "succeeded"
+
+
+def test_stream_renew_and_export(client, monkeypatch):
+    import api.api
+    for route in ('/camera/SER1/stream/renew', '/camera/SER1/stream/export'):
+        assert client.post(route).status_code == 400, route
+    monkeypatch.setitem(api.api.active_streams, 'SER1', FakeStream())
+    renewed = client.post('/camera/SER1/stream/renew')
+    assert renewed.get_json() == {"result": True, "expires": 1234.5}
+    exported = client.post('/camera/SER1/stream/export', json={"start": 1, "end": 2})
+    assert exported.get_json() == {"result": True, "filename": "arlo-SER1-20260101-000000.mkv"}
+    assert client.get('/camera/SER1/stream/status').get_json()["active"] is True
+    assert client.get('/metrics').get_data(as_text=True).count('arlo_active_streams 1') == 1
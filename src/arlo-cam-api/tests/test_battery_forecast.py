@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import pytest
+
+from helpers.battery_forecast import BatteryForecaster, fit_drain
+
+
+def discharge(serial, start, hours, percent, rate, charging=0, wifi=3):
+    """Hourly rows draining `rate` %/hour from `percent`"""
+    return [(serial, start + h * 3600, percent - rate * h, 4.0, 3600.0, charging, wifi) for h in range(hours)]
+
+
+def test_fits_each_camera_separately():
+    rows = discharge("A", 0, 5, 90, 2.0) + discharge("B", 0, 5, 60, 0.5)
+    result = fit_drain(rows, ["A", "B"])
+    assert result["A"]["drain_rate"] == pytest.approx(2.0)
+    assert result["B"]["drain_rate"] == pytest.approx(0.5)
+    assert result["A"]["percent"] == 82
+    assert result["B"]["time"] == 4 * 3600
+    assert result["A"]["samples"] == 5
+    assert result["A"]["expected_rate"] == 1.0
+
+
+def test_latest_row_wins_for_single_row_camera():
+    rows = discharge("A", 0, 4, 90, 1.0) + [("B", 100, 40, None, None, 0, None)]
+    result = fit_drain(rows, ["A", "B"])
+    assert result["B"]["percent"] == 40
+    assert result["B"]["volt"] is None
+    assert result["B"]["drain_rate"] is None
+    assert result["A"]["time"] == 3 * 3600
+
+
+def test_only_the_segment_since_the_last_charge_is_fitted():
+    rows = discharge("A", 0, 4, 50, 5.0) + discharge("A", 4 * 3600, 1, 100, 0, charging=1) \
+        + discharge("A", 5 * 3600, 4, 100, 1.0)
+    result = fit_drain(rows, ["A"])
+    assert result["A"]["samples"] == 4
+    assert result["A"]["drain_rate"] == pytest.approx(1.0)
+    assert result["A"]["percent"] == 97
+
+
+def test_too_little_data_is_not_fitted():
+    result = fit_drain(discharge("A", 0, 2, 90, 1.0), ["A"])
+    assert result["A"]["drain_rate"] is None
+
+
+def test_wifi_reconnects_counted_over_the_segment():
+    rows = [("A", h * 3600, 90 - h, 4.0, 3600.0, 0, 3 + 2 * h) for h in range(4)]
+    assert fit_drain(rows, ["A"])["A"]["wifi_reconnects"] == 6
+
+
+def test_forecaster_flags_abnormal_drain(tmp_path, monkeypatch):
+    forecaster = BatteryForecaster({}, db_path=str(tmp_path / "arlo.db"))
+    now = [1_000_000.0]
+    monkeypatch.setattr("helpers.battery_forecast.time.time", lambda: now[0])
+    for h in range(5):
+        for serial, rate in (("A", 1.0), ("B", 10.0)):
+            forecaster.record(serial, SimpleNamespace(dictionary={
+                "BatPercent": 90 - rate * h, "SecsPerPercentAvg": 3600, "ChargingState": "Off"}))
+        now[0] += 3600
+    forecast = forecaster.get_forecast()
+    assert forecast["cameras"]["A"]["abnormal"] is False
+    assert forecast["cameras"]["B"]["abnormal"] is True
+    assert forecaster.get_forecast("A")["hours_left"] == pytest.approx(86, abs=1.5)
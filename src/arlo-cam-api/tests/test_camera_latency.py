@@ -0,0 +1,79 @@
+import pytest
+
+import helpers.camera_latency as camera_latency_module
+from helpers.camera_latency import CameraLatency
+
+
+@pytest.fixture
+def latency():
+    return CameraLatency()
+
+
+def test_default_timeout_until_first_answer(latency):
+    assert latency.timeout("SER1") == camera_latency_module.DEFAULT_TIMEOUT
+    assert latency.get_state("SER1") is not None
+    assert latency.get_state("SER1")["srtt"] is None
+
+
+def test_srtt_and_rttvar_follow_rfc6298(latency):
+    latency.success("SER1", 0.2)
+    state = latency.get_state("SER1")
+    assert state["srtt"] == pytest.approx(0.2)
+    assert state["rttvar"] == pytest.approx(0.1)
+
+    latency.success("SER1", 0.6)
+    state = latency.get_state("SER1")
+    # RTTVAR uses the SRTT from before this sample
+    assert state["rttvar"] == pytest.approx(0.75 * 0.1 + 0.25 * 0.4)
+    assert state["srtt"] == pytest.approx(0.875 * 0.2 + 0.125 * 0.6)
+    assert state["timeout"] == pytest.approx(max(camera_latency_module.MIN_TIMEOUT, 0.25 + 4 * 0.175), abs=1e-3)
+
+
+def test_fast_camera_is_clamped_to_min_timeout_while_awake(latency):
+    for _ in range(5):
+        latency.success("SER1", 0.05)
+    assert latency.timeout("SER1") == camera_latency_module.MIN_TIMEOUT
+
+
+def test_sleeping_camera_gets_at_least_the_default(latency, monkeypatch):
+    latency.success("SER1", 0.05)
+    later = latency.cameras["SER1"]["last_success"] + camera_latency_module.AWAKE_WINDOW + 1
+    monkeypatch.setattr(camera_latency_module.time, "time", lambda: later)
+    assert latency.timeout("SER1") == camera_latency_module.DEFAULT_TIMEOUT
+
+
+def test_attempts_double_the_timeout_up_to_max(latency):
+    timeouts = [latency.timeout("SER1", attempt) for attempt in range(3)]
+    assert timeouts == [5.0, 10.0, 15.0]
+
+
+def test_timeouts_back_off_until_the_next_answer(latency):
+    for _ in range(5):
+        latency.success("SER1", 0.3)
+    base = latency.get_state("SER1")["timeout"]
+    latency.failure("SER1", "no_ack")
+    latency.failure("SER1", "connect")
+    assert latency.get_state("SER1")["timeout"] == pytest.approx(4 * base, abs=1e-3)
+    for _ in range(3):
+        latency.failure("SER1", "no_ack")
+    assert latency.get_state("SER1")["backoff"] == 8
+    # A nack is an answer, not a timeout
+    latency.failure("SER1", "nack")
+    assert latency.get_state("SER1")["failures"] == {"no_ack": 4, "connect": 1, "nack": 1}
+    latency.success("SER1", 0.3)
+    assert latency.get_state("SER1")["backoff"] == 1
+
+
+def test_retry_delay_has_bounded_jitter(latency):
+    for attempt in (1, 2, 3):
+        base = camera_latency_module.RETRY_BASE * 2 ** (attempt - 1)
+        delay = latency.retry_delay(attempt)
+        assert 0.5 * base <= delay <= 1.5 * base
+
+
+def test_percentiles(latency):
+    for n in range(1, 101):
+        latency.success("SER1", n / 1000)
+    state = latency.get_state("SER1")
+    assert (state["p50"], state["p90"], state["p99"]) == (0.051, 0.091, 0.1)
+    assert latency.timeouts()[("SER1",)] == pytest.approx(state["timeout"], abs=1e-3)
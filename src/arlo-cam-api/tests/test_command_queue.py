@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+
+import helpers.command_queue
+from helpers.command_queue import CommandQueue
+
+
+@pytest.fixture
+def queue():
+    queue = CommandQueue(workers=4)
+    yield queue
+    queue.executor.shutdown(wait=False)
+
+
+def run(queue, serial, job, key=None, name='arm'):
+    record, created = queue.submit(serial, name, job, key)
+    return queue.wait(record["id"], 5), created
+
+
+def test_acknowledged_command_succeeds(queue):
+    record, created = run(queue, "SER1", lambda: (200, {"result": True}))
+    assert created
+    assert record["status"] == "succeeded"
+    assert record["result"] == {"result": True}
+    assert record["finished"] is not None
+
+
+def test_unacknowledged_command_fails(queue):
+    record, _ = run(queue, "SER1", lambda: (200, {"result": False}))
+    assert record["status"] == "failed"
+    assert record["error"]
+    assert record["http_status"] == 200
+
+
+def test_error_status_and_exceptions_fail(queue):
+    record, _ = run(queue, "SER1", lambda: (404, {"error": "nope"}))
+    assert record["status"] == "failed"
+
+    def boom():
+        raise RuntimeError("socket closed")
+    record, _ = run(queue, "SER1", boom)
+    assert record["status"] == "failed"
+    assert record["error"] == "socket closed"
+    assert record["http_status"] is None
+
+
+def test_idempotency_key_returns_original_command(queue):
+    calls = []
+
+    def job():
+        calls.append(1)
+        return 200, {"result": True}
+    first, _ = run(queue, "SER1", job, key="abc")
+    again, created = queue.submit("SER1", "arm", job, "abc")
+    assert not created
+    assert again["id"] == first["id"]
+    # Keys are per camera and per command
+    other, created = queue.submit("SER2", "arm", job, "abc")
+    assert created and other["id"] != first["id"]
+    queue.wait(other["id"], 5)
+    assert len(calls) == 2
+
+
+def test_commands_for_one_camera_run_in_order(queue):
+    order = []
+    gate = threading.Event()
+
+    def job(n):
+        def run_job():
+            if n == 0:
+                gate.wait(5)
+            order.append(n)
+            return 200, {"result": True}
+        return run_job
+    ids = [queue.submit("SER1", "arm", job(n))[0]["id"] for n in range(3)]
+    gate.set()
+    for command_id in ids:
+        queue.wait(command_id, 5)
+    assert order == [0, 1, 2]
+
+
+def test_expired_commands_are_pruned_past_a_hung_one(queue, monkeypatch):
+    hung = threading.Event()
+    stuck, _ = queue.submit("SER1", "arm", lambda: (hung.wait(5), (200, {"result": True}))[1])
+    done, _ = run(queue, "SER2", lambda: (200, {"result": True}), key="k")
+
+    monkeypatch.setattr(helpers.command_queue, "COMMAND_RETENTION", 0)
+    queue.submit("SER3", "arm", lambda: (200, {"result": True}))
+    assert queue.get(done["id"]) is None
+    assert queue.idempotency_keys.get(("SER2", "arm", "k")) is None
+    assert queue.get(stuck["id"])["status"] == "running"
+    hung.set()
+
+
+def test_prune_stops_at_first_retained_command(queue, monkeypatch):
+    first, _ = run(queue, "SER1", lambda: (200, {"result": True}))
+    second, _ = run(queue, "SER1", lambda: (200, {"result": True}))
+    queue.finished.clear()
+    queue.finished.extend([(100.0, first["id"]), (200.0, second["id"])])
+    monkeypatch.setattr(helpers.command_queue.time, "time",
+                        lambda: 150.0 + helpers.command_queue.COMMAND_RETENTION)
+    with queue.lock:
+        queue._prune()
+    assert queue.get(first["id"]) is None
+    assert queue.get(second["id"]) is not None
+    assert len(queue.finished) == 1
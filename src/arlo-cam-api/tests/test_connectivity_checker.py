@@ -0,0 +1,98 @@
+import socket
+import sqlite3
+import struct
+
+import helpers.connectivity_checker as connectivity_checker
+from helpers.connectivity_checker import (ConnectivityChecker, NDMSG, NLMSG_HEADER, RTATTR, RTM_DELNEIGH,
+                                          RTM_NEWNEIGH, NDA_DST, NDA_LLADDR, NUD_FAILED,
+                                          parse_neighbour_messages, read_arp_table)
+
+NUD_REACHABLE = 0x02
+
+
+def test_read_arp_table_keeps_resolved_entries(tmp_path):
+    arp = tmp_path / "arp"
+    arp.write_text(
+        "IP address       HW type     Flags       HW address            Mask     Device\n"
+        "172.14.0.100     0x1         0x2         AA:BB:CC:DD:EE:01     *        wlan0\n"
+        "172.14.0.101     0x1         0x0         00:00:00:00:00:00     *        wlan0\n"
+        "172.14.0.102     0x1         0x6         aa:bb:cc:dd:ee:03     *        wlan0\n"
+        "truncated line\n")
+    assert read_arp_table(str(arp)) == {
+        "aa:bb:cc:dd:ee:01": {"ip": "172.14.0.100", "device": "wlan0", "reachable": True},
+        "aa:bb:cc:dd:ee:03": {"ip": "172.14.0.102", "device": "wlan0", "reachable": True},
+    }
+
+
+def test_read_arp_table_survives_a_missing_file(tmp_path):
+    assert read_arp_table(str(tmp_path / "missing")) == {}
+
+
+def attribute(kind, value):
+    attr = RTATTR.pack(RTATTR.size + len(value), kind) + value
+    return attr + b'\0' * (-len(attr) % 4)
+
+
+def neighbour_message(msg_type, ip, mac=None, state=NUD_REACHABLE, family=socket.AF_INET):
+    body = NDMSG.pack(family, 3, state, 0, 1) + attribute(NDA_DST, socket.inet_aton(ip) if family == socket.AF_INET
+                                                          else b'\0' * 16)
+    if mac is not None:
+        body += attribute(NDA_LLADDR, bytes.fromhex(mac.replace(':', '')))
+    return NLMSG_HEADER.pack(NLMSG_HEADER.size + len(body), msg_type, 0, 0, 0) + body
+
+
+def test_parse_neighbour_messages():
+    data = (neighbour_message(RTM_NEWNEIGH, "172.14.0.100", "aa:bb:cc:dd:ee:01")
+            + neighbour_message(RTM_NEWNEIGH, "172.14.0.101", "aa:bb:cc:dd:ee:02", state=NUD_FAILED)
+            + neighbour_message(RTM_DELNEIGH, "172.14.0.102", "aa:bb:cc:dd:ee:03")
+            + neighbour_message(RTM_NEWNEIGH, "fe80::1", "aa:bb:cc:dd:ee:04", family=socket.AF_INET6)
+            + neighbour_message(RTM_NEWNEIGH, "172.14.0.105"))
+    assert parse_neighbour_messages(data) == [
+        ("172.14.0.100", "aa:bb:cc:dd:ee:01", True),
+        ("172.14.0.101", "aa:bb:cc:dd:ee:02", False),
+        ("172.14.0.102", "aa:bb:cc:dd:ee:03", False),
+        ("172.14.0.105", None, True),
+    ]
+
+
+def test_parse_neighbour_messages_skips_other_types_and_truncation():
+    other = NLMSG_HEADER.pack(NLMSG_HEADER.size + 4, 16, 0, 0, 0) + b'\0' * 4
+    message = neighbour_message(RTM_NEWNEIGH, "172.14.0.100", "aa:bb:cc:dd:ee:01")
+    assert parse_neighbour_messages(other + message) == [("172.14.0.100", "aa:bb:cc:dd:ee:01", True)]
+    assert parse_neighbour_messages(message[:NLMSG_HEADER.size - 1]) == []
+    assert parse_neighbour_messages(struct.pack('=LHHLL', 0, RTM_NEWNEIGH, 0, 0, 0)) == []
+
+
+def connected(db):
+    with sqlite3.connect(db) as conn:
+        return conn.execute("SELECT connected FROM camera WHERE serialnumber = 'SER1'").fetchone()[0]
+
+
+def test_quiet_camera_missing_from_arp_goes_offline(camera_db, monkeypatch):
+    monkeypatch.setattr(connectivity_checker, "DB_PATH", str(camera_db))
+    reads = []
+    monkeypatch.setattr(connectivity_checker, "read_arp_table", lambda: reads.append(1) or {})
+    checker = ConnectivityChecker(netlink=False)
+    checker.check()
+    assert connected(camera_db) == 0
+    assert reads == [1]
+
+    # Traffic is proof enough - no ARP read
+    checker.note_traffic("SER1")
+    checker.check()
+    assert connected(camera_db) == 1
+    assert reads == [1]
+
+
+def test_neighbour_event_does_not_override_recent_traffic(camera_db, monkeypatch):
+    monkeypatch.setattr(connectivity_checker, "DB_PATH", str(camera_db))
+    checker = ConnectivityChecker(netlink=False)
+    checker.note_traffic("SER1")
+    checker.apply_neighbour("aa:bb:cc:dd:ee:01", 0)
+    assert connected(camera_db) == 1
+
+    checker.traffic.clear()
+    checker.apply_neighbour("aa:bb:cc:dd:ee:01", 0)
+    assert connected(camera_db) == 0
+    checker.apply_neighbour("aa:bb:cc:dd:ee:01", 1)
+    assert connected(camera_db) == 1
@@ -0,0 +1,81 @@
+import sqlite3
+
+from helpers.dhcp_leases import LeaseIndex, parse_leases
+
+
+def add_camera(db, serial, ip, hostname, mac):
+    with sqlite3.connect(db) as conn:
+        conn.execute("INSERT INTO camera (ip, serialnumber, hostname, mac_address) VALUES (?, ?, ?, ?)",
+                     (ip, serial, hostname, mac))
+
+
+def cameras(db):
+    with sqlite3.connect(db) as conn:
+        return {serial: (ip, mac) for serial, ip, mac in
+                conn.execute("SELECT serialnumber, ip, mac_address FROM camera")}
+
+
+def load(tmp_path, text):
+    lease_file = tmp_path / "dnsmasq.leases"
+    lease_file.write_text(text)
+    index = LeaseIndex()
+    index.lease_file = str(lease_file)
+    index.reload()
+    return index
+
+
+def test_parse_leases():
+    leases = parse_leases(
+        "1700000000 AA:BB:CC:DD:EE:01 172.14.0.100 VMC4030P-SER1 01:aa:bb:cc:dd:ee:01\n"
+        "0 aa:bb:cc:dd:ee:02 172.14.0.101 * *\n"
+        "duid 00:01:00:01:2c:aa\n"
+        "\n"
+        "garbage\n")
+    assert leases == {
+        "aa:bb:cc:dd:ee:01": {"ip": "172.14.0.100", "hostname": "VMC4030P-SER1", "expiry": 1700000000},
+        "aa:bb:cc:dd:ee:02": {"ip": "172.14.0.101", "hostname": None, "expiry": 0},
+    }
+
+
+def test_known_mac_follows_its_new_address(camera_db, tmp_path):
+    index = load(tmp_path, "0 aa:bb:cc:dd:ee:01 172.14.0.150 VMC4030P-SER1 *\n")
+    assert cameras(camera_db)["SER1"] == ("172.14.0.150", "aa:bb:cc:dd:ee:01")
+    assert index.serial_for_ip("172.14.0.150") == "SER1"
+    assert index.serial_for_ip("172.14.0.100") is None
+
+
+def test_camera_without_mac_is_matched_by_ip(camera_db, tmp_path):
+    add_camera(camera_db, "SER2", "172.14.0.101", "VMC4030P-SER2", None)
+    index = load(tmp_path, "0 aa:bb:cc:dd:ee:02 172.14.0.101 * *\n")
+    assert cameras(camera_db)["SER2"] == ("172.14.0.101", "aa:bb:cc:dd:ee:02")
+    assert index.serial_for_ip("172.14.0.101") == "SER2"
+
+
+def test_camera_without_mac_is_matched_by_hostname(camera_db, tmp_path):
+    add_camera(camera_db, "SER2", "UNKNOWN", "VMC4030P-SER2", None)
+    load(tmp_path, "0 aa:bb:cc:dd:ee:02 172.14.0.120 vmc4030p-ser2 *\n")
+    assert cameras(camera_db)["SER2"] == ("172.14.0.120", "aa:bb:cc:dd:ee:02")
+
+
+def test_stale_row_does_not_take_another_cameras_address(camera_db, tmp_path):
+    # SER2's lease expired and its old address went to SER1
+    add_camera(camera_db, "SER2", "172.14.0.150", "VMC4030P-SER2", "aa:bb:cc:dd:ee:02")
+    index = load(tmp_path, "0 aa:bb:cc:dd:ee:01 172.14.0.150 VMC4030P-SER1 *\n")
+    rows = cameras(camera_db)
+    assert rows["SER1"] == ("172.14.0.150", "aa:bb:cc:dd:ee:01")
+    assert rows["SER2"] == ("UNKNOWN", "aa:bb:cc:dd:ee:02")
+    assert index.serial_for_ip("172.14.0.150") == "SER1"
+
+
+def test_ip_of_unowned_mac_is_used_for_a_replaced_adapter(camera_db, tmp_path):
+    # SER1's recorded MAC has no lease; its address now belongs to a MAC no camera owns
+    load(tmp_path, "0 aa:bb:cc:dd:ee:09 172.14.0.100 * *\n")
+    assert cameras(camera_db)["SER1"] == ("172.14.0.100", "aa:bb:cc:dd:ee:09")
+
+
+def test_unchanged_leases_do_not_rewrite_rows(camera_db, tmp_path):
+    index = load(tmp_path, "0 aa:bb:cc:dd:ee:01 172.14.0.100 VMC4030P-SER1 *\n")
+    with sqlite3.connect(camera_db) as conn:
+        conn.execute("UPDATE camera SET ip = 'changed-behind-our-back'")
+    index.reload()
+    assert cameras(camera_db)["SER1"][0] == "changed-behind-our-back"
@@ -0,0 +1,52 @@
+from helpers.event_bus import EventBus, format_sse
+import helpers.event_bus
+
+
+def test_replays_events_after_cursor():
+    bus = EventBus()
+    for n in range(3):
+        bus.publish('status', n=n)
+    subscription = bus.subscribe(since=1)
+    assert [subscription.get(0)["data"]["n"] for _ in range(2)] == [1, 2]
+    assert subscription.get(0) is None
+
+
+def test_caught_up_cursor_gets_nothing():
+    bus = EventBus()
+    bus.publish('status')
+    subscription = bus.subscribe(since=1)
+    assert subscription.get(0) is None
+    bus.publish('status')
+    assert subscription.get(0)["id"] == 2
+
+
+def test_cursor_from_before_a_restart_resyncs():
+    bus = EventBus()
+    bus.publish('status')
+    subscription = bus.subscribe(since=40)
+    assert subscription.get(0)["type"] == "resync"
+
+
+def test_cursor_that_fell_off_history_resyncs(monkeypatch):
+    monkeypatch.setattr(helpers.event_bus, 'HISTORY_SIZE', 2)
+    bus = EventBus()
+    for _ in range(5):
+        bus.publish('status')
+    assert bus.subscribe(since=1).get(0)["type"] == "resync"
+    assert bus.subscribe(since=3).get(0)["id"] == 4
+
+
+def test_slow_subscriber_resyncs(monkeypatch):
+    monkeypatch.setattr(helpers.event_bus, 'SUBSCRIBER_QUEUE_SIZE', 2)
+    bus = EventBus()
+    subscription = bus.subscribe()
+    for _ in range(3):
+        bus.publish('status')
+    event = subscription.get(0)
+    assert event["type"] == "resync" and event["id"] == 3
+    assert subscription.get(0) is None
+
+
+def test_format_sse():
+    event = EventBus().publish('motion_start', serial_number='SER1')
+    assert format_sse(event).startswith("id: 1\nevent: motion_start\ndata: {")
@@ -0,0 +1,74 @@
+from helpers.hls_playlist import HlsPlaylist
+
+
+def test_window_slides_and_returns_evicted(tmp_path):
+    playlist = HlsPlaylist(str(tmp_path / "stream.m3u8"), window=3)
+    evicted = []
+    for n in range(5):
+        evicted += playlist.add_segment(f"seg{n}.ts", 2.0)
+    assert evicted == ["seg0.ts", "seg1.ts"]
+    assert [s["uri"] for s in playlist.segments] == ["seg2.ts", "seg3.ts", "seg4.ts"]
+    assert playlist.media_sequence == 2
+
+
+def test_discontinuity_sequence_bumps_when_tag_leaves_window(tmp_path):
+    playlist = HlsPlaylist(str(tmp_path / "stream.m3u8"), window=2)
+    playlist.mark_discontinuity()  # nothing before it yet - ignored
+    playlist.add_segment("a.ts", 2.0)
+    playlist.mark_discontinuity()
+    playlist.add_segment("b.ts", 2.0)
+    assert "#EXT-X-DISCONTINUITY\n#EXTINF:2.000,\nb.ts" in playlist.render()
+
+    playlist.add_segment("c.ts", 2.0)
+    assert playlist.discontinuity_sequence == 0
+    playlist.add_segment("d.ts", 2.0)
+    assert playlist.discontinuity_sequence == 1
+    assert "#EXT-X-DISCONTINUITY\n" not in playlist.render()
+
+
+def test_round_trip_through_file(tmp_path):
+    path = str(tmp_path / "stream.m3u8")
+    playlist = HlsPlaylist(path, window=4)
+    playlist.add_segment("ring000.ts?seq=0", 2.0, 1700000000.0, 1000)
+    playlist.mark_discontinuity()
+    playlist.add_segment("ring001.ts?seq=1", 1.5, 1700000002.0, 2000)
+    playlist.write()
+
+    loaded = HlsPlaylist.load(path, window=4)
+    assert loaded.segments == playlist.segments
+    assert loaded.render() == playlist.render()
+
+
+def test_byte_ranges_need_version_4(tmp_path):
+    playlist = HlsPlaylist(str(tmp_path / "stream.m3u8"))
+    playlist.add_segment("seg0.ts", 2.0)
+    assert "#EXT-X-VERSION:3" in playlist.render()
+    playlist.add_segment("ring000.ts?seq=1", 2.0, length=4096)
+    rendered = playlist.render()
+    assert "#EXT-X-VERSION:4" in rendered
+    assert "#EXT-X-BYTERANGE:4096@0\nring000.ts?seq=1" in rendered
+
+
+def test_dvr_window_range_selection(tmp_path):
+    playlist = HlsPlaylist(str(tmp_path / "stream.m3u8"), window=0)
+    for n in range(10):
+        playlist.add_segment(f"seg{n}.ts", 2.0, 1000.0 + 2 * n)
+    # window=0 keeps everything
+    assert len(playlist.segments) == 10
+    picked = playlist.segments_between(1005.0, 1009.0)
+    assert [s["uri"] for s in picked] == ["seg2.ts", "seg3.ts", "seg4.ts"]
+    assert len(playlist.segments_between()) == 10
+
+
+def test_segments_without_time_only_in_unbounded_range(tmp_path):
+    playlist = HlsPlaylist(str(tmp_path / "stream.m3u8"))
+    playlist.add_segment("seg0.ts", 2.0)
+    assert playlist.segments_between(0, None) == []
+    assert len(playlist.segments_between()) == 1
+
+
+def test_end_list(tmp_path):
+    playlist = HlsPlaylist(str(tmp_path / "stream.m3u8"))
+    playlist.add_segment("seg0.ts", 2.0)
+    playlist.end()
+    assert playlist.render().endswith("#EXT-X-ENDLIST\n")
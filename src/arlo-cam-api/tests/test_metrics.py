@@ -0,0 +1,56 @@
+import gc
+import threading
+
+from helpers.metrics import Registry
+
+
+def test_counter_sums_thread_shards_and_survives_thread_exit():
+    registry = Registry()
+    counter = registry.counter('test_total', 'Test counter', ['kind'])
+
+    def work():
+        for _ in range(1000):
+            counter.inc(kind='a')
+        counter.inc(5, kind='b')
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc(kind='a')
+    gc.collect()
+
+    text = registry.render()
+    assert 'test_total{kind="a"} 8001' in text
+    assert 'test_total{kind="b"} 40' in text
+    # Exited threads were folded into the retired totals
+    assert len(registry.shards) == 1
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    histogram = registry.histogram('test_seconds', 'Test histogram', buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{le="1"} 3' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 4' in lines
+    assert 'test_seconds_sum 3.65' in lines
+    assert 'test_seconds_count 4' in lines
+
+
+def test_gauge_set_and_callback():
+    registry = Registry()
+    registry.gauge('test_set', 'Set gauge', ['serial']).set(3, serial='SER1')
+    registry.gauge('test_cb', 'Callback gauge', ['serial'], callback=lambda: {('SER2',): 1.5})
+    text = registry.render()
+    assert '# TYPE test_set gauge' in text
+    assert 'test_set{serial="SER1"} 3' in text
+    assert 'test_cb{serial="SER2"} 1.5' in text
+
+
+def test_label_values_are_escaped():
+    registry = Registry()
+    registry.counter('test_total', 'Test', ['name']).inc(name='a "b"\\\n')
+    assert 'test_total{name="a \\"b\\"\\\\\\n"} 1' in registry.render()
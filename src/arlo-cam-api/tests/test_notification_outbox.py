@@ -0,0 +1,97 @@
+import sqlite3
+import time
+
+import pytest
+
+import helpers.notification_outbox
+from helpers.metrics import registry
+from helpers.notification_outbox import NotificationOutbox
+
+
+@pytest.fixture
+def outbox(tmp_path, monkeypatch):
+    # Keep the app's queue depth gauge registered once this test's outbox is gone
+    name = 'arlo_notification_queue_depth'
+    monkeypatch.setitem(registry.metrics, name, registry.metrics.get(name))
+    return NotificationOutbox(db_path=str(tmp_path / "arlo.db"), max_attempts=3, retry_base=2, retry_max=5)
+
+
+def rows(outbox):
+    with sqlite3.connect(outbox.db_path) as conn:
+        return conn.execute("SELECT destination, state, attempts, next_attempt, last_error "
+                            "FROM notification_outbox ORDER BY id").fetchall()
+
+
+def deliver_due(outbox):
+    outbox._dispatch_due()
+    outbox.executor.shutdown(wait=True)
+
+
+def test_delivered_notification_is_removed(outbox):
+    sent = []
+    outbox.register('ntfy', lambda payload, attempt: sent.append((payload, attempt)))
+    outbox.enqueue('ntfy', {"title": "Motion"})
+    assert outbox.depths() == {('ntfy',): 1}
+    deliver_due(outbox)
+    assert sent == [({"title": "Motion"}, 1)]
+    assert rows(outbox) == []
+    assert outbox.depths() == {}
+
+
+def test_failed_delivery_is_rescheduled_with_backoff(outbox, monkeypatch):
+    def down(payload, attempt):
+        raise ConnectionError("connection refused")
+    outbox.register('webhook', down)
+    outbox.enqueue('webhook', {"hash": "x"})
+    before = time.time()
+    deliver_due(outbox)
+    [(destination, state, attempts, next_attempt, error)] = rows(outbox)
+    assert (state, attempts, error) == ('pending', 1, "connection refused")
+    # retry_base with up to 50% jitter taken off
+    assert before + 1 <= next_attempt <= time.time() + 2
+
+
+def test_backoff_doubles_up_to_the_cap(outbox, monkeypatch):
+    monkeypatch.setattr(helpers.notification_outbox.random, "uniform", lambda a, b: 1.0)
+    outbox.max_attempts = 10
+    outbox.enqueue('ntfy', {})
+    delays = []
+    for attempts in range(1, 5):
+        now = time.time()
+        monkeypatch.setattr(helpers.notification_outbox.time, "time", lambda: now)
+        outbox._failed(1, 'ntfy', attempts, "timeout")
+        delays.append(rows(outbox)[0][3] - now)
+    assert delays == [2, 4, 5, 5]
+
+
+def test_gives_up_after_max_attempts(outbox):
+    attempts_seen = []
+
+    def down(payload, attempt):
+        attempts_seen.append(attempt)
+        raise ConnectionError("down")
+    outbox.register('ntfy', down)
+    outbox.enqueue('ntfy', {})
+    with sqlite3.connect(outbox.db_path) as conn:
+        conn.execute("UPDATE notification_outbox SET attempts = 2")
+    deliver_due(outbox)
+    assert attempts_seen == [3]
+    assert rows(outbox)[0][1:3] == ('failed', 3)
+    assert outbox.depths() == {}
+
+
+def test_missing_sender_is_a_failure(outbox):
+    outbox.enqueue('nowhere', {})
+    deliver_due(outbox)
+    assert "No sender registered" in rows(outbox)[0][4]
+
+
+def test_start_requeues_interrupted_rows(outbox, monkeypatch):
+    monkeypatch.setattr(helpers.notification_outbox.threading.Thread, "start", lambda self: None)
+    outbox.enqueue('ntfy', {})
+    outbox.enqueue('ntfy', {})
+    with sqlite3.connect(outbox.db_path) as conn:
+        conn.execute("UPDATE notification_outbox SET state = 'sending' WHERE id = 1")
+        conn.execute("UPDATE notification_outbox SET state = 'failed', created = 0 WHERE id = 2")
+    outbox.start()
+    assert [row[1] for row in rows(outbox)] == ['pending']
@@ -0,0 +1,88 @@
+import pytest
+
+import helpers.notification_policy
+from helpers.notification_policy import NotificationPolicy, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(helpers.notification_policy.time, "time", lambda: now[0])
+    return now
+
+
+def make_policy(tmp_path, **config):
+    config = {"NotifyCameraBurst": 2, "NotifyCameraPerHour": 60, "NotifyTopicBurst": 3,
+              "NotifyTopicPerHour": 3600, "NotifyDigestWindow": 600, **config}
+    digests = []
+    policy = NotificationPolicy(config, lambda serial, digest: digests.append((serial, digest)),
+                                db_path=str(tmp_path / "arlo.db"))
+    return policy, digests
+
+
+def test_token_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(3, 0.5, tokens=0, updated=100)
+    bucket.refill(102)
+    assert bucket.tokens == 1
+    bucket.refill(1000)
+    assert bucket.tokens == 3
+
+
+def test_token_bucket_ignores_clock_stepping_back():
+    bucket = TokenBucket(3, 1, tokens=1, updated=100)
+    bucket.refill(50)
+    assert bucket.tokens == 1
+    assert bucket.updated == 100
+
+
+def test_camera_burst_then_digest(tmp_path, clock):
+    policy, _ = make_policy(tmp_path)
+    admitted = [policy.admit("SER1", "arlo", "Front", "zone1", f"f{n}.mp4") for n in range(4)]
+    assert admitted == [True, True, False, False]
+    digest = policy.get_state()["digests"]["SER1"]
+    assert digest["count"] == 2
+    assert digest["file_name"] == "f3.mp4"
+    assert digest["zones"] == ["zone1"]
+
+    # A token is back after a minute, but the open digest keeps collecting
+    clock[0] += 60
+    assert not policy.admit("SER1", "arlo", "Front", None, "f4.mp4")
+
+
+def test_topic_bucket_is_shared_by_cameras(tmp_path, clock):
+    policy, _ = make_policy(tmp_path)
+    assert policy.admit("SER1", "arlo", "Front", None, "a.mp4")
+    assert policy.admit("SER1", "arlo", "Front", None, "b.mp4")
+    assert policy.admit("SER2", "arlo", "Back", None, "c.mp4")
+    assert not policy.admit("SER2", "arlo", "Back", None, "d.mp4")
+    # Another topic has its own bucket
+    assert policy.admit("SER3", "other", "Side", None, "e.mp4")
+
+
+def test_limits_survive_restart(tmp_path, clock):
+    policy, _ = make_policy(tmp_path)
+    for n in range(3):
+        policy.admit("SER1", "arlo", "Front", None, f"f{n}.mp4")
+    restarted, _ = make_policy(tmp_path)
+    assert restarted.get_state()["buckets"]["camera:SER1"] == 0
+    assert restarted.get_state()["digests"]["SER1"]["count"] == 1
+    assert not restarted.admit("SER1", "arlo", "Front", None, "f3.mp4")
+
+
+def test_disabled_policy_admits_everything(tmp_path, clock):
+    policy, _ = make_policy(tmp_path, NotifyRateLimitEnabled=False)
+    assert all(policy.admit("SER1", "arlo", "Front", None, "f.mp4") for _ in range(10))
+
+
+def test_digest_is_sent_when_its_window_closes(tmp_path):
+    policy, digests = make_policy(tmp_path, NotifyCameraBurst=1, NotifyDigestWindow=0.05)
+    policy.start()
+    for n in range(3):
+        policy.admit("SER1", "arlo", "Front", None, f"f{n}.mp4")
+    deadline = helpers.notification_policy.time.time() + 5
+    while not digests and helpers.notification_policy.time.time() < deadline:
+        helpers.notification_policy.time.sleep(0.01)
+    [(serial, digest)] = digests
+    assert serial == "SER1"
+    assert digest["count"] == 2
+    assert policy.get_state()["digests"] == {}
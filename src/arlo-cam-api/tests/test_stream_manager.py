@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+import helpers.stream_manager as stream_manager
+from helpers.hls_playlist import HlsPlaylist
+from helpers.stream_manager import StreamManager, EXIT_SOURCE_LOST
+
+
+class FakeProcess:
+    def __init__(self, returncode):
+        self.returncode = returncode
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        pass
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(stream_manager, "STREAM_BASE_DIR", str(tmp_path))
+    manager = StreamManager("SER1", "172.14.0.100")
+    manager.lease_deadline = time.time() + 600
+    return manager
+
+
+def supervise(manager, monkeypatch, returncodes):
+    """Run the supervisor over helpers exiting with returncodes, return the backoff delays"""
+    delays = []
+    monkeypatch.setattr(stream_manager.time, "sleep", delays.append)
+    remaining = list(returncodes)
+
+    def launch(duration):
+        manager.gst_process = FakeProcess(remaining.pop(0))
+    manager.gst_process = FakeProcess(remaining.pop(0))
+    monkeypatch.setattr(manager, "_launch", launch)
+    manager._supervise()
+    return delays
+
+
+def test_backoff_doubles_up_to_max_then_gives_up(manager, monkeypatch):
+    delays = supervise(manager, monkeypatch, [EXIT_SOURCE_LOST] * 7)
+    assert delays == [1.0, 2.0, 4.0, 8.0, 8.0]
+    assert manager.reconnect_count == stream_manager.RECONNECT_MAX_ATTEMPTS
+    assert manager.epoch == stream_manager.RECONNECT_MAX_ATTEMPTS
+
+
+def test_clean_exit_is_not_reconnected(manager, monkeypatch):
+    delays = supervise(manager, monkeypatch, [EXIT_SOURCE_LOST, 0])
+    assert delays == [1.0]
+    assert manager.reconnect_count == 1
+
+
+def test_stable_stream_resets_attempts(manager, monkeypatch):
+    monkeypatch.setattr(stream_manager, "RECONNECT_STABLE_AFTER", 0)
+    delays = supervise(manager, monkeypatch, [EXIT_SOURCE_LOST] * 4 + [0])
+    assert delays == [1.0] * 4
+
+
+def test_no_reconnect_after_lease(manager, monkeypatch):
+    manager.lease_deadline = time.time()
+    delays = supervise(manager, monkeypatch, [EXIT_SOURCE_LOST, 0])
+    assert delays == [1.0]
+    assert manager.reconnect_count == 0
+
+
+def test_source_loss_is_reported(manager, monkeypatch):
+    lost = []
+    manager.on_source_lost = lost.append
+    supervise(manager, monkeypatch, [EXIT_SOURCE_LOST, EXIT_SOURCE_LOST, 0])
+    assert lost == ["SER1", "SER1"]
+
+
+def test_renew_extends_lease_and_rewrites_lease_file(manager, tmp_path):
+    (tmp_path / "SER1").mkdir()
+    manager.lease_deadline = time.time() + 5
+    assert manager.renew(60)
+    try:
+        assert manager.lease_deadline > time.time() + 55
+        assert float((tmp_path / "SER1" / ".lease").read_text()) == manager.lease_deadline
+    finally:
+        manager.cleanup_timer.cancel()
+    manager.stopped = True
+    assert not manager.renew(60)
+
+
+def test_export_copies_only_the_segment_byte_range(manager, tmp_path, monkeypatch):
+    stream_dir = tmp_path / "SER1"
+    stream_dir.mkdir()
+    # A reused ring slot: new segment followed by the tail of an older one
+    (stream_dir / "ring000.ts").write_bytes(b"N" * 10 + b"O" * 20)
+    playlist = HlsPlaylist(manager.playlist_path)
+    playlist.add_segment("ring000.ts?seq=7", 2.0, time.time(), 10)
+    playlist.write()
+    monkeypatch.setattr(stream_manager, "RECORDING_BASE_PATH", f"{tmp_path}/")
+
+    copied = []
+
+    class Result:
+        returncode = 0
+        stderr = b""
+
+    def run(cmd, **kwargs):
+        list_path = cmd[cmd.index('-i') + 1]
+        with open(list_path) as segment_list:
+            for line in segment_list:
+                with open(line.strip()[len("file '"):-1], 'rb') as f:
+                    copied.append(f.read())
+        return Result()
+    monkeypatch.setattr(stream_manager.subprocess, "run", run)
+
+    path = manager.export_range()
+    assert path.startswith(f"{tmp_path}/arlo-SER1-")
+    assert copied == [b"N" * 10]
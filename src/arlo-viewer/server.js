@@ -104,9 +104,22 @@ app.use(express.static('public'));
 app.use(express.json());
 
 // Proxy for camera status API (Flask runs on port 5000)
+// Passes ETag/If-None-Match through so unchanged polls are a bodiless 304
 app.get('/api/cameras/status', (req, res) => {
     const http = require('http');
-    http.get('http://localhost:5000/cameras/status', (apiRes) => {
+    const headers = {};
+    if (req.headers['if-none-match']) {
+        headers['If-None-Match'] = req.headers['if-none-match'];
+    }
+    http.get('http://localhost:5000/cameras/status', { headers }, (apiRes) => {
+        if (apiRes.headers.etag) {
+            res.setHeader('ETag', apiRes.headers.etag);
+        }
+        res.setHeader('Cache-Control', 'no-cache');
+        if (apiRes.statusCode === 304) {
+            apiRes.resume();
+            return res.status(304).end();
+        }
         let data = '';
         apiRes.on('data', (chunk) => data += chunk);
         apiRes.on('end', () => {
@@ -473,6 +486,70 @@ app.post('/api/camera/:serial/stream/stop', (req, res) => {
     proxyReq.end();
 });
 
+// Proxy for stream lease renewal (the stream stops when the lease runs out)
+app.post('/api/camera/:serial/stream/renew', (req, res) => {
+    const http = require('http');
+    const serial = req.params.serial;
+
+    const options = {
+        hostname: 'localhost',
+        port: 5000,
+        path: `/camera/${serial}/stream/renew`,
+        method: 'POST'
+    };
+
+    const proxyReq = http.request(options, (apiRes) => {
+        let data = '';
+        apiRes.on('data', (chunk) => data += chunk);
+        apiRes.on('end', () => {
+            res.status(apiRes.statusCode);
+            res.setHeader('Content-Type', 'application/json');
+            res.send(data);
+        });
+    });
+
+    proxyReq.on('error', (err) => {
+        res.status(500).json({ error: 'Failed to renew stream' });
+    });
+
+    proxyReq.end();
+});
+
+// Proxy for saving the live DVR window (or a start/end range of it) as a recording
+app.post('/api/camera/:serial/stream/export', (req, res) => {
+    const http = require('http');
+    const serial = req.params.serial;
+    const body = JSON.stringify(req.body || {});
+
+    const options = {
+        hostname: 'localhost',
+        port: 5000,
+        path: `/camera/${serial}/stream/export`,
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Content-Length': Buffer.byteLength(body)
+        }
+    };
+
+    const proxyReq = http.request(options, (apiRes) => {
+        let data = '';
+        apiRes.on('data', (chunk) => data += chunk);
+        apiRes.on('end', () => {
+            res.status(apiRes.statusCode);
+            res.setHeader('Content-Type', 'application/json');
+            res.send(data);
+        });
+    });
+
+    proxyReq.on('error', (err) => {
+        res.status(500).json({ error: 'Failed to export stream' });
+    });
+
+    proxyReq.write(body);
+    proxyReq.end();
+});
+
 // Proxy for stream status API
 app.get('/api/camera/:serial/stream/status', (req, res) => {
     const http = require('http');
@@ -490,6 +567,40 @@ app.get('/api/camera/:serial/stream/status', (req, res) => {
     });
 });
 
+// Proxy for the Server-Sent Events stream (motion, recordings, status, streams)
+app.get('/api/events', (req, res) => {
+    const http = require('http');
+    const headers = {};
+    if (req.headers['last-event-id']) {
+        headers['Last-Event-ID'] = req.headers['last-event-id'];
+    }
+
+    const proxyReq = http.get({
+        hostname: 'localhost',
+        port: 5000,
+        path: '/events',
+        headers
+    }, (apiRes) => {
+        res.writeHead(apiRes.statusCode, {
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive'
+        });
+        apiRes.pipe(res);
+    });
+
+    proxyReq.on('error', (err) => {
+        if (!res.headersSent) {
+            res.status(500).json({ error: 'Failed to connect to event stream' });
+        } else {
+            res.end();
+        }
+    });
+
+    // Viewer went away - drop the upstream subscription too
+    req.on('close', () => proxyReq.destroy());
+});
+
 // Serve HLS files (.m3u8 playlists and .ts segments)
 app.get('/api/stream/:serial/:file', (req, res) => {
     const serial = req.params.serial;
@@ -521,6 +632,28 @@ app.get('/api/stream/:serial/:file', (req, res) => {
     res.setHeader('Content-Type', contentType);
     res.setHeader('Cache-Control', 'no-cache');
 
+    // Ring segments are reused slots - the playlist gives each one as a
+    // byte range, and whatever follows it is left over from an earlier lap
+    const range = req.headers.range;
+    if (range && file.endsWith('.ts')) {
+        const fileSize = fs.statSync(filePath).size;
+        const parts = range.replace(/bytes=/, "").split("-");
+        let start = parseInt(parts[0], 10);
+        let end = parts[1] ? parseInt(parts[1], 10) : fileSize - 1;
+
+        if (isNaN(start) || start < 0) start = 0;
+        if (isNaN(end) || end >= fileSize) end = fileSize - 1;
+        if (start > end) start = end;
+
+        res.writeHead(206, {
+            'Content-Range': `bytes ${start}-${end}/${fileSize}`,
+            'Accept-Ranges': 'bytes',
+            'Content-Length': (end - start) + 1
+        });
+        fs.createReadStream(filePath, { start, end }).pipe(res);
+        return;
+    }
+
     // Stream the file
     fs.createReadStream(filePath).pipe(res);
 });